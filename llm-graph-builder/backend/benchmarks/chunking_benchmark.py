@@ -0,0 +1,78 @@
+"""
+Compare the token chunker used by CreateChunksofDocument with langchain's TokenTextSplitter.
+
+Run from the backend directory:
+    python -m benchmarks.chunking_benchmark path/to/corpus.txt [--pages 100] [--chunk-size 200] [--chunk-overlap 20]
+
+Without a file a synthetic corpus of --size-mb megabytes is generated. The corpus is cut into --pages pages
+of equal size, both chunkers split every page and the wall time, throughput and chunk counts are printed.
+"""
+import argparse
+import random
+import time
+from langchain_text_splitters import TokenTextSplitter
+from src.shared.token_chunker import get_token_chunker
+
+WORDS = ("graph", "knowledge", "entity", "relationship", "chunk", "document", "embedding", "neo4j", "pesquisa",
+         "periódico", "análise", "capítulo", "resultados", "1999", "2024", "—", "données", "数据", "🙂")
+
+
+def synthetic_corpus(size_mb: float, seed: int = 0):
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    parts = []
+    length = 0
+    while length < target:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 25))) + ". "
+        if rng.random() < 0.1:
+            sentence += "\n\n"
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+def split_into_pages(text: str, pages: int):
+    page_size = max(1, len(text) // pages)
+    return [text[i:i + page_size] for i in range(0, len(text), page_size)]
+
+def run(name, split_page, pages):
+    start = time.perf_counter()
+    chunk_count = 0
+    for page in pages:
+        chunk_count += len(split_page(page))
+    elapsed = time.perf_counter() - start
+    size_mb = sum(len(page.encode("utf-8")) for page in pages) / (1024 * 1024)
+    print(f"{name:<20} {elapsed:8.2f} s  {size_mb / elapsed:8.2f} MB/s  {chunk_count} chunks")
+    return chunk_count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", nargs="?", help="text file to chunk, a synthetic corpus is used when omitted")
+    parser.add_argument("--size-mb", type=float, default=10, help="size of the synthetic corpus")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--chunk-overlap", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8", errors="replace") as corpus_file:
+            text = corpus_file.read()
+    else:
+        text = synthetic_corpus(args.size_mb)
+    pages = split_into_pages(text, args.pages)
+
+    start = time.perf_counter()
+    token_chunker = get_token_chunker(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    print(f"token chunker setup {time.perf_counter() - start:.2f} s (once per process)")
+
+    def split_with_text_splitter(page):
+        # a new splitter per call, as CreateChunksofDocument did before
+        return TokenTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap).split_text(page)
+
+    baseline_chunks = run("TokenTextSplitter", split_with_text_splitter, pages)
+    chunker_chunks = run("TokenChunker", token_chunker.split_text_with_offsets, pages)
+    if baseline_chunks != chunker_chunks:
+        print(f"chunk counts differ by {abs(baseline_chunks - chunker_chunks)}")
+
+
+if __name__ == "__main__":
+    main()
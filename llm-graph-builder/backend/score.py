@@ -1,3 +1,5 @@
+from src.shared.import_profile import start_import_profile, stop_import_profile
+start_import_profile()
 from fastapi import FastAPI, File, UploadFile, Form, Request
 from fastapi_health import health
 from fastapi.middleware.cors import CORSMiddleware
@@ -9,7 +11,6 @@ import uvicorn
 import asyncio
 import base64
 from langserve import add_routes
-from langchain_google_vertexai import ChatVertexAI
 from src.api_response import create_api_response
 from src.graphDB_dataAccess import graphDBdataAccess
 from src.graph_query import get_graph_results,get_chunktext_results
@@ -18,6 +19,9 @@ from src.post_processing import create_vector_fulltext_indexes, create_entity_em
 from sse_starlette.sse import EventSourceResponse
 from src.communities import create_communities
 from src.neighbours import get_neighbour_nodes
+from src.shared.driver_registry import driver_registry
+from src.shared.status_event_bus import status_event_bus
+from src.job_queue import get_job_queue, JOB_STATUS_QUEUED
 import json
 from typing import List, Mapping, Union
 from starlette.middleware.sessions import SessionMiddleware
@@ -28,6 +32,7 @@ from src.logger import CustomLogger
 from datetime import datetime, timezone
 import time
 import gc
+import uuid
 from Secweb import SecWeb
 from Secweb.StrictTransportSecurity import HSTS
 from Secweb.ContentSecurityPolicy import ContentSecurityPolicy
@@ -37,6 +42,7 @@ from fastapi.middleware.gzip import GZipMiddleware
 from src.ragas_eval import *
 from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import gzip
+stop_import_profile()
 
 logger = CustomLogger()
 CHUNK_DIR = os.path.join(os.path.dirname(__file__), "chunks")
@@ -95,12 +101,26 @@ app.add_middleware(
 
 is_gemini_enabled = os.environ.get("GEMINI_ENABLED", "False").lower() in ("true", "1", "yes")
 if is_gemini_enabled:
+    from langchain_google_vertexai import ChatVertexAI
     add_routes(app,ChatVertexAI(), path="/vertexai")
 
 app.add_api_route("/health", health([healthy_condition, healthy]))
 
 app.add_middleware(SessionMiddleware, secret_key=os.urandom(24))
 
+@app.on_event("startup")
+async def start_extract_job_workers():
+    job_queue = get_job_queue()
+    if job_queue is not None:
+        job_queue.start(run_extract_job, int(os.environ.get('EXTRACT_JOB_WORKERS', '2')))
+
+@app.on_event("shutdown")
+async def close_neo4j_drivers():
+    job_queue = get_job_queue()
+    if job_queue is not None:
+        await job_queue.stop()
+    driver_registry.close_all()
+
 
 @app.post("/url/scan")
 async def create_source_knowledge_graph_url(
@@ -137,7 +157,7 @@ async def create_source_knowledge_graph_url(
             lst_file_name,success_count,failed_count = await asyncio.to_thread(create_source_node_graph_url_s3,graph, model, source_url, aws_access_key_id, aws_secret_access_key, source_type
             )
         elif source_type == 'gcs bucket':
-            lst_file_name,success_count,failed_count = create_source_node_graph_url_gcs(graph, model, gcs_project_id, gcs_bucket_name, gcs_bucket_folder, source_type,Credentials(access_token)
+            lst_file_name,success_count,failed_count = await asyncio.to_thread(create_source_node_graph_url_gcs,graph, model, gcs_project_id, gcs_bucket_name, gcs_bucket_folder, source_type,Credentials(access_token)
             )
         elif source_type == 'web-url':
             lst_file_name,success_count,failed_count = await asyncio.to_thread(create_source_node_graph_web_url,graph, model, source_url, source_type
@@ -206,6 +226,24 @@ async def extract_knowledge_graph_from_file(
     Returns:
           Nodes and Relations created in Neo4j databse for the pdf file
     """
+    extract_params = {'uri':uri, 'userName':userName, 'password':password, 'model':model, 'database':database, 'source_url':source_url,
+                      'aws_access_key_id':aws_access_key_id, 'aws_secret_access_key':aws_secret_access_key, 'wiki_query':wiki_query,
+                      'gcs_project_id':gcs_project_id, 'gcs_bucket_name':gcs_bucket_name, 'gcs_bucket_folder':gcs_bucket_folder,
+                      'gcs_blob_filename':gcs_blob_filename, 'source_type':source_type, 'file_name':file_name, 'allowedNodes':allowedNodes,
+                      'allowedRelationship':allowedRelationship, 'language':language, 'access_token':access_token, 'retry_condition':retry_condition}
+    job_queue = get_job_queue()
+    if job_queue is not None:
+        job_id = await asyncio.to_thread(job_queue.submit, extract_params, file_name)
+        return create_api_response('Success', data={'job_id':job_id, 'status':JOB_STATUS_QUEUED, 'fileName':file_name}, file_source=source_type)
+    return await extract_source(**extract_params)
+
+async def extract_source(uri, userName, password, model, database, source_url=None, aws_access_key_id=None, aws_secret_access_key=None,
+                         wiki_query=None, gcs_project_id=None, gcs_bucket_name=None, gcs_bucket_folder=None, gcs_blob_filename=None,
+                         source_type=None, file_name=None, allowedNodes=None, allowedRelationship=None, language=None, access_token=None,
+                         retry_condition=None):
+    """
+    Extract the knowledge graph of one source, called by /extract directly or by the extraction job workers.
+    """
     try:
         start_time = time.time()
         payload_json_obj = {'api_name':'extract', 'db_url':uri, 'userName':userName, 'database':database, 'source_url':source_url, 'aws_access_key_id':aws_access_key_id,
@@ -271,6 +309,115 @@ async def extract_knowledge_graph_from_file(
     finally:
         gc.collect()
 
+async def run_extract_job(extract_params, attempt):
+    """
+    Job queue handler for /extract. A job claimed again after its worker died resumes from the processed_chunk
+    of the Document node when chunks were processed and all chunks were written, otherwise it starts over.
+    """
+    if attempt > 1:
+        graph = create_graph_database_connection(extract_params['uri'], extract_params['userName'], extract_params['password'], extract_params['database'])
+        result = graphDBdataAccess(graph).get_current_status_document_node(extract_params['file_name'])
+        # chunking_completed is unset for documents chunked before it was recorded, their chunks were written at once
+        if len(result) > 0 and result[0]['processed_chunk'] and result[0]['chunking_completed'] is not False:
+            extract_params['retry_condition'] = START_FROM_LAST_PROCESSED_POSITION
+        logging.info(f"Resuming extraction of {extract_params['file_name']} with retry condition {extract_params['retry_condition']}")
+        set_status_retry(graph, extract_params['file_name'], extract_params['retry_condition'])
+    return await extract_source(**extract_params)
+
+@app.get("/extract_job/{job_id}")
+async def get_extract_job(job_id):
+    job_queue = get_job_queue()
+    if job_queue is None:
+        return create_api_response('Failed', message='Extraction job queue is not enabled')
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        return create_api_response('Failed', message=f'Job {job_id} not found')
+    return create_api_response('Success', data=job)
+
+@app.get("/bulk_extract/{batch_id}")
+async def get_bulk_extract_status(batch_id):
+    """Status of the files queued by one /bulk_extract call and their aggregate throughput: files, bytes, files/s and MB/s."""
+    job_queue = get_job_queue()
+    if job_queue is None:
+        return create_api_response('Failed', message='Extraction job queue is not enabled')
+    summary = await asyncio.to_thread(job_queue.get_batch_summary, batch_id)
+    if summary is None:
+        return create_api_response('Failed', message=f'Bulk extraction {batch_id} not found')
+    return create_api_response('Success', data=summary)
+
+@app.post("/bulk_extract")
+async def bulk_extract(
+    uri=Form(),
+    userName=Form(),
+    password=Form(),
+    database=Form(),
+    model=Form(),
+    source_type=Form(),
+    source_url=Form(None),
+    aws_access_key_id=Form(None),
+    aws_secret_access_key=Form(None),
+    gcs_project_id=Form(None),
+    gcs_bucket_name=Form(None),
+    gcs_bucket_folder=Form(None),
+    access_token=Form(None),
+    allowedNodes=Form(None),
+    allowedRelationship=Form(None)
+):
+    """
+    Scan an S3 prefix or a GCS folder and extract every PDF file in it in one call.
+
+    Source nodes are created like /url/scan does, then the files are downloaded, parsed and extracted
+    concurrently as one job per file on the extraction job queue, so a large bucket never runs inside the request
+    and its worker timeout. The call is rejected when the job queue is not enabled. The response has the job of
+    every file and the batch_id whose progress and aggregate throughput /bulk_extract/{batch_id} reports.
+    """
+    try:
+        start = time.time()
+        job_queue = get_job_queue()
+        if job_queue is None:
+            return create_api_response('Failed', message='Bulk extraction needs the extraction job queue, set ENABLE_EXTRACT_JOB_QUEUE', file_source=source_type)
+        payload_json_obj = {'api_name':'bulk_extract', 'db_url':uri, 'userName':userName, 'database':database, 'source_url':source_url, 'aws_access_key_id':aws_access_key_id,
+                            'model':model, 'gcs_bucket_name':gcs_bucket_name, 'gcs_bucket_folder':gcs_bucket_folder, 'source_type':source_type,
+                            'gcs_project_id':gcs_project_id, 'logging_time': formatted_time(datetime.now(timezone.utc))}
+        logger.log_struct(payload_json_obj, "INFO")
+        graph = create_graph_database_connection(uri, userName, password, database)
+        common_params = {'uri':uri, 'userName':userName, 'password':password, 'model':model, 'database':database, 'source_type':source_type,
+                         'allowedNodes':allowedNodes, 'allowedRelationship':allowedRelationship}
+        if source_type == 's3 bucket' and source_url and aws_access_key_id and aws_secret_access_key:
+            lst_file_name,success_count,failed_count = await asyncio.to_thread(create_source_node_graph_url_s3, graph, model, source_url, aws_access_key_id, aws_secret_access_key, source_type)
+            extract_params_list = [{**common_params, 'source_url':file['url'], 'aws_access_key_id':aws_access_key_id, 'aws_secret_access_key':aws_secret_access_key,
+                                    'file_name':file['fileName']} for file in lst_file_name if file['status'] == 'Success']
+        elif source_type == 'gcs bucket' and gcs_bucket_name:
+            lst_file_name,success_count,failed_count = await asyncio.to_thread(create_source_node_graph_url_gcs, graph, model, gcs_project_id, gcs_bucket_name, gcs_bucket_folder, source_type, Credentials(access_token))
+            extract_params_list = [{**common_params, 'gcs_project_id':gcs_project_id, 'gcs_bucket_name':gcs_bucket_name, 'gcs_bucket_folder':file['gcsBucketFolder'],
+                                    'gcs_blob_filename':file['fileName'], 'access_token':access_token, 'file_name':file['fileName']}
+                                   for file in lst_file_name if file['status'] == 'Success']
+        else:
+            return create_api_response('Failed',message='source_type is other than accepted source')
+
+        file_sizes = {file['fileName']: file['fileSize'] for file in lst_file_name}
+        batch_id = uuid.uuid4().hex
+        files = []
+        for extract_params in extract_params_list:
+            file_name = extract_params['file_name']
+            job_id = await asyncio.to_thread(job_queue.submit, extract_params, file_name, batch_id, file_sizes.get(file_name))
+            files.append({'fileName':file_name, 'job_id':job_id, 'status':JOB_STATUS_QUEUED})
+        elapsed_time = time.time() - start
+        json_obj = {'api_name':'bulk_extract', 'db_url':uri, 'source_type':source_type, 'source_url':source_url, 'gcs_bucket_name':gcs_bucket_name,
+                    'logging_time': formatted_time(datetime.now(timezone.utc)), 'batch_id':batch_id, 'queued_files':len(files), 'elapsed_api_time':f'{elapsed_time:.2f}'}
+        logger.log_struct(json_obj, "INFO")
+        return create_api_response('Success', data={'batch_id':batch_id, 'files':files, 'elapsed_api_time':f'{elapsed_time:.2f}'},
+                                   success_count=len(files), failed_count=failed_count, file_source=source_type)
+    except Exception as e:
+        error_message = str(e)
+        message = f"Unable to extract the files of source type: {source_type}"
+        json_obj = {'error_message':error_message, 'status':'Failed','db_url':uri, 'source_type': source_type, 'source_url':source_url, 'gcs_bucket_name':gcs_bucket_name, 'logging_time': formatted_time(datetime.now(timezone.utc))}
+        logger.log_struct(json_obj, "ERROR")
+        logging.exception('Exception Stack trace:')
+        return create_api_response('Failed', message=message, error=error_message, file_source=source_type)
+    finally:
+        gc.collect()
+
 @app.get("/sources_list")
 async def get_source_list(uri:str, userName:str, password:str, database:str=None):
     """
@@ -345,10 +492,7 @@ async def chat_bot(uri=Form(),model=Form(None),userName=Form(), password=Form(),
         payload_json_obj = {'api_name':'chat_bot', 'db_url':uri, 'userName':userName, 'database':database, 'question':question,'document_names':document_names,
                              'session_id':session_id, 'mode':mode, 'logging_time': formatted_time(datetime.now(timezone.utc))}
         logger.log_struct(payload_json_obj, "INFO")
-        if mode == "graph":
-            graph = Neo4jGraph( url=uri,username=userName,password=password,database=database,sanitize = True, refresh_schema=True)
-        else:
-            graph = create_graph_database_connection(uri, userName, password, database)
+        graph = create_graph_database_connection(uri, userName, password, database)
 
         graph_DB_dataAccess = graphDBdataAccess(graph)
         write_access = graph_DB_dataAccess.check_account_access(database=database)
@@ -371,6 +515,55 @@ async def chat_bot(uri=Form(),model=Form(None),userName=Form(), password=Form(),
     finally:
         gc.collect()
 
+# not under the /chat_bot gzip path prefix, compressing the event stream would hold the tokens back
+@app.post("/stream_chat_bot")
+async def stream_chat_bot(request: Request, uri=Form(),model=Form(None),userName=Form(), password=Form(), database=Form(),question=Form(None), document_names=Form(None),session_id=Form(None),mode=Form(None)):
+    """
+    Server sent events variant of /chat_bot: 'token' events carry the answer text as it is generated, a
+    trailing 'info' event (or 'error' event) carries the /chat_bot response with sources, nodedetails and tokens.
+    """
+    logging.info(f"QA_RAG stream called at {datetime.now()}")
+    qa_rag_start_time = time.time()
+    try:
+        payload_json_obj = {'api_name':'stream_chat_bot', 'db_url':uri, 'userName':userName, 'database':database, 'question':question,'document_names':document_names,
+                             'session_id':session_id, 'mode':mode, 'logging_time': formatted_time(datetime.now(timezone.utc))}
+        logger.log_struct(payload_json_obj, "INFO")
+        graph = create_graph_database_connection(uri, userName, password, database)
+        graph_DB_dataAccess = graphDBdataAccess(graph)
+        write_access = await asyncio.to_thread(graph_DB_dataAccess.check_account_access, database=database)
+    except Exception as e:
+        job_status = "Failed"
+        message="Unable to get chat response"
+        error_message = str(e)
+        logging.exception(f'Exception in chat bot stream:{error_message}')
+        return create_api_response(job_status, message=message, error=error_message,data=mode)
+
+    async def generate():
+        try:
+            async for event in QA_RAG_stream(graph=graph,model=model,question=question,document_names=document_names,session_id=session_id,mode=mode,write_access=write_access):
+                if await request.is_disconnected():
+                    logging.info("Chat stream client disconnected")
+                    break
+                if event["event"] != "token":
+                    total_call_time = time.time() - qa_rag_start_time
+                    logging.info(f"Total Response time is  {total_call_time:.2f} seconds")
+                    event["data"]["info"]["response_time"] = round(total_call_time, 2)
+                    json_obj = {'api_name':'stream_chat_bot','db_url':uri,'session_id':session_id,'mode':mode, 'logging_time': formatted_time(datetime.now(timezone.utc)), 'elapsed_api_time':f'{total_call_time:.2f}'}
+                    logger.log_struct(json_obj, "INFO")
+                yield {"event": event["event"], "data": json.dumps(event["data"])}
+        except asyncio.CancelledError:
+            logging.info("Chat stream connection cancelled")
+        except Exception as e:
+            job_status = "Failed"
+            message="Unable to get chat response"
+            error_message = str(e)
+            logging.exception(f'Exception in chat bot stream:{error_message}')
+            yield {"event": "error", "data": json.dumps(create_api_response(job_status, message=message, error=error_message,data=mode))}
+        finally:
+            gc.collect()
+
+    return EventSourceResponse(generate(),ping=60)
+
 @app.post("/chunk_entities")
 async def chunk_entities(uri=Form(),userName=Form(), password=Form(), database=Form(), nodedetails=Form(None),entities=Form(),mode=Form()):
     try:
@@ -489,14 +682,14 @@ async def connect(uri=Form(), userName=Form(), password=Form(), database=Form())
 @app.post("/upload")
 async def upload_large_file_into_chunks(file:UploadFile = File(...), chunkNumber=Form(None), totalChunks=Form(None),
                                         originalname=Form(None), model=Form(None), uri=Form(), userName=Form(),
-                                        password=Form(), database=Form()):
+                                        password=Form(), database=Form(), chunkSize=Form(None)):
     try:
         start = time.time()
         payload_json_obj = {'api_name':'upload', 'db_url':uri, 'userName':userName, 'database':database, 'chunkNumber':chunkNumber,'totalChunks':totalChunks,
                             'original_file_name':originalname,'model':model, 'logging_time': formatted_time(datetime.now(timezone.utc))}
         logger.log_struct(payload_json_obj, "INFO")
         graph = create_graph_database_connection(uri, userName, password, database)
-        result = await asyncio.to_thread(upload_file, graph, model, file, chunkNumber, totalChunks, originalname, uri, CHUNK_DIR, MERGED_DIR)
+        result = await asyncio.to_thread(upload_file, graph, model, file, chunkNumber, totalChunks, originalname, uri, CHUNK_DIR, MERGED_DIR, chunkSize)
         end = time.time()
         elapsed_time = end - start
         json_obj = {'api_name':'upload','db_url':uri, 'logging_time': formatted_time(datetime.now(timezone.utc)), 'elapsed_api_time':f'{elapsed_time:.2f}'}
@@ -546,39 +739,39 @@ def decode_password(pwd):
 
 @app.get("/update_extract_status/{file_name}")
 async def update_extract_status(request:Request, file_name, url, userName, password, database):
+    decoded_password = decode_password(password)
+    uri = url
+    if " " in url:
+        uri= url.replace(" ","+")
+
+    def fetch_status():
+        # get the current status of document node, used for the first event and by the shared fallback poller
+        graph = create_graph_database_connection(uri, userName, decoded_password, database)
+        graphDb_data_Access = graphDBdataAccess(graph)
+        result = graphDb_data_Access.get_current_status_document_node(file_name)
+        if len(result) == 0:
+            return None
+        return {'status':result[0]['Status'],
+                'processingTime':result[0]['processingTime'],
+                'nodeCount':result[0]['nodeCount'],
+                'relationshipCount':result[0]['relationshipCount'],
+                'model':result[0]['model'],
+                'total_chunks':result[0]['total_chunks'],
+                'fileSize':result[0]['fileSize'],
+                'processed_chunk':result[0]['processed_chunk'],
+                'fileSource':result[0]['fileSource']
+                }
+
     async def generate():
-        status = ''
-        decoded_password = decode_password(password)
-        uri = url
-        if " " in url:
-            uri= url.replace(" ","+")
-        while True:
-            try:
+        # status changes are pushed by update_source_node through the status event bus instead of polling per client
+        try:
+            async for snapshot in status_event_bus.subscribe((uri, database, file_name), fetch_status):
                 if await request.is_disconnected():
                     logging.info(" SSE Client disconnected")
                     break
-                # get the current status of document node
-
-                else:
-                    graph = create_graph_database_connection(uri, userName, decoded_password, database)
-                    graphDb_data_Access = graphDBdataAccess(graph)
-                    result = graphDb_data_Access.get_current_status_document_node(file_name)
-                    # print(f'Result of document status in SSE : {result}')
-                    if len(result) > 0:
-                        status = json.dumps({'fileName':file_name,
-                        'status':result[0]['Status'],
-                        'processingTime':result[0]['processingTime'],
-                        'nodeCount':result[0]['nodeCount'],
-                        'relationshipCount':result[0]['relationshipCount'],
-                        'model':result[0]['model'],
-                        'total_chunks':result[0]['total_chunks'],
-                        'fileSize':result[0]['fileSize'],
-                        'processed_chunk':result[0]['processed_chunk'],
-                        'fileSource':result[0]['fileSource']
-                        })
-                    yield status
-            except asyncio.CancelledError:
-                logging.info("SSE Connection cancelled")
+                yield json.dumps({'fileName':file_name, **snapshot})
+        except asyncio.CancelledError:
+            logging.info("SSE Connection cancelled")
 
     return EventSourceResponse(generate(),ping=60)
 
@@ -1,7 +1,9 @@
 import os
+import re
 import json
 import time
 import logging
+import asyncio
 
 import threading
 from concurrent.futures import ThreadPoolExecutor
@@ -15,35 +17,26 @@ from langchain_community.vectorstores.neo4j_vector import Neo4jVector
 from langchain_community.chat_message_histories import Neo4jChatMessageHistory
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnableBranch
+from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnableParallel
 from langchain.retrievers import ContextualCompressionRetriever
 from langchain_community.document_transformers import EmbeddingsRedundantFilter
-from langchain.retrievers.document_compressors import EmbeddingsFilter, DocumentCompressorPipeline
-from langchain_text_splitters import TokenTextSplitter
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain.chains import GraphCypherQAChain
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.callbacks import StdOutCallbackHandler, BaseCallbackHandler
 
-# LangChain chat models
-from langchain_openai import ChatOpenAI, AzureChatOpenAI
-from langchain_google_vertexai import ChatVertexAI
-from langchain_groq import ChatGroq
-from langchain_anthropic import ChatAnthropic
-from langchain_fireworks import ChatFireworks
-from langchain_aws import ChatBedrock
-from langchain_community.chat_models import ChatOllama
-
 # Local imports
-from src.llm import get_llm
+from src.llm import get_llm, is_llm_instance
 from src.shared.common_fn import load_embedding_model
+from src.shared.chat_cache import chat_chain_cache
+from src.shared.answer_cache import get_answer_cache, get_documents_version, normalize_embedding
+from src.shared.stored_embeddings_filter import StoredEmbeddingsFilter
 from src.shared.constants import *
 from src.graphDB_dataAccess import graphDBdataAccess
 from src.ragas_eval import get_ragas_metrics
 load_dotenv()
 
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL')
-EMBEDDING_FUNCTION , _ = load_embedding_model(EMBEDDING_MODEL)
 
 class SessionChatHistory:
     history_dict = {}
@@ -78,27 +71,31 @@ def get_history_by_session_id(session_id):
 
 def get_total_tokens(ai_response, llm):
     try:
-        if isinstance(llm, (ChatOpenAI, AzureChatOpenAI, ChatFireworks, ChatGroq)):
+        if is_llm_instance(llm, "langchain_openai", ("ChatOpenAI", "AzureChatOpenAI")) or is_llm_instance(llm, "langchain_fireworks", ("ChatFireworks",)) or is_llm_instance(llm, "langchain_groq", ("ChatGroq",)):
             total_tokens = ai_response.response_metadata.get('token_usage', {}).get('total_tokens', 0)
 
-        elif isinstance(llm, ChatVertexAI):
+        elif is_llm_instance(llm, "langchain_google_vertexai", ("ChatVertexAI",)):
             total_tokens = ai_response.response_metadata.get('usage_metadata', {}).get('prompt_token_count', 0)
 
-        elif isinstance(llm, ChatBedrock):
+        elif is_llm_instance(llm, "langchain_aws", ("ChatBedrock",)):
             total_tokens = ai_response.response_metadata.get('usage', {}).get('total_tokens', 0)
 
-        elif isinstance(llm, ChatAnthropic):
+        elif is_llm_instance(llm, "langchain_anthropic", ("ChatAnthropic",)):
             input_tokens = int(ai_response.response_metadata.get('usage', {}).get('input_tokens', 0))
             output_tokens = int(ai_response.response_metadata.get('usage', {}).get('output_tokens', 0))
             total_tokens = input_tokens + output_tokens
 
-        elif isinstance(llm, ChatOllama):
+        elif is_llm_instance(llm, "langchain_community.chat_models", ("ChatOllama",)):
             total_tokens = ai_response.response_metadata.get("prompt_eval_count", 0)
 
         else:
             logging.warning(f"Unrecognized language model: {type(llm)}. Returning 0 tokens.")
             total_tokens = 0
 
+        # streamed responses carry the usage in usage_metadata instead of response_metadata
+        if not total_tokens and getattr(ai_response, "usage_metadata", None):
+            total_tokens = ai_response.usage_metadata.get("total_tokens", 0)
+
     except Exception as e:
         logging.error(f"Error retrieving total tokens: {e}")
         total_tokens = 0
@@ -219,6 +216,27 @@ def format_documents(documents, model):
 
     return "\n\n".join(formatted_docs), sources,entities,global_communities
 
+def get_response_details(docs, sources, entitydetails, communities, chat_mode_settings):
+    """Sources, nodedetails and entities of the answer, depending on the chat mode."""
+    result = {'sources': list(), 'nodedetails': dict(), 'entities': dict()}
+    node_details = {"chunkdetails":list(),"entitydetails":list(),"communitydetails":list()}
+    entities = {'entityids':list(),"relationshipids":list()}
+
+    if chat_mode_settings["mode"] == CHAT_ENTITY_VECTOR_MODE:
+        node_details["entitydetails"] = entitydetails
+
+    elif chat_mode_settings["mode"] == CHAT_GLOBAL_VECTOR_FULLTEXT_MODE:
+        node_details["communitydetails"] = communities
+    else:
+        sources_and_chunks = get_sources_and_chunks(sources, docs)
+        result['sources'] = sources_and_chunks['sources']
+        node_details["chunkdetails"] = sources_and_chunks["chunkdetails"]
+        entities.update(entitydetails)
+
+    result["nodedetails"] = node_details
+    result["entities"] = entities
+    return result
+
 def process_documents(docs, question, messages, llm, model,chat_mode_settings):
     start_time = time.time()
 
@@ -233,23 +251,7 @@ def process_documents(docs, question, messages, llm, model,chat_mode_settings):
             "input": question
         })
 
-        result = {'sources': list(), 'nodedetails': dict(), 'entities': dict()}
-        node_details = {"chunkdetails":list(),"entitydetails":list(),"communitydetails":list()}
-        entities = {'entityids':list(),"relationshipids":list()}
-
-        if chat_mode_settings["mode"] == CHAT_ENTITY_VECTOR_MODE:
-            node_details["entitydetails"] = entitydetails
-
-        elif chat_mode_settings["mode"] == CHAT_GLOBAL_VECTOR_FULLTEXT_MODE:
-            node_details["communitydetails"] = communities
-        else:
-            sources_and_chunks = get_sources_and_chunks(sources, docs)
-            result['sources'] = sources_and_chunks['sources']
-            node_details["chunkdetails"] = sources_and_chunks["chunkdetails"]
-            entities.update(entitydetails)
-
-        result["nodedetails"] = node_details
-        result["entities"] = entities
+        result = get_response_details(docs, sources, entitydetails, communities, chat_mode_settings)
 
         content = ai_response.content
         total_tokens = get_total_tokens(ai_response, llm)
@@ -284,6 +286,28 @@ def retrieve_documents(doc_retriever, messages):
 
     return docs,transformed_question
 
+def is_self_contained_question(question):
+    """Cheap check that a follow-up question can be retrieved without the conversation: long enough and no references to it."""
+    words = re.findall(r"\w+", question.lower())
+    if len(words) < CHAT_SELF_CONTAINED_MIN_WORDS or CHAT_FOLLOW_UP_REFERENCE_WORDS.intersection(words):
+        return False
+    logging.info("Follow-up question is self-contained, retrieving without the question transform")
+    return True
+
+def merge_retrieved_documents(results):
+    """
+    Merge the documents retrieved for the raw and the transformed question. A document found by both (same
+    source, or same text when it has no source) is kept once, with the higher query similarity score.
+    """
+    merged = {}
+    for document in results["transformed"] + results["raw"]:
+        key = document.metadata.get("source") or document.page_content
+        kept = merged.get(key)
+        if kept is None or document.state.get("query_similarity_score", 0) > kept.state.get("query_similarity_score", 0):
+            merged[key] = document
+    logging.info(f"Merged {len(results['raw'])} raw and {len(results['transformed'])} transformed question documents into {len(merged)}")
+    return list(merged.values())
+
 def create_document_retriever_chain(llm, retriever):
     try:
         logging.info("Starting to create document retriever chain")
@@ -297,26 +321,38 @@ def create_document_retriever_chain(llm, retriever):
 
         output_parser = StrOutputParser()
 
-        splitter = TokenTextSplitter(chunk_size=CHAT_DOC_SPLIT_SIZE, chunk_overlap=0)
-        embeddings_filter = EmbeddingsFilter(
-            embeddings=EMBEDDING_FUNCTION,
+        # scores the retrieved documents with the chunk vectors returned by the retrieval query, only the question is embedded
+        embedding_function, _ = load_embedding_model(EMBEDDING_MODEL)
+        embeddings_filter = StoredEmbeddingsFilter(
+            embeddings=embedding_function,
             similarity_threshold=CHAT_EMBEDDING_FILTER_SCORE_THRESHOLD
         )
 
-        pipeline_compressor = DocumentCompressorPipeline(
-            transformers=[splitter, embeddings_filter]
-        )
-
         compression_retriever = ContextualCompressionRetriever(
-            base_compressor=pipeline_compressor, base_retriever=retriever
+            base_compressor=embeddings_filter, base_retriever=retriever
         )
 
+        # a smaller, faster model can be set for the question transform
+        transform_model = os.environ.get('CHAT_QUESTION_TRANSFORM_MODEL')
+        transform_llm = get_cached_llm(transform_model)[0] if transform_model else llm
+        transform_mode = os.environ.get('CHAT_QUESTION_TRANSFORM_MODE', CHAT_QUESTION_TRANSFORM_MODE).lower()
+
+        raw_question_retriever = RunnableLambda(lambda x: x["messages"][-1].content) | compression_retriever
+        transformed_question_retriever = query_transform_prompt | transform_llm | output_parser | compression_retriever
+        branches = [(lambda x: len(x.get("messages", [])) == 1, raw_question_retriever)]
+        if transform_mode in ("skip", "speculative"):
+            branches.append((lambda x: is_self_contained_question(x["messages"][-1].content), raw_question_retriever))
+        if transform_mode == "speculative":
+            # retrieval of the raw question doesn't wait for the transform LLM round trip
+            follow_up_retriever = RunnableParallel(
+                raw=raw_question_retriever, transformed=transformed_question_retriever
+            ) | RunnableLambda(merge_retrieved_documents)
+        else:
+            follow_up_retriever = transformed_question_retriever
+
         query_transforming_retriever_chain = RunnableBranch(
-            (
-                lambda x: len(x.get("messages", [])) == 1,
-                (lambda x: x["messages"][-1].content) | compression_retriever,
-            ),
-            query_transform_prompt | llm | output_parser | compression_retriever,
+            *branches,
+            follow_up_retriever,
         ).with_config(run_name="chat_retriever_chain")
 
         logging.info("Successfully created document retriever chain")
@@ -339,9 +375,11 @@ def initialize_neo4j_vector(graph, chat_mode_settings):
         if not retrieval_query or not index_name:
             raise ValueError("Required settings 'retrieval_query' or 'index_name' are missing.")
 
+        embedding_function, _ = load_embedding_model(EMBEDDING_MODEL)
+
         if keyword_index:
             neo_db = Neo4jVector.from_existing_graph(
-                embedding=EMBEDDING_FUNCTION,
+                embedding=embedding_function,
                 index_name=index_name,
                 retrieval_query=retrieval_query,
                 graph=graph,
@@ -354,7 +392,7 @@ def initialize_neo4j_vector(graph, chat_mode_settings):
             logging.info(f"Successfully retrieved Neo4jVector Fulltext index '{index_name}' and keyword index '{keyword_index}'")
         else:
             neo_db = Neo4jVector.from_existing_graph(
-                embedding=EMBEDDING_FUNCTION,
+                embedding=embedding_function,
                 index_name=index_name,
                 retrieval_query=retrieval_query,
                 graph=graph,
@@ -391,7 +429,9 @@ def create_retriever(neo_db, document_names, chat_mode_settings,search_k, score_
 def get_neo4j_retriever(graph, document_names,chat_mode_settings, score_threshold=CHAT_SEARCH_KWARG_SCORE_THRESHOLD):
     try:
 
-        neo_db = initialize_neo4j_vector(graph, chat_mode_settings)
+        neo_db = chat_chain_cache.vector_stores.get_or_create(
+            (graph, chat_mode_settings["mode"]), lambda: initialize_neo4j_vector(graph, chat_mode_settings)
+        )
         # document_names= list(map(str.strip, json.loads(document_names)))
         search_k = chat_mode_settings["top_k"]
         retriever = create_retriever(neo_db, document_names,chat_mode_settings, search_k, score_threshold)
@@ -402,17 +442,32 @@ def get_neo4j_retriever(graph, document_names,chat_mode_settings, score_threshol
         raise Exception(f"An error occurred while retrieving the Neo4jVector index or creating the retriever. Please drop and create a new vector index '{index_name}': {e}") from e
 
 
+def get_cached_llm(model):
+    """Return (llm, model_name) from the chat cache, the client is created by get_llm on the first use of the model."""
+    return chat_chain_cache.llms.get_or_create(model, lambda: get_llm(model=model))
+
+def get_chat_model(model):
+    """Diffbot has no chat model, its chats run on DEFAULT_DIFFBOT_CHAT_MODEL."""
+    if model == "diffbot":
+        return os.getenv('DEFAULT_DIFFBOT_CHAT_MODEL')
+    return model
+
 def setup_chat(model, graph, document_names, chat_mode_settings):
     start_time = time.time()
     try:
-        if model == "diffbot":
-            model = os.getenv('DEFAULT_DIFFBOT_CHAT_MODEL')
+        model = get_chat_model(model)
 
-        llm, model_name = get_llm(model=model)
+        llm, model_name = get_cached_llm(model)
         logging.info(f"Model called in chat: {model} (version: {model_name})")
 
-        retriever = get_neo4j_retriever(graph=graph, chat_mode_settings=chat_mode_settings, document_names=document_names)
-        doc_retriever = create_document_retriever_chain(llm, retriever)
+        # the retriever only filters on the documents in the modes with a document filter
+        document_filter = tuple(sorted(document_names)) if document_names and chat_mode_settings["document_filter"] else ()
+        doc_retriever = chat_chain_cache.retriever_chains.get_or_create(
+            (graph, chat_mode_settings["mode"], model, document_filter),
+            lambda: create_document_retriever_chain(
+                llm, get_neo4j_retriever(graph=graph, chat_mode_settings=chat_mode_settings, document_names=document_names)
+            ),
+        )
 
         chat_setup_time = time.time() - start_time
         logging.info(f"Chat setup completed in {chat_setup_time:.2f} seconds")
@@ -423,8 +478,86 @@ def setup_chat(model, graph, document_names, chat_mode_settings):
 
     return llm, doc_retriever, model_name
 
+def lookup_answer_cache(answer_cache, question, model, graph, document_names, chat_mode_settings):
+    """Embed the question and look it up, returns (cached result or None, cache scope, documents version, question embedding)."""
+    lookup_start = time.time()
+    cache_scope = (graph, chat_mode_settings["mode"], model, tuple(sorted(document_names)))
+    embedding_function, _ = load_embedding_model(EMBEDDING_MODEL)
+    question_embedding = normalize_embedding(embedding_function.embed_query(question))
+    documents_version = get_documents_version(graph, document_names)
+    cached_result, similarity = answer_cache.lookup(cache_scope, documents_version, question_embedding, time.time() - lookup_start)
+    logging.info(f"Answer cache {'hit' if cached_result is not None else 'miss'}, similarity {similarity:.4f}, lookup in {time.time() - lookup_start:.2f} seconds")
+    return cached_result, cache_scope, documents_version, question_embedding
+
+def get_cached_answer_response(answer_cache, cached_result, messages, history, model):
+    """Answer from the answer cache: the cached answer is added to the history like a generated one."""
+    messages.append(AIMessage(content=cached_result["message"]))
+    llm, _ = get_cached_llm(get_chat_model(model))
+    summarization_thread = threading.Thread(target=summarize_and_log, args=(history, messages, llm))
+    summarization_thread.start()
+    # no tokens were spent on this answer
+    cached_result["info"]["total_tokens"] = 0
+    cached_result["info"]["answer_cache"] = {"hit": True, **answer_cache.get_stats()}
+    return cached_result
+
+def get_chat_response(question, content, result, formatted_docs, total_tokens, model_version, chat_mode_settings):
+    metric_details = {"question":question,"contexts":formatted_docs,"answer":content}
+    return {
+        "session_id": "",
+        "message": content,
+        "info": {
+            # "metrics" : metrics,
+            "sources": result["sources"],
+            "model": model_version,
+            "nodedetails": result["nodedetails"],
+            "total_tokens": total_tokens,
+            "response_time": 0,
+            "mode": chat_mode_settings["mode"],
+            "entities": result["entities"],
+            "metric_details": metric_details,
+        },
+
+        "user": "chatbot"
+    }
+
+def add_answer_to_cache(answer_cache, answer_cache_entry, docs, response, start_time):
+    """Cache the response when it was answered from retrieved documents and report the cache stats in it."""
+    cache_scope, documents_version, question_embedding = answer_cache_entry
+    if docs:
+        answer_cache.add(cache_scope, documents_version, question_embedding, response, time.time() - start_time)
+    response["info"]["answer_cache"] = {"hit": False, **answer_cache.get_stats()}
+
+def get_chat_error_response(e, chat_mode_settings):
+    return {
+        "session_id": "",
+        "message": "Something went wrong",
+        "info": {
+            "metrics" : [],
+            "sources": [],
+            "nodedetails": [],
+            "total_tokens": 0,
+            "response_time": 0,
+            "error": f"{type(e).__name__}: {str(e)}",
+            "mode": chat_mode_settings["mode"],
+            "entities": [],
+            "metric_details": {},
+        },
+        "user": "chatbot"
+    }
+
 def process_chat_response(messages, history, question, model, graph, document_names, chat_mode_settings):
     try:
+        start_time = time.time()
+        answer_cache = get_answer_cache()
+        # only the first question of a conversation is cached, follow-up questions depend on the history
+        use_answer_cache = answer_cache is not None and len(messages) == 1
+        if use_answer_cache:
+            cached_result, *answer_cache_entry = lookup_answer_cache(
+                answer_cache, question, model, graph, document_names, chat_mode_settings
+            )
+            if cached_result is not None:
+                return get_cached_answer_response(answer_cache, cached_result, messages, history, model)
+
         llm, doc_retriever, model_version = setup_chat(model, graph, document_names, chat_mode_settings)
 
         docs,transformed_question = retrieve_documents(doc_retriever, messages)
@@ -444,43 +577,14 @@ def process_chat_response(messages, history, question, model, graph, document_na
         summarization_thread.start()
         logging.info("Summarization thread started.")
         # summarize_and_log(history, messages, llm)
-        metric_details = {"question":question,"contexts":formatted_docs,"answer":content}
-        return {
-            "session_id": "",
-            "message": content,
-            "info": {
-                # "metrics" : metrics,
-                "sources": result["sources"],
-                "model": model_version,
-                "nodedetails": result["nodedetails"],
-                "total_tokens": total_tokens,
-                "response_time": 0,
-                "mode": chat_mode_settings["mode"],
-                "entities": result["entities"],
-                "metric_details": metric_details,
-            },
-
-            "user": "chatbot"
-        }
+        response = get_chat_response(question, content, result, formatted_docs, total_tokens, model_version, chat_mode_settings)
+        if use_answer_cache:
+            add_answer_to_cache(answer_cache, answer_cache_entry, docs, response, start_time)
+        return response
 
     except Exception as e:
         logging.exception(f"Error processing chat response at {datetime.now()}: {str(e)}")
-        return {
-            "session_id": "",
-            "message": "Something went wrong",
-            "info": {
-                "metrics" : [],
-                "sources": [],
-                "nodedetails": [],
-                "total_tokens": 0,
-                "response_time": 0,
-                "error": f"{type(e).__name__}: {str(e)}",
-                "mode": chat_mode_settings["mode"],
-                "entities": [],
-                "metric_details": {},
-            },
-            "user": "chatbot"
-        }
+        return get_chat_error_response(e, chat_mode_settings)
 
 def summarize_and_log(history, stored_messages, llm):
     logging.info("Starting summarization in a separate thread.")
@@ -522,8 +626,10 @@ def create_graph_chain(model, graph):
     try:
         logging.info(f"Graph QA Chain using LLM model: {model}")
 
-        cypher_llm,model_name = get_llm(model)
-        qa_llm,model_name = get_llm(model)
+        # the graph is shared by all requests, its schema is refreshed once per cache lifetime instead of per question
+        chat_chain_cache.graph_schemas.get_or_create(graph, graph.refresh_schema)
+        cypher_llm,model_name = get_cached_llm(model)
+        qa_llm,model_name = get_cached_llm(model)
         graph_chain = GraphCypherQAChain.from_llm(
             cypher_llm=cypher_llm,
             qa_llm=qa_llm,
@@ -645,6 +751,23 @@ def get_chat_mode_settings(mode,settings_map=CHAT_MODE_CONFIG_MAP):
 
     return chat_mode_settings
 
+def get_document_filter_response(chat_mode_settings):
+    return {
+        "session_id": "",
+        "message": "Please deselect all documents in the table before using this chat mode",
+        "info": {
+            "sources": [],
+            "model": "",
+            "nodedetails": [],
+            "total_tokens": 0,
+            "response_time": 0,
+            "mode": chat_mode_settings["mode"],
+            "entities": [],
+            "metric_details": [],
+        },
+        "user": "chatbot"
+    }
+
 def QA_RAG(graph,model, question, document_names, session_id, mode, write_access=True):
     logging.info(f"Chat Mode: {mode}")
 
@@ -660,24 +783,105 @@ def QA_RAG(graph,model, question, document_names, session_id, mode, write_access
         chat_mode_settings = get_chat_mode_settings(mode=mode)
         document_names= list(map(str.strip, json.loads(document_names)))
         if document_names and not chat_mode_settings["document_filter"]:
-            result =  {
-                "session_id": "",
-                "message": "Please deselect all documents in the table before using this chat mode",
-                "info": {
-                    "sources": [],
-                    "model": "",
-                    "nodedetails": [],
-                    "total_tokens": 0,
-                    "response_time": 0,
-                    "mode": chat_mode_settings["mode"],
-                    "entities": [],
-                    "metric_details": [],
-                },
-                "user": "chatbot"
-            }
+            result = get_document_filter_response(chat_mode_settings)
         else:
             result = process_chat_response(messages,history, question, model, graph, document_names,chat_mode_settings)
 
     result["session_id"] = session_id
 
-    return result
\ No newline at end of file
+    return result
+
+
+async def process_chat_response_stream(messages, history, question, model, graph, document_names, chat_mode_settings):
+    """
+    Streaming variant of process_chat_response: yields a token event for every chunk of the answer from
+    rag_chain.astream as soon as retrieval is done, then an info event with the same response
+    process_chat_response returns.
+    """
+    start_time = time.time()
+    try:
+        answer_cache = get_answer_cache()
+        use_answer_cache = answer_cache is not None and len(messages) == 1
+        if use_answer_cache:
+            cached_result, *answer_cache_entry = await asyncio.to_thread(
+                lookup_answer_cache, answer_cache, question, model, graph, document_names, chat_mode_settings
+            )
+            if cached_result is not None:
+                cached_result = await asyncio.to_thread(get_cached_answer_response, answer_cache, cached_result, messages, history, model)
+                yield {"event": "token", "data": cached_result["message"]}
+                yield {"event": "info", "data": cached_result}
+                return
+
+        llm, doc_retriever, model_version = await asyncio.to_thread(setup_chat, model, graph, document_names, chat_mode_settings)
+        docs, transformed_question = await asyncio.to_thread(retrieve_documents, doc_retriever, messages)
+
+        total_tokens = 0
+        if docs:
+            formatted_docs, sources, entitydetails, communities = format_documents(docs, model)
+            rag_chain = get_rag_chain(llm=llm)
+            content_parts = []
+            ai_response = None
+            async for chunk in rag_chain.astream({
+                "messages": messages[:-1],
+                "context": formatted_docs,
+                "input": question
+            }):
+                if ai_response is None:
+                    logging.info(f"First answer token after {time.time() - start_time:.2f} seconds")
+                ai_response = chunk if ai_response is None else ai_response + chunk
+                if chunk.content:
+                    content_parts.append(chunk.content)
+                    yield {"event": "token", "data": chunk.content}
+            content = "".join(content_parts)
+            result = get_response_details(docs, sources, entitydetails, communities, chat_mode_settings)
+            if ai_response is not None:
+                total_tokens = get_total_tokens(ai_response, llm)
+        else:
+            content = '{"results": []}'
+            result = {"sources": list(), "nodedetails": list(), "entities": list()}
+            formatted_docs = ""
+            yield {"event": "token", "data": content}
+
+        messages.append(AIMessage(content=content))
+        threading.Thread(target=summarize_and_log, args=(history, messages, llm)).start()
+        logging.info(f"Streamed response completed in {time.time() - start_time:.2f} seconds")
+        response = get_chat_response(question, content, result, formatted_docs, total_tokens, model_version, chat_mode_settings)
+        if use_answer_cache:
+            add_answer_to_cache(answer_cache, answer_cache_entry, docs, response, start_time)
+        yield {"event": "info", "data": response}
+
+    except Exception as e:
+        logging.exception(f"Error streaming chat response at {datetime.now()}: {str(e)}")
+        yield {"event": "error", "data": get_chat_error_response(e, chat_mode_settings)}
+
+async def stream_single_response(result):
+    yield {"event": "token", "data": result["message"]}
+    yield {"event": "info", "data": result}
+
+async def QA_RAG_stream(graph, model, question, document_names, session_id, mode, write_access=True):
+    """
+    Streaming variant of QA_RAG, an async generator of {"event", "data"} dicts: token events with the answer
+    text as it is generated, then one info event (error event on failure) with the response QA_RAG returns.
+    Graph mode answers and messages that are not generated come as a single token event.
+    """
+    logging.info(f"Chat Mode: {mode}")
+
+    history = await asyncio.to_thread(create_neo4j_chat_message_history, graph, session_id, write_access)
+    messages = await asyncio.to_thread(lambda: history.messages)
+    messages.append(HumanMessage(content=question))
+
+    if mode == CHAT_GRAPH_MODE:
+        result = await asyncio.to_thread(process_graph_response, model, graph, question, messages, history)
+        events = stream_single_response(result)
+    else:
+        chat_mode_settings = get_chat_mode_settings(mode=mode)
+        document_names = list(map(str.strip, json.loads(document_names)))
+        if document_names and not chat_mode_settings["document_filter"]:
+            events = stream_single_response(get_document_filter_response(chat_mode_settings))
+        else:
+            events = process_chat_response_stream(messages, history, question, model, graph, document_names, chat_mode_settings)
+
+    async for event in events:
+        if event["event"] != "token":
+            event["data"]["session_id"] = session_id
+        yield event
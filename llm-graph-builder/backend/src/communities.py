@@ -5,7 +5,9 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-from src.shared.common_fn import load_embedding_model
+from src.shared.common_fn import load_embedding_model, embed_documents_cached
+from src.shared.driver_registry import driver_registry
+from src.shared.chat_cache import chat_chain_cache
 
 
 COMMUNITY_PROJECTION_NAME = "communities"
@@ -191,13 +193,10 @@ COMMUNITY_INDEX_FULL_TEXT_QUERY = f"CREATE FULLTEXT INDEX {COMMUNITY_FULLTEXT_IN
 
 
 
-def get_gds_driver(uri, username, password, database):
+def get_gds_driver(graph_driver):
+    """GDS client on the shared driver of the registry, the caller keeps graph_driver while it uses the client."""
     try:
-        gds = GraphDataScience(
-            endpoint=uri,
-            auth=(username, password),
-            database=database
-        )
+        gds = GraphDataScience.from_neo4j_driver(graph_driver.driver, database=graph_driver.database)
         logging.info("Successfully created GDS driver.")
         return gds
     except Exception as e:
@@ -358,12 +357,18 @@ def create_community_embeddings(gds):
         batch_size = 100
         for i in range(0, len(rows), batch_size):
             batch_rows = rows[i:i+batch_size]
-            for row in batch_rows:
-                try:
-                    row['embedding'] = embeddings.embed_query(row['text'])
-                except Exception as e:
-                    logging.error(f"Failed to embed text for community ID {row['communityId']}: {e}")
-                    row['embedding'] = None
+            try:
+                embeddings_list = embed_documents_cached(embeddings, embedding_model, [row['text'] for row in batch_rows])
+                for row, embedding in zip(batch_rows, embeddings_list):
+                    row['embedding'] = embedding
+            except Exception as e:
+                logging.error(f"Failed to embed texts for community batch starting at {i}, embedding them one by one: {e}")
+                for row in batch_rows:
+                    try:
+                        row['embedding'] = embeddings.embed_query(row['text'])
+                    except Exception as e:
+                        logging.error(f"Failed to embed text for community ID {row['communityId']}: {e}")
+                        row['embedding'] = None
 
             try:
                 logging.info("Writing embeddings to the database.")
@@ -411,6 +416,9 @@ def create_vector_index(gds, index_type,embedding_dimension=None):
     except Exception as e:
         logging.error("An error occurred while creating the vector index.", exc_info=True)
         logging.error(f"Error details: {str(e)}")
+    finally:
+        # once the index is recreated, or failed to, so no chat caches a store against the dropped index
+        chat_chain_cache.invalidate()
 
 
 def create_fulltext_index(gds, index_type):
@@ -438,6 +446,9 @@ def create_fulltext_index(gds, index_type):
     except Exception as e:
         logging.error("An error occurred while creating the full-text index.", exc_info=True)
         logging.error(f"Error details: {str(e)}")
+    finally:
+        # once the index is recreated, or failed to, so no chat caches a store against the dropped index
+        chat_chain_cache.invalidate()
 
 def create_community_properties(gds, model):
     commands = [
@@ -492,7 +503,8 @@ def clear_communities(gds):
 
 def create_communities(uri, username, password, database,model=COMMUNITY_CREATION_DEFAULT_MODEL):
     try:
-        gds = get_gds_driver(uri, username, password, database)
+        graph_driver = driver_registry.get_driver(uri, username, password, database)
+        gds = get_gds_driver(graph_driver)
         clear_communities(gds)
 
         graph_project = create_community_graph_projection(gds)
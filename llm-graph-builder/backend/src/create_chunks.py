@@ -1,16 +1,17 @@
-from langchain_text_splitters import TokenTextSplitter
 from langchain.docstore.document import Document
 from langchain_community.graphs import Neo4jGraph
 import logging
 import os
+import itertools
 from src.document_sources.youtube import get_chunks_with_timestamps, get_calculated_timestamps
+from src.shared.token_chunker import get_token_chunker
 import re
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level="INFO")
 
 
 class CreateChunksofDocument:
-    def __init__(self, pages: list[Document], graph: Neo4jGraph):
+    def __init__(self, pages, graph: Neo4jGraph):
         self.pages = pages
         self.graph = graph
 
@@ -19,31 +20,50 @@ class CreateChunksofDocument:
         Split a list of documents(file pages) into chunks of fixed size.
 
         Args:
-            pages: A list of pages to split. Each page is a list of text strings.
+            pages: A list or an iterator of pages to split. Each page is a list of text strings.
 
         Returns:
-            A list of chunks each of which is a langchain Document.
+            The chunks, each of which is a langchain Document whose metadata has the start_index and end_index
+            character offsets of the chunk in the document, its pages joined. PDF pages are split one page at a
+            time and the chunks are returned as a generator, so pages are only read as the chunks are consumed.
         """
         logging.info("Split file into smaller chunks")
         # number_of_chunks_allowed = int(os.environ.get('NUMBER_OF_CHUNKS_ALLOWED'))
-        text_splitter = TokenTextSplitter(chunk_size=200, chunk_overlap=20)
-        if 'page' in self.pages[0].metadata:
-            chunks = []
-            for i, document in enumerate(self.pages):
-                page_number = i + 1
-                for chunk in text_splitter.split_documents([document]):
-                    chunks.append(Document(page_content=chunk.page_content, metadata={'page_number':page_number}))
-
-        elif 'length' in self.pages[0].metadata:
+        text_chunker = get_token_chunker(chunk_size=200, chunk_overlap=20)
+        pages = iter(self.pages)
+        first_page = next(pages, None)
+        if first_page is not None and 'page' in first_page.metadata:
+            return self.split_pages_lazily(itertools.chain([first_page], pages), text_chunker)
+
+        self.pages = [first_page] + list(pages)
+        if 'length' in self.pages[0].metadata:
             if len(self.pages) == 1  or (len(self.pages) > 1 and self.pages[1].page_content.strip() == ''):
                 match = re.search(r'(?:v=)([0-9A-Za-z_-]{11})\s*',self.pages[0].metadata['source'])
                 youtube_id=match.group(1)
-                chunks_without_time_range = text_splitter.split_documents([self.pages[0]])
+                chunks_without_time_range = list(self.split_documents([self.pages[0]], text_chunker))
                 chunks = get_calculated_timestamps(chunks_without_time_range, youtube_id)
 
             else:
-                chunks_without_time_range = text_splitter.split_documents(self.pages)
+                chunks_without_time_range = list(self.split_documents(self.pages, text_chunker))
                 chunks = get_chunks_with_timestamps(chunks_without_time_range)
         else:
-            chunks = text_splitter.split_documents(self.pages)
-        return chunks
\ No newline at end of file
+            chunks = list(self.split_documents(self.pages, text_chunker))
+        return chunks
+
+    def split_documents(self, documents, text_chunker):
+        """Chunk every document once, yielding chunks with a copy of the page metadata and document level offsets."""
+        document_offset = 0
+        for document in documents:
+            for start, end, chunk_text in text_chunker.split_text_with_offsets(document.page_content):
+                metadata = {**document.metadata, 'start_index': document_offset + start, 'end_index': document_offset + end}
+                yield Document(page_content=chunk_text, metadata=metadata)
+            document_offset += len(document.page_content)
+
+    def split_pages_lazily(self, pages, text_chunker):
+        document_offset = 0
+        for i, document in enumerate(pages):
+            page_number = i + 1
+            for start, end, chunk_text in text_chunker.split_text_with_offsets(document.page_content):
+                yield Document(page_content=chunk_text, metadata={'page_number':page_number, 'start_index': document_offset + start,
+                                                                  'end_index': document_offset + end})
+            document_offset += len(document.page_content)
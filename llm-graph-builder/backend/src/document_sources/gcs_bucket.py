@@ -8,11 +8,44 @@ from PyPDF2 import PdfReader
 import io
 from google.oauth2.credentials import Credentials
 import time
-import nltk
+import hashlib
+import threading
 from .local_file import load_document_content
 
+_gcs_clients = {}
+_gcs_clients_lock = threading.Lock()
+# access tokens expire, the oldest client is dropped beyond this many
+MAX_GCS_CLIENTS = 32
+# limit of the GCS compose API
+GCS_MAX_COMPOSE_SOURCES = 32
+_nltk_data_lock = threading.Lock()
+_nltk_data_downloaded = False
+
+def get_gcs_client(gcs_project_id, access_token=None):
+  """Return the storage client shared by every request for the project and access token, the token is only kept hashed in the key."""
+  key = (gcs_project_id, hashlib.sha256(access_token.encode()).hexdigest() if access_token else None)
+  with _gcs_clients_lock:
+    if key not in _gcs_clients:
+      if len(_gcs_clients) >= MAX_GCS_CLIENTS:
+        _gcs_clients.pop(next(iter(_gcs_clients)))
+      if access_token is None:
+        _gcs_clients[key] = storage.Client(project=gcs_project_id)
+      else:
+        _gcs_clients[key] = storage.Client(project=gcs_project_id, credentials=Credentials(access_token))
+    return _gcs_clients[key]
+
+def download_nltk_data():
+  # the Unstructured loader needs these, downloading them once per process is enough
+  global _nltk_data_downloaded
+  with _nltk_data_lock:
+    if not _nltk_data_downloaded:
+      import nltk
+      nltk.download('punkt')
+      nltk.download('averaged_perceptron_tagger')
+      _nltk_data_downloaded = True
+
 def get_gcs_bucket_files_info(gcs_project_id, gcs_bucket_name, gcs_bucket_folder, creds):
-    storage_client = storage.Client(project=gcs_project_id, credentials=creds)
+    storage_client = get_gcs_client(gcs_project_id, creds.token)
     file_name=''
     try:
       bucket = storage_client.bucket(gcs_bucket_name.strip())
@@ -45,8 +78,7 @@ def load_pdf(file_path):
     return PyMuPDFLoader(file_path)
 
 def get_documents_from_gcs(gcs_project_id, gcs_bucket_name, gcs_bucket_folder, gcs_blob_filename, access_token=None):
-  nltk.download('punkt')
-  nltk.download('averaged_perceptron_tagger')
+  download_nltk_data()
   if gcs_bucket_folder is not None:
     if gcs_bucket_folder.endswith('/'):
       blob_name = gcs_bucket_folder+gcs_blob_filename
@@ -58,12 +90,10 @@ def get_documents_from_gcs(gcs_project_id, gcs_bucket_name, gcs_bucket_folder, g
   logging.info(f"GCS project_id : {gcs_project_id}")
 
   if access_token is None:
-    storage_client = storage.Client(project=gcs_project_id)
     loader = GCSFileLoader(project_name=gcs_project_id, bucket=gcs_bucket_name, blob=blob_name, loader_func=load_document_content)
     pages = loader.load()
   else:
-    creds= Credentials(access_token)
-    storage_client = storage.Client(project=gcs_project_id, credentials=creds)
+    storage_client = get_gcs_client(gcs_project_id, access_token)
 
     bucket = storage_client.bucket(gcs_bucket_name)
     blob = bucket.blob(blob_name)
@@ -82,46 +112,55 @@ def get_documents_from_gcs(gcs_project_id, gcs_bucket_name, gcs_bucket_folder, g
 
 def upload_file_to_gcs(file_chunk, chunk_number, original_file_name, bucket_name, folder_name_sha1_hashed):
   try:
-    storage_client = storage.Client()
+    storage_client = get_gcs_client(None)
 
     file_name = f'{original_file_name}_part_{chunk_number}'
     bucket = storage_client.bucket(bucket_name)
-    file_data = file_chunk.file.read()
     file_name_with__hashed_folder = folder_name_sha1_hashed +'/'+file_name
     logging.info(f'GCS folder pathin upload: {file_name_with__hashed_folder}')
     blob = bucket.blob(file_name_with__hashed_folder)
-    file_io = io.BytesIO(file_data)
-    blob.upload_from_file(file_io)
+    # stream the spooled upload, reading it into memory first held every part twice
+    blob.upload_from_file(file_chunk.file, rewind=True)
     time.sleep(1)
     logging.info('Chunk uploaded successfully in gcs')
   except Exception as e:
     raise Exception('Error in while uploading the file chunks on GCS')
 
+def compose_blobs(bucket, source_blobs, destination_blob, temporary_prefix):
+  """
+  Concatenate the source blobs into destination_blob server side. A compose request takes at most
+  GCS_MAX_COMPOSE_SOURCES sources, so more parts are composed in groups into temporary blobs first.
+  Returns the temporary blobs, for the caller to delete.
+  """
+  temporary_blobs = []
+  level = 0
+  while len(source_blobs) > GCS_MAX_COMPOSE_SOURCES:
+    composed_blobs = []
+    for group_start in range(0, len(source_blobs), GCS_MAX_COMPOSE_SOURCES):
+      composed_blob = bucket.blob(f'{temporary_prefix}_compose_{level}_{group_start // GCS_MAX_COMPOSE_SOURCES}')
+      composed_blob.compose(source_blobs[group_start:group_start + GCS_MAX_COMPOSE_SOURCES])
+      composed_blobs.append(composed_blob)
+    temporary_blobs.extend(composed_blobs)
+    source_blobs = composed_blobs
+    level += 1
+  destination_blob.compose(source_blobs)
+  return temporary_blobs
+
 def merge_file_gcs(bucket_name, original_file_name: str, folder_name_sha1_hashed, total_chunks):
   try:
-      storage_client = storage.Client()
+      storage_client = get_gcs_client(None)
       bucket = storage_client.bucket(bucket_name)
-      # Retrieve chunks from GCS
-      # blobs = storage_client.list_blobs(bucket_name, prefix=folder_name_sha1_hashed)
-      # print(f'before sorted blobs: {blobs}')
-      chunks = []
-      for i in range(1,total_chunks+1):
-        blob_name = folder_name_sha1_hashed + '/' + f"{original_file_name}_part_{i}"
-        blob = bucket.blob(blob_name)
-        if blob.exists():
-          print(f'Blob Name: {blob.name}')
-          chunks.append(blob.download_as_bytes())
-        blob.delete()
-
-      merged_file = b"".join(chunks)
+      # Compose the chunks in GCS, the file never passes through this process
+      part_blobs = [bucket.blob(folder_name_sha1_hashed + '/' + f"{original_file_name}_part_{i}") for i in range(1,total_chunks+1)]
       file_name_with__hashed_folder = folder_name_sha1_hashed +'/'+original_file_name
       logging.info(f'GCS folder path in merge: {file_name_with__hashed_folder}')
-      blob = storage_client.bucket(bucket_name).blob(file_name_with__hashed_folder)
-      logging.info('save the merged file from chunks in gcs')
-      file_io = io.BytesIO(merged_file)
-      blob.upload_from_file(file_io)
-      # pdf_reader = PdfReader(file_io)
-      file_size = len(merged_file)
+      blob = bucket.blob(file_name_with__hashed_folder)
+      logging.info('compose the merged file from chunks in gcs')
+      temporary_blobs = compose_blobs(bucket, part_blobs, blob, file_name_with__hashed_folder)
+      for part_blob in part_blobs + temporary_blobs:
+        part_blob.delete()
+      blob.reload()
+      file_size = blob.size
 
       return file_size
   except Exception as e:
@@ -129,7 +168,7 @@ def merge_file_gcs(bucket_name, original_file_name: str, folder_name_sha1_hashed
 
 def delete_file_from_gcs(bucket_name,folder_name, file_name):
   try:
-    storage_client = storage.Client()
+    storage_client = get_gcs_client(None)
     bucket = storage_client.bucket(bucket_name)
     folder_file_name = folder_name +'/'+file_name
     blob = bucket.blob(folder_file_name)
@@ -141,7 +180,7 @@ def delete_file_from_gcs(bucket_name,folder_name, file_name):
 
 def copy_failed_file(source_bucket_name,dest_bucket_name,folder_name, file_name):
   try:
-    storage_client = storage.Client()
+    storage_client = get_gcs_client(None)
     source_bucket = storage_client.bucket(source_bucket_name)
     dest_bucket = storage_client.bucket(dest_bucket_name)
     folder_file_name = folder_name +'/'+file_name
@@ -1,5 +1,9 @@
 import logging
+import os
 import shutil
+import itertools
+import threading
+import multiprocessing
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 # from langchain_community.document_loaders import PyPDFLoader
@@ -7,6 +11,14 @@ from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_community.document_loaders import UnstructuredFileLoader
 from langchain_core.documents import Document
 
+_parsing_context = None
+_parsing_slots = None
+_parsing_context_lock = threading.Lock()
+
+
+class DocumentParsingTimeoutError(Exception):
+    """Parsing a file did not finish within DOCUMENT_PARSING_TIMEOUT seconds."""
+
 # def get_documents_from_file_by_bytes(file):
 #     file_name = file.filename
 #     logging.info(f"get_documents_from_file called for filename = {file_name}")
@@ -33,12 +45,12 @@ def get_documents_from_file_by_path(file_path,file_name):
         # loader = PyPDFLoader(str(file_path))
         file_extension = file_path.suffix.lower()
         try:
-            loader = load_document_content(file_path)
             if file_extension == ".pdf":
-                pages = loader.load()
+                pages = get_pages_lazily(load_document_content(file_path))
             else:
-                unstructured_pages = loader.load()
-                pages= get_pages_with_page_numbers(unstructured_pages)
+                pages = get_pages_from_unstructured_file(file_path)
+        except DocumentParsingTimeoutError:
+            raise
         except Exception as e:
             raise Exception('Error while reading the file content or metadata')
     else:
@@ -46,41 +58,113 @@ def get_documents_from_file_by_path(file_path,file_name):
         raise Exception(f'File {file_name} does not exist')
     return file_name, pages , file_extension
 
+def get_pages_lazily(loader):
+    """
+    Return the pages of the loader as a generator, so pages are parsed as the chunker consumes them instead
+    of the whole file being held in memory. The first page is read eagerly so that unreadable or empty files
+    still fail here; an empty file returns an empty list.
+    """
+    pages = loader.lazy_load()
+    first_page = next(pages, None)
+    if first_page is None:
+        return []
+    return itertools.chain([first_page], pages)
+
 def get_pages_with_page_numbers(unstructured_pages):
+    """
+    Regroup Unstructured elements into pages in a single pass. The first and last elements are recognised by
+    their index, comparing documents by value on every element made this quadratic in the file size.
+    """
     pages = []
     page_number = 1
-    page_content=''
+    page_content_parts = []
     metadata = {}
-    for page in unstructured_pages:
+    last_index = len(unstructured_pages) - 1
+    for index, page in enumerate(unstructured_pages):
+        is_last_element = index == last_index
         if  'page_number' in page.metadata:
             if page.metadata['page_number']==page_number:
-                page_content += page.page_content
+                page_content_parts.append(page.page_content)
                 metadata = {'source':page.metadata['source'],'page_number':page_number, 'filename':page.metadata['filename'],
                         'filetype':page.metadata['filetype']}
 
             if page.metadata['page_number']>page_number:
                 page_number+=1
-                # if not metadata:
-                #     metadata = {'total_pages':unstructured_pages[-1].metadata['page_number']}
-                pages.append(Document(page_content = page_content))
-                page_content=''
+                pages.append(Document(page_content = ''.join(page_content_parts)))
+                page_content_parts = []
 
-            if page == unstructured_pages[-1]:
-                # if not metadata:
-                #     metadata = {'total_pages':unstructured_pages[-1].metadata['page_number']}
-                pages.append(Document(page_content = page_content))
+            if is_last_element:
+                pages.append(Document(page_content = ''.join(page_content_parts)))
 
-        elif page.metadata['category']=='PageBreak' and page!=unstructured_pages[0]:
+        elif page.metadata['category']=='PageBreak' and index != 0:
             page_number+=1
-            pages.append(Document(page_content = page_content, metadata=metadata))
-            page_content=''
+            pages.append(Document(page_content = ''.join(page_content_parts), metadata=metadata))
+            page_content_parts = []
             metadata={}
 
         else:
-            page_content += page.page_content
+            page_content_parts.append(page.page_content)
             metadata_with_custom_page_number = {'source':page.metadata['source'],
                             'page_number':1, 'filename':page.metadata['filename'],
                             'filetype':page.metadata['filetype']}
-            if page == unstructured_pages[-1]:
-                    pages.append(Document(page_content = page_content, metadata=metadata_with_custom_page_number))
-    return pages
\ No newline at end of file
+            if is_last_element:
+                    pages.append(Document(page_content = ''.join(page_content_parts), metadata=metadata_with_custom_page_number))
+    return pages
+
+def parse_unstructured_file(file_path):
+    """Runs in a parsing worker process: partition the file with Unstructured and regroup the elements into pages."""
+    loader = UnstructuredFileLoader(file_path, mode="elements",autodetect_encoding=True)
+    return get_pages_with_page_numbers(loader.load())
+
+def parse_unstructured_file_in_process(file_path, connection):
+    """Runs in a parsing process: send back the pages, or the error when parsing fails."""
+    try:
+        connection.send((True, parse_unstructured_file(file_path)))
+    except Exception as e:
+        connection.send((False, f'{type(e).__name__}: {e}'))
+    finally:
+        connection.close()
+
+def get_parsing_context():
+    global _parsing_context, _parsing_slots
+    with _parsing_context_lock:
+        if _parsing_context is None:
+            workers = int(os.environ.get('DOCUMENT_PARSING_WORKERS', '2'))
+            # forkserver instead of fork, the parent process runs threads. The server imports Unstructured's
+            # partitioners once, the slow part of a first parse, and every parse process is forked warm from it
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['unstructured.partition.auto'])
+            _parsing_slots = threading.BoundedSemaphore(workers)
+            _parsing_context = context
+            logging.info(f"Document parsing runs in up to {workers} processes")
+        return _parsing_context, _parsing_slots
+
+def get_pages_from_unstructured_file(file_path):
+    """
+    Parse a non-PDF file in its own process, so Unstructured's CPU bound partitioning doesn't hold the GIL of
+    the API process. At most DOCUMENT_PARSING_WORKERS files are parsed at once. Parsing is limited to
+    DOCUMENT_PARSING_TIMEOUT seconds from the start of the parse process, waiting for a free slot doesn't
+    count, and a parse that runs over is killed without touching the other parses.
+    """
+    context, slots = get_parsing_context()
+    timeout = float(os.environ.get('DOCUMENT_PARSING_TIMEOUT', '600'))
+    with slots:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=parse_unstructured_file_in_process, args=(str(file_path), sender), daemon=True)
+        process.start()
+        sender.close()
+        try:
+            if not receiver.poll(timeout):
+                logging.error(f"Parsing {file_path} did not finish in {timeout} seconds, killing its parse process")
+                process.kill()
+                raise DocumentParsingTimeoutError(f'Parsing the file did not finish in {timeout} seconds')
+            try:
+                is_parsed, result = receiver.recv()
+            except EOFError:
+                raise Exception('The parse process exited without returning the pages')
+        finally:
+            receiver.close()
+            process.join()
+    if not is_parsed:
+        raise Exception(result)
+    return result
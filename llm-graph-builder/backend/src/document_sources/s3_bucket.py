@@ -1,9 +1,31 @@
-from langchain_community.document_loaders import S3DirectoryLoader
+from langchain_community.document_loaders import PyMuPDFLoader
 import logging
 import boto3
+import hashlib
 import os
+import threading
+from tempfile import NamedTemporaryFile
 from urllib.parse import urlparse
 
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+# the oldest client is dropped beyond this many credentials
+MAX_S3_CLIENTS = 32
+
+def get_s3_client(aws_access_key_id=None, aws_secret_access_key=None):
+  """
+  Return the S3 client shared by every request made with the credentials. boto3 clients are thread safe,
+  creating them is not and is slow, so they are created once under a lock. The secret is only kept hashed in the key.
+  """
+  key = (aws_access_key_id, hashlib.sha256((aws_secret_access_key or "").encode()).hexdigest())
+  with _s3_clients_lock:
+    if key not in _s3_clients:
+      if len(_s3_clients) >= MAX_S3_CLIENTS:
+        _s3_clients.pop(next(iter(_s3_clients)))
+      session = boto3.session.Session(aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
+      _s3_clients[key] = session.client('s3')
+    return _s3_clients[key]
+
 def get_s3_files_info(s3_url,aws_access_key_id=None,aws_secret_access_key=None):
   try:
       # Extract bucket name and directory from the S3 URL
@@ -12,26 +34,25 @@ def get_s3_files_info(s3_url,aws_access_key_id=None,aws_secret_access_key=None):
       directory = parsed_url.path.lstrip('/')
       try:
         # Connect to S3
-        s3 = boto3.client('s3',aws_access_key_id=aws_access_key_id,aws_secret_access_key=aws_secret_access_key)
+        s3 = get_s3_client(aws_access_key_id, aws_secret_access_key)
+
+        # List objects in the specified directory, list_objects_v2 returns at most 1000 keys per page
+        files_info = []
+        paginator = s3.get_paginator('list_objects_v2')
+        for response in paginator.paginate(Bucket=bucket_name, Prefix=directory):
+          # Check each object for file size and type
+          for obj in response.get('Contents', []):
+              file_key = obj['Key']
+              file_name = os.path.basename(file_key)
+              file_size = obj['Size']
 
-        # List objects in the specified directory
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=directory)
+              # Check if file is a PDF
+              if file_name.endswith('.pdf'):
+                files_info.append({'file_key': file_key, 'file_size_bytes': file_size})
       except Exception as e:
          raise Exception("Invalid AWS credentials")
 
-      files_info = []
-
-      # Check each object for file size and type
-      for obj in response.get('Contents', []):
-          file_key = obj['Key']
-          file_name = os.path.basename(file_key)
-          logging.info(f'file_name : {file_name}  and file key : {file_key}')
-          file_size = obj['Size']
-
-          # Check if file is a PDF
-          if file_name.endswith('.pdf'):
-            files_info.append({'file_key': file_key, 'file_size_bytes': file_size})
-
+      logging.info(f'Found {len(files_info)} pdf files under s3://{bucket_name}/{directory}')
       return files_info
   except Exception as e:
     error_message = str(e)
@@ -47,8 +68,11 @@ def get_s3_pdf_content(s3_url,aws_access_key_id=None,aws_secret_access_key=None)
         logging.info(f'bucket name : {bucket_name}')
         directory = parsed_url.path.lstrip('/')
         if directory.endswith('.pdf'):
-          loader=S3DirectoryLoader(bucket_name, prefix=directory,aws_access_key_id=aws_access_key_id,aws_secret_access_key=aws_secret_access_key)
-          pages = loader.load_and_split()
+          s3 = get_s3_client(aws_access_key_id, aws_secret_access_key)
+          with NamedTemporaryFile(suffix='.pdf') as tmp:
+            s3.download_fileobj(bucket_name, directory, tmp)
+            tmp.flush()
+            pages = PyMuPDFLoader(tmp.name).load()
           return pages
         else:
           return None
@@ -64,7 +88,7 @@ def get_documents_from_s3(s3_url, aws_access_key_id, aws_secret_access_key):
       bucket = parsed_url.netloc
       file_key = parsed_url.path.lstrip('/')
       file_name=file_key.split('/')[-1]
-      s3=boto3.client('s3',aws_access_key_id=aws_access_key_id,aws_secret_access_key=aws_secret_access_key)
+      s3=get_s3_client(aws_access_key_id, aws_secret_access_key)
       response=s3.head_object(Bucket=bucket,Key=file_key)
       file_size=response['ContentLength']
 
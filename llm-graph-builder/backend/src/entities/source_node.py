@@ -24,3 +24,4 @@ class sourceNode:
     processed_chunk:int=None
     access_token:str=None
     retry_condition:str=None
+    chunking_completed:bool=None
@@ -2,11 +2,16 @@ import logging
 import os
 from datetime import datetime
 from langchain_community.graphs import Neo4jGraph
-from src.shared.common_fn import create_gcs_bucket_folder_name_hashed, delete_uploaded_local_file, load_embedding_model
+from src.shared.common_fn import create_gcs_bucket_folder_name_hashed, delete_uploaded_local_file
+from src.shared.embedding_models import get_embedding_dimension
 from src.document_sources.gcs_bucket import delete_file_from_gcs
 from src.shared.constants import BUCKET_UPLOAD
 from src.entities.source_node import sourceNode
 from src.communities import MAX_COMMUNITY_LEVELS
+from src.knn_graph import update_knn_graph_in_process
+from src.shared.driver_registry import driver_registry, GraphDriver
+from src.shared.status_event_bus import status_event_bus
+from src.shared.chat_cache import chat_chain_cache
 import json
 from dotenv import load_dotenv
 
@@ -16,6 +21,7 @@ class graphDBdataAccess:
 
     def __init__(self, graph: Neo4jGraph):
         self.graph = graph
+        self.connection_key = driver_registry.get_connection_key(graph)
 
     def update_exception_db(self, file_name, exp_msg, retry_condition):
         try:
@@ -31,11 +37,17 @@ class graphDBdataAccess:
             else :
                 self.graph.query("""MERGE(d:Document {fileName :$fName}) SET d.status = $status, d.errorMessage = $error_msg""",
                             {"fName":file_name, "status":job_status, "error_msg":exp_msg})
+            self.publish_status(file_name, {"status":job_status})
         except Exception as e:
             error_message = str(e)
             logging.error(f"Error in updating document node status as failed: {error_message}")
             raise Exception(error_message)
 
+    def publish_status(self, file_name, properties):
+        """Notify the extraction status subscribers of the document, see StatusEventBus."""
+        if self.connection_key is not None and file_name:
+            status_event_bus.publish((*self.connection_key, file_name), properties)
+
     def create_source_node(self, obj_source_node:sourceNode):
         try:
             job_status = "New"
@@ -101,12 +113,16 @@ class graphDBdataAccess:
             if obj_source_node.retry_condition is not None :
                 params['retry_condition'] = obj_source_node.retry_condition
 
+            if obj_source_node.chunking_completed is not None:
+                params['chunking_completed'] = obj_source_node.chunking_completed
+
             param= {"props":params}
 
             print(f'Base Param value 1 : {param}')
             query = "MERGE(d:Document {fileName :$props.fileName}) SET d += $props"
             logging.info("Update source node properties")
             self.graph.query(query,param)
+            self.publish_status(params.get('fileName'), params)
         except Exception as e:
             error_message = str(e)
             self.update_exception_db(self.file_name,error_message)
@@ -135,9 +151,15 @@ class graphDBdataAccess:
         """
         Update the graph node with SIMILAR relationship where embedding scrore match
         """
+        knn_min_score = os.environ.get('KNN_MIN_SCORE')
+        if os.environ.get('KNN_BUILDER', 'cypher').lower() == 'numpy':
+            # top-k computed in process with blocked matrix multiplies, for databases where the per chunk vector query times out
+            incremental = os.environ.get('KNN_INCREMENTAL', 'True').upper() == "TRUE"
+            graph_driver = GraphDriver(self.graph)
+            update_knn_graph_in_process(graph_driver, graph_driver.database, get_embedding_dimension(os.getenv('EMBEDDING_MODEL')), float(knn_min_score), incremental)
+            return
         index = self.graph.query("""show indexes yield * where type = 'VECTOR' and name = 'vector'""")
         # logging.info(f'show index vector: {index}')
-        knn_min_score = os.environ.get('KNN_MIN_SCORE')
         if len(index) > 0:
             logging.info('update KNN graph')
             self.graph.query("""MATCH (c:Chunk)
@@ -223,8 +245,9 @@ class graphDBdataAccess:
                                 """)
 
         embedding_model = os.getenv('EMBEDDING_MODEL')
-        embeddings, application_dimension = load_embedding_model(embedding_model)
-        logging.info(f'embedding model:{embeddings} and dimesion:{application_dimension}')
+        # the dimension is known without loading the model, /connect never loads it
+        application_dimension = get_embedding_dimension(embedding_model)
+        logging.info(f'embedding model:{embedding_model} and dimesion:{application_dimension}')
 
         gds_status = self.check_gds_version()
         write_access = self.check_account_access(database=database)
@@ -249,7 +272,8 @@ class graphDBdataAccess:
                 MATCH(d:Document {fileName : $file_name}) RETURN d.status AS Status , d.processingTime AS processingTime,
                 d.nodeCount AS nodeCount, d.model as model, d.relationshipCount as relationshipCount,
                 d.total_chunks AS total_chunks , d.fileSize as fileSize,
-                d.is_cancelled as is_cancelled, d.processed_chunk as processed_chunk, d.fileSource as fileSource
+                d.is_cancelled as is_cancelled, d.processed_chunk as processed_chunk, d.fileSource as fileSource,
+                d.chunking_completed as chunking_completed
                 """
         param = {"file_name" : file_name}
         return self.execute_query(query, param)
@@ -425,19 +449,23 @@ class graphDBdataAccess:
         drop and create the vector index when vector index dimesion are different.
         """
         embedding_model = os.getenv('EMBEDDING_MODEL')
-        embeddings, dimension = load_embedding_model(embedding_model)
-
-        if isVectorIndexExist == 'true':
-            self.graph.query("""drop index vector""")
-        # self.graph.query("""drop index vector""")
-        self.graph.query("""CREATE VECTOR INDEX `vector` if not exists for (c:Chunk) on (c.embedding)
-                            OPTIONS {indexConfig: {
-                            `vector.dimensions`: $dimensions,
-                            `vector.similarity_function`: 'cosine'
-                            }}
-                        """,
-                        {
-                            "dimensions" : dimension
-                        }
-                        )
+        dimension = get_embedding_dimension(embedding_model)
+
+        try:
+            if isVectorIndexExist == 'true':
+                self.graph.query("""drop index vector""")
+            # self.graph.query("""drop index vector""")
+            self.graph.query("""CREATE VECTOR INDEX `vector` if not exists for (c:Chunk) on (c.embedding)
+                                OPTIONS {indexConfig: {
+                                `vector.dimensions`: $dimensions,
+                                `vector.similarity_function`: 'cosine'
+                                }}
+                            """,
+                            {
+                                "dimensions" : dimension
+                            }
+                            )
+        finally:
+            # after the create, a store cached in between would point at the dropped index
+            chat_chain_cache.invalidate()
         return "Drop and Re-Create vector index succesfully"
@@ -1,7 +1,6 @@
 import logging
 from neo4j import time
-from neo4j import GraphDatabase
-import os
+from src.shared.driver_registry import driver_registry
 import json
 from src.shared.constants import GRAPH_CHUNK_LIMIT,GRAPH_QUERY,CHUNK_TEXT_QUERY,COUNT_CHUNKS_QUERY
 # from neo4j.debug import watch
@@ -10,19 +9,16 @@ from src.shared.constants import GRAPH_CHUNK_LIMIT,GRAPH_QUERY,CHUNK_TEXT_QUERY,
 
 def get_graphDB_driver(uri, username, password,database="neo4j"):
     """
-    Creates and returns a Neo4j database driver instance configured with the provided credentials.
+    Returns the shared Neo4j database driver for the provided credentials from the driver registry.
+    The driver is shared, callers must not close it and keep the returned handle while they use it.
 
     Returns:
-    Neo4j.Driver: A driver object for interacting with the Neo4j database.
+    GraphDriver: A handle of the driver for interacting with the Neo4j database.
 
     """
     try:
         logging.info(f"Attempting to connect to the Neo4j database at {uri}")
-        enable_user_agent = os.environ.get("ENABLE_USER_AGENT", "False").lower() in ("true", "1", "yes")
-        if enable_user_agent:
-            driver = GraphDatabase.driver(uri, auth=(username, password),database=database, user_agent=os.environ.get('NEO4J_USER_AGENT'))
-        else:
-            driver = GraphDatabase.driver(uri, auth=(username, password),database=database)
+        driver = driver_registry.get_driver(uri, username, password, database)
         logging.info("Connection successful")
         return driver
     except Exception as e:
@@ -221,9 +217,6 @@ def get_graph_results(uri, username, password,database,document_names):
     except Exception as e:
         logging.error(f"graph_query module: An error occurred in get_graph_results. Error: {str(e)}")
         raise Exception(f"graph_query module: An error occurred in get_graph_results. Please check the logs for more details.") from e
-    finally:
-        logging.info("Closing connection for graph_query api")
-        driver.close()
 
 
 def get_chunktext_results(uri, username, password, database, document_name, page_no):
@@ -233,7 +226,7 @@ def get_chunktext_results(uri, username, password, database, document_name, page
        offset = 10
        skip = (page_no - 1) * offset
        limit = offset
-       driver = GraphDatabase.driver(uri, auth=(username, password))
+       driver = get_graphDB_driver(uri, username, password, database)
        with driver.session(database=database) as session:
            total_chunks_result = session.run(COUNT_CHUNKS_QUERY, file_name=document_name)
            total_chunks = total_chunks_result.single()["total_chunks"]
@@ -254,6 +247,4 @@ def get_chunktext_results(uri, username, password, database, document_name, page
            }
    except Exception as e:
        logging.error(f"An error occurred in get_chunktext_results. Error: {str(e)}")
-       raise Exception("An error occurred in get_chunktext_results. Please check the logs for more details.") from e
-   finally:
-       driver.close()
\ No newline at end of file
+       raise Exception("An error occurred in get_chunktext_results. Please check the logs for more details.") from e
\ No newline at end of file
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import psutil
+import sqlite3
+import threading
+import time
+import uuid
+from cryptography.fernet import Fernet, InvalidToken
+
+JOB_QUEUE_DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "job_queue", "jobs.sqlite")
+JOB_STATUS_QUEUED = "Queued"
+JOB_STATUS_RUNNING = "Running"
+JOB_STATUS_COMPLETED = "Completed"
+JOB_STATUS_FAILED = "Failed"
+
+CREATE_JOBS_TABLE = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    file_name TEXT,
+    payload TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    heartbeat_at REAL,
+    owner TEXT,
+    batch_id TEXT,
+    file_size INTEGER
+)
+"""
+CREATE_JOBS_STATUS_INDEX = "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+CREATE_JOBS_BATCH_INDEX = "CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)"
+
+
+def get_payload_key(path: str):
+    """
+    Key encrypting the job payloads: JOB_QUEUE_SECRET_KEY (a Fernet key) when set, otherwise a key generated once
+    into the key file at path, readable by its owner only.
+    """
+    key = os.environ.get('JOB_QUEUE_SECRET_KEY')
+    if key:
+        return key.encode()
+    try:
+        file_descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    except FileExistsError:
+        with open(path, "rb") as key_file:
+            return key_file.read().strip()
+    key = Fernet.generate_key()
+    with os.fdopen(file_descriptor, "wb") as key_file:
+        key_file.write(key)
+    return key
+
+
+def get_process_owner(pid: int = None):
+    """host:pid:start time of the process, the start time tells a restarted process with a reused pid apart."""
+    process = psutil.Process(pid)
+    return f"{socket.gethostname()}:{process.pid}:{process.create_time()}"
+
+def is_owner_alive(owner):
+    """True when owner is a process on this host that is still running, the heartbeat decides for other hosts."""
+    host, pid, _ = owner.rsplit(":", 2) if owner.count(":") >= 2 else (None, None, None)
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        return get_process_owner(int(pid)) == owner
+    except psutil.Error:
+        return False
+
+
+class JobQueue:
+    """
+    Durable job queue stored in SQLite, shared by every worker process on the host.
+
+    Jobs are claimed atomically, running jobs send a heartbeat every JOB_HEARTBEAT_INTERVAL seconds and a
+    running job whose heartbeat is older than JOB_STALE_TIMEOUT (the process crashed or was restarted) is
+    claimed again, up to JOB_MAX_ATTEMPTS attempts. The handler receives the attempt number so it can resume
+    instead of starting over.
+
+    Heartbeats are sent from a thread, so a job whose synchronous steps block the event loop stays alive.
+    The claiming process is recorded as owner (host:pid), and a stale job whose owner is still running on
+    this host is not claimed again.
+
+    The payload holds credentials (database password, AWS secret key, GCS access token): it is stored encrypted,
+    see get_payload_key, cleared as soon as a job finishes and the database file is created readable by its owner
+    only. Without JOB_QUEUE_SECRET_KEY the key file lies next to the database, which only keeps the credentials
+    out of copies of the database file; set JOB_QUEUE_SECRET_KEY to keep the key off the disk.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_DEFAULT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # created with 0600 before sqlite opens it, sqlite gives the -wal and -shm files the same permissions
+        os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+        os.chmod(path, 0o600)
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.chmod(path + suffix, 0o600)
+        self.connection.execute(CREATE_JOBS_TABLE)
+        self.connection.execute(CREATE_JOBS_STATUS_INDEX)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+        for column, column_type in (("owner", "TEXT"), ("batch_id", "TEXT"), ("file_size", "INTEGER")):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self.connection.execute(CREATE_JOBS_BATCH_INDEX)
+        self.fernet = Fernet(get_payload_key(os.path.splitext(path)[0] + ".key"))
+        self.owner = get_process_owner()
+        self.heartbeat_interval = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', '15'))
+        self.stale_timeout = float(os.environ.get('JOB_STALE_TIMEOUT', '120'))
+        self.max_attempts = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+        self.poll_interval = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+        self.worker_tasks = []
+
+    def submit(self, payload: dict, file_name: str = None, batch_id: str = None, file_size: int = None):
+        """Queue a job, batch_id groups the jobs of one bulk request for get_batch_summary."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.connection.execute("""INSERT INTO jobs (id, file_name, payload, status, created_at, updated_at, batch_id, file_size)
+                                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                                    (job_id, file_name, self.fernet.encrypt(json.dumps(payload).encode()).decode(), JOB_STATUS_QUEUED, now, now,
+                                     batch_id, file_size))
+        logging.info(f"Queued job {job_id} for file {file_name}")
+        return job_id
+
+    def get(self, job_id: str):
+        with self.lock:
+            row = self.connection.execute("SELECT id, file_name, status, attempts, result, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {"job_id": row[0], "file_name": row[1], "status": row[2], "attempts": row[3],
+                "result": json.loads(row[4]) if row[4] else None, "error": row[5],
+                "created_at": row[6], "updated_at": row[7]}
+
+    def get_batch_summary(self, batch_id: str):
+        """
+        Status of every job of the batch and the aggregate throughput of the completed ones, from the first job
+        queued to the last one finished. Returns None for an unknown batch.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT id, file_name, status, file_size, error, created_at, updated_at FROM jobs WHERE batch_id = ? ORDER BY created_at",
+                                           (batch_id,)).fetchall()
+        if not rows:
+            return None
+        files = [{"job_id": job_id, "fileName": file_name, "status": status, "error": error}
+                 for job_id, file_name, status, file_size, error, created_at, updated_at in rows]
+        completed_rows = [row for row in rows if row[2] == JOB_STATUS_COMPLETED]
+        finished_rows = [row for row in rows if row[2] in (JOB_STATUS_COMPLETED, JOB_STATUS_FAILED)]
+        processed_bytes = sum(row[3] or 0 for row in completed_rows)
+        elapsed_time = max(row[6] for row in finished_rows) - min(row[5] for row in rows) if finished_rows else 0
+        return {"files": files,
+                "total_files": len(rows),
+                "queued_files": sum(1 for row in rows if row[2] == JOB_STATUS_QUEUED),
+                "running_files": sum(1 for row in rows if row[2] == JOB_STATUS_RUNNING),
+                "extracted_files": len(completed_rows),
+                "failed_files": sum(1 for row in rows if row[2] == JOB_STATUS_FAILED),
+                "processed_bytes": processed_bytes,
+                "elapsed_time": f"{elapsed_time:.2f}",
+                "files_per_second": f"{len(completed_rows) / elapsed_time:.2f}" if elapsed_time else "0.00",
+                "mb_per_second": f"{processed_bytes / (1024 * 1024) / elapsed_time:.2f}" if elapsed_time else "0.00"}
+
+    def claim(self):
+        """Claim the oldest queued job or a stale running job, returns None when there is nothing to run."""
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                skipped_job_ids = []
+                while True:
+                    row = self.connection.execute(f"""SELECT id, file_name, payload, attempts, owner FROM jobs
+                                                     WHERE (status = ? OR (status = ? AND heartbeat_at < ?))
+                                                     AND id NOT IN ({",".join("?" * len(skipped_job_ids))})
+                                                     ORDER BY created_at LIMIT 1""",
+                                                  (JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, now - self.stale_timeout, *skipped_job_ids)).fetchone()
+                    if row is None:
+                        self.connection.execute("COMMIT")
+                        return None
+                    job_id, file_name, payload, attempts, owner = row
+                    if owner and is_owner_alive(owner) and owner != self.owner:
+                        # heartbeat late but its process still runs, it isn't abandoned
+                        skipped_job_ids.append(job_id)
+                        continue
+                    if attempts >= self.max_attempts:
+                        self.connection.execute("UPDATE jobs SET status = ?, error = ?, payload = NULL, updated_at = ? WHERE id = ?",
+                                                (JOB_STATUS_FAILED, f"Job abandoned after {attempts} attempts", now, job_id))
+                        continue
+                    try:
+                        payload = json.loads(self.fernet.decrypt(payload))
+                    except InvalidToken:
+                        self.connection.execute("UPDATE jobs SET status = ?, error = ?, payload = NULL, updated_at = ? WHERE id = ?",
+                                                (JOB_STATUS_FAILED, "Job payload cannot be decrypted with the job queue key", now, job_id))
+                        continue
+                    self.connection.execute("UPDATE jobs SET status = ?, attempts = ?, heartbeat_at = ?, updated_at = ?, owner = ? WHERE id = ?",
+                                            (JOB_STATUS_RUNNING, attempts + 1, now, now, self.owner, job_id))
+                    self.connection.execute("COMMIT")
+                    return {"job_id": job_id, "file_name": file_name, "payload": payload, "attempt": attempts + 1}
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def heartbeat(self, job_id: str):
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?", (time.time(), job_id, JOB_STATUS_RUNNING))
+
+    def finish(self, job_id: str, status: str, result=None, error: str = None):
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, updated_at = ? WHERE id = ?",
+                                    (status, json.dumps(result, default=str) if result is not None else None, error, time.time(), job_id))
+
+    def start(self, handler, workers: int):
+        """
+        Start the worker tasks on the running event loop.
+
+        handler: async callable(payload, attempt) returning the job result dict; a result with status 'Failed'
+        or an exception marks the job as failed.
+        """
+        for _ in range(workers):
+            self.worker_tasks.append(asyncio.create_task(self.worker(handler)))
+        logging.info(f"Started {workers} job workers on {self.path}")
+
+    async def stop(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+    async def worker(self, handler):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.claim)
+            except Exception as e:
+                logging.error(f"Failed to claim a job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            logging.info(f"Running job {job['job_id']} for file {job['file_name']}, attempt {job['attempt']}")
+            heartbeat_stop = threading.Event()
+            heartbeat_thread = threading.Thread(target=self.send_heartbeats, args=(job['job_id'], heartbeat_stop), daemon=True)
+            heartbeat_thread.start()
+            try:
+                result = await handler(job['payload'], job['attempt'])
+                status = JOB_STATUS_FAILED if isinstance(result, dict) and result.get('status') == 'Failed' else JOB_STATUS_COMPLETED
+                await asyncio.to_thread(self.finish, job['job_id'], status, result)
+            except asyncio.CancelledError:
+                # the job stays Running and is resumed by another worker once its heartbeat is stale
+                raise
+            except Exception as e:
+                logging.exception(f"Job {job['job_id']} failed: {e}")
+                await asyncio.to_thread(self.finish, job['job_id'], JOB_STATUS_FAILED, None, str(e))
+            finally:
+                heartbeat_stop.set()
+
+    def send_heartbeats(self, job_id: str, stop: threading.Event):
+        # a thread and not a task on the loop, the extraction runs synchronous steps that can block the loop for minutes
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat(job_id)
+            except Exception as e:
+                logging.error(f"Failed to send the heartbeat of job {job_id}: {e}")
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Return the process wide extraction job queue, or None when ENABLE_EXTRACT_JOB_QUEUE is not set."""
+    global _job_queue
+    if os.environ.get('ENABLE_EXTRACT_JOB_QUEUE', 'False').upper() != "TRUE":
+        return None
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(os.environ.get('JOB_QUEUE_PATH') or JOB_QUEUE_DEFAULT_PATH)
+    return _job_queue
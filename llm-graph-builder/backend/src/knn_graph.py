@@ -0,0 +1,144 @@
+import logging
+import os
+import time
+import numpy as np
+
+
+KNN_TOP_K = 5
+KNN_FETCH_SIZE = 10000
+KNN_QUERY_BLOCK_SIZE = 1024
+KNN_CORPUS_BLOCK_SIZE = 16384
+KNN_WRITE_BATCH_SIZE = 5000
+
+GET_CHUNK_EMBEDDINGS = """
+MATCH (c:Chunk)
+WHERE c.embedding IS NOT NULL
+RETURN elementId(c) AS element_id, c.embedding AS embedding, c.knn_updated_at IS NULL AS is_new
+"""
+
+MERGE_SIMILAR_RELATIONSHIPS = """
+UNWIND $rows AS row
+MATCH (c:Chunk) WHERE elementId(c) = row.source
+MATCH (n:Chunk) WHERE elementId(n) = row.target
+MERGE (c)-[rel:SIMILAR]-(n)
+SET rel.score = row.score
+"""
+
+MARK_CHUNKS_KNN_UPDATED = """
+UNWIND $element_ids AS element_id
+MATCH (c:Chunk) WHERE elementId(c) = element_id
+SET c.knn_updated_at = datetime()
+"""
+
+
+def load_chunk_embeddings(driver, database, fetch_size, dimension):
+    """
+    Stream the chunk embeddings out of the database into one float32 matrix, in batches of fetch_size rows.
+    Embeddings whose dimension is not the one of the configured embedding model (left over from another
+    model) are skipped.
+    """
+    element_ids = []
+    is_new = []
+    blocks = []
+    batch = []
+    skipped = 0
+    with driver.session(database=database, fetch_size=fetch_size) as session:
+        for record in session.run(GET_CHUNK_EMBEDDINGS):
+            embedding = record["embedding"]
+            if len(embedding) != dimension:
+                skipped += 1
+                continue
+            element_ids.append(record["element_id"])
+            is_new.append(record["is_new"])
+            batch.append(embedding)
+            if len(batch) == fetch_size:
+                blocks.append(np.asarray(batch, dtype=np.float32))
+                batch = []
+    if batch:
+        blocks.append(np.asarray(batch, dtype=np.float32))
+    if skipped:
+        logging.warning(f"Skipped {skipped} chunk embeddings whose dimension is not {dimension}")
+    embeddings = np.vstack(blocks) if blocks else np.empty((0, dimension), dtype=np.float32)
+    return element_ids, np.asarray(is_new, dtype=bool), embeddings
+
+def normalize_rows(embeddings):
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return embeddings / norms
+
+def top_k_neighbours(embeddings, query_indices, k, min_score, query_block_size, corpus_block_size):
+    """
+    Yield (query index, neighbour index, score) for the k most similar chunks of every query chunk with a score
+    of at least min_score. Similarities are computed with blocked matrix multiplies, one query block against one
+    corpus block at a time, so memory stays at query_block_size x corpus_block_size scores. The score is the
+    cosine similarity rescaled to [0, 1] like the scores of the Neo4j cosine vector index, so KNN_MIN_SCORE keeps
+    its meaning.
+    """
+    corpus_size = embeddings.shape[0]
+    for query_start in range(0, len(query_indices), query_block_size):
+        block_indices = query_indices[query_start:query_start + query_block_size]
+        queries = embeddings[block_indices]
+        best_scores = np.full((len(block_indices), k), -np.inf, dtype=np.float32)
+        best_indices = np.full((len(block_indices), k), -1, dtype=np.int64)
+        for corpus_start in range(0, corpus_size, corpus_block_size):
+            corpus_end = min(corpus_start + corpus_block_size, corpus_size)
+            scores = (1 + queries @ embeddings[corpus_start:corpus_end].T) / 2
+            # a chunk is not its own neighbour
+            rows = np.nonzero((block_indices >= corpus_start) & (block_indices < corpus_end))[0]
+            scores[rows, block_indices[rows] - corpus_start] = -np.inf
+            candidate_scores = np.concatenate([best_scores, scores], axis=1)
+            candidate_indices = np.concatenate([best_indices, np.broadcast_to(np.arange(corpus_start, corpus_end), scores.shape)], axis=1)
+            keep = min(k, candidate_scores.shape[1])
+            top = np.argpartition(-candidate_scores, keep - 1, axis=1)[:, :keep]
+            best_scores = np.take_along_axis(candidate_scores, top, axis=1)
+            best_indices = np.take_along_axis(candidate_indices, top, axis=1)
+        for row, query_index in enumerate(block_indices):
+            for score, neighbour_index in zip(best_scores[row], best_indices[row]):
+                if neighbour_index >= 0 and score >= min_score:
+                    yield int(query_index), int(neighbour_index), float(score)
+
+def write_similar_relationships(driver, database, element_ids, neighbours, updated_indices, write_batch_size):
+    """Write the SIMILAR relationships in UNWIND batches, each pair once, then mark the query chunks as updated."""
+    relationship_count = 0
+    rows = []
+    seen_pairs = set()
+    with driver.session(database=database) as session:
+        for query_index, neighbour_index, score in neighbours:
+            pair = (min(query_index, neighbour_index), max(query_index, neighbour_index))
+            if pair in seen_pairs:
+                continue
+            seen_pairs.add(pair)
+            rows.append({"source": element_ids[query_index], "target": element_ids[neighbour_index], "score": score})
+            if len(rows) == write_batch_size:
+                session.execute_write(lambda tx, batch: tx.run(MERGE_SIMILAR_RELATIONSHIPS, rows=batch).consume(), rows)
+                relationship_count += len(rows)
+                rows = []
+        if rows:
+            session.execute_write(lambda tx, batch: tx.run(MERGE_SIMILAR_RELATIONSHIPS, rows=batch).consume(), rows)
+            relationship_count += len(rows)
+        for start in range(0, len(updated_indices), write_batch_size):
+            batch_ids = [element_ids[index] for index in updated_indices[start:start + write_batch_size]]
+            session.execute_write(lambda tx, batch: tx.run(MARK_CHUNKS_KNN_UPDATED, element_ids=batch).consume(), batch_ids)
+    return relationship_count
+
+def update_knn_graph_in_process(driver, database, dimension, knn_min_score, incremental=True):
+    """
+    Build the SIMILAR relationships between chunks in this process instead of one vector index query per chunk
+    in a single transaction. In incremental mode only chunks without knn_updated_at (added since the last run)
+    get their neighbours computed, against all chunks. dimension is the one of the embedding model.
+    """
+    start = time.time()
+    top_k = int(os.environ.get('KNN_TOP_K', KNN_TOP_K))
+    element_ids, is_new, embeddings = load_chunk_embeddings(driver, database, int(os.environ.get('KNN_FETCH_SIZE', KNN_FETCH_SIZE)), dimension)
+    query_indices = np.nonzero(is_new)[0] if incremental else np.arange(len(element_ids))
+    logging.info(f"Loaded {len(element_ids)} chunk embeddings in {time.time() - start:.2f} seconds, computing neighbours of {len(query_indices)} chunks")
+    if len(query_indices) == 0:
+        return 0
+    embeddings = normalize_rows(embeddings)
+    neighbours = top_k_neighbours(embeddings, query_indices, top_k, knn_min_score,
+                                  int(os.environ.get('KNN_QUERY_BLOCK_SIZE', KNN_QUERY_BLOCK_SIZE)),
+                                  int(os.environ.get('KNN_CORPUS_BLOCK_SIZE', KNN_CORPUS_BLOCK_SIZE)))
+    relationship_count = write_similar_relationships(driver, database, element_ids, neighbours, query_indices,
+                                                     int(os.environ.get('KNN_WRITE_BATCH_SIZE', KNN_WRITE_BATCH_SIZE)))
+    logging.info(f"Wrote {relationship_count} SIMILAR relationships for {len(query_indices)} chunks in {time.time() - start:.2f} seconds")
+    return relationship_count
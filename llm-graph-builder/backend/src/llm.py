@@ -1,31 +1,36 @@
 import logging
 from langchain.docstore.document import Document
 import os
-from langchain_openai import ChatOpenAI, AzureChatOpenAI
-from langchain_google_vertexai import ChatVertexAI
-from langchain_groq import ChatGroq
-from langchain_google_vertexai import HarmBlockThreshold, HarmCategory
-from langchain_experimental.graph_transformers.diffbot import DiffbotGraphTransformer
-import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor
-from langchain_experimental.graph_transformers import LLMGraphTransformer
+import sys
+import asyncio
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_anthropic import ChatAnthropic
-from langchain_fireworks import ChatFireworks
-from langchain_aws import ChatBedrock
-from langchain_community.chat_models import ChatOllama
-import boto3
-import google.auth
 from src.shared.constants import MODEL_VERSIONS
+from src.shared.llm_scheduler import get_extraction_scheduler
+from src.shared.extraction_cache import get_extraction_cache, get_extraction_cache_key, graph_document_from_json
 
 
+def is_llm_instance(llm, module_name: str, class_names: tuple):
+    """
+    isinstance check against provider classes that doesn't import the provider: the provider packages are
+    imported on the first get_llm call for that provider, if the module was never imported llm can't be one of its classes.
+    """
+    module = sys.modules.get(module_name)
+    if module is None:
+        return False
+    return isinstance(llm, tuple(getattr(module, class_name) for class_name in class_names))
+
 def get_llm(model: str):
-    """Retrieve the specified language model based on the model name."""
+    """
+    Retrieve the specified language model based on the model name.
+    Provider packages are imported here, on the first call for that provider, and not when the module is loaded.
+    """
     env_key = "LLM_MODEL_CONFIG_" + model
     env_value = os.environ.get(env_key)
     logging.info("Model: {}".format(env_key))
 
     if "gemini" in model:
+        import google.auth
+        from langchain_google_vertexai import ChatVertexAI, HarmBlockThreshold, HarmCategory
         model_name = env_value
         credentials, project_id = google.auth.default()
         #model_name = MODEL_VERSIONS[model]
@@ -44,6 +49,7 @@ def get_llm(model: str):
             },
         )
     elif "openai" in model:
+        from langchain_openai import ChatOpenAI
         #model_name = MODEL_VERSIONS[model]
         model_name, api_key = env_value.split(",")
         llm = ChatOpenAI(
@@ -53,6 +59,7 @@ def get_llm(model: str):
         )
 
     elif "azure" in model:
+        from langchain_openai import AzureChatOpenAI
         model_name, api_endpoint, api_key, api_version = env_value.split(",")
         llm = AzureChatOpenAI(
             api_key=api_key,
@@ -65,20 +72,25 @@ def get_llm(model: str):
         )
 
     elif "anthropic" in model:
+        from langchain_anthropic import ChatAnthropic
         model_name, api_key = env_value.split(",")
         llm = ChatAnthropic(
             api_key=api_key, model=model_name, temperature=0, timeout=None
         )
 
     elif "fireworks" in model:
+        from langchain_fireworks import ChatFireworks
         model_name, api_key = env_value.split(",")
         llm = ChatFireworks(api_key=api_key, model=model_name)
 
     elif "groq" in model:
+        from langchain_groq import ChatGroq
         model_name, base_url, api_key = env_value.split(",")
         llm = ChatGroq(api_key=api_key, model_name=model_name, temperature=0)
 
     elif "bedrock" in model:
+        import boto3
+        from langchain_aws import ChatBedrock
         model_name, aws_access_key, aws_secret_key, region_name = env_value.split(",")
         bedrock_client = boto3.client(
             service_name="bedrock-runtime",
@@ -92,10 +104,12 @@ def get_llm(model: str):
         )
 
     elif "ollama" in model:
+        from langchain_community.chat_models import ChatOllama
         model_name, base_url = env_value.split(",")
         llm = ChatOllama(base_url=base_url, model=model_name)
 
     elif "diffbot" in model:
+        from langchain_experimental.graph_transformers.diffbot import DiffbotGraphTransformer
         #model_name = "diffbot"
         model_name, api_key = env_value.split(",")
         llm = DiffbotGraphTransformer(
@@ -104,6 +118,7 @@ def get_llm(model: str):
         )
 
     else:
+        from langchain_openai import ChatOpenAI
         model_name, api_endpoint, api_key = env_value.split(",")
         llm = ChatOpenAI(
             api_key=api_key,
@@ -146,10 +161,13 @@ def get_combined_chunks(chunkId_chunkDoc_list):
 
 
 async def get_graph_document_list(
-    llm, combined_chunk_document_list, allowedNodes, allowedRelationship
+    llm, combined_chunk_document_list, allowedNodes, allowedRelationship, model=None
 ):
-    futures = []
-    graph_document_list = []
+    """
+    Extract one graph document per combined chunk. Every chunk is a separate request scheduled through the
+    extraction scheduler of the model, which caps concurrency, applies the requests per minute limit and
+    retries rate limited requests. Diffbot's transformer is synchronous, so it runs in a worker thread.
+    """
     if "diffbot_api_key" in dir(llm):
         llm_transformer = llm
     else:
@@ -159,6 +177,7 @@ async def get_graph_document_list(
         else:
             node_properties = ["description"]
             relationship_properties = ["description"]
+        from langchain_experimental.graph_transformers import LLMGraphTransformer
         llm_transformer = LLMGraphTransformer(
             llm=llm,
             node_properties=node_properties,
@@ -168,27 +187,27 @@ async def get_graph_document_list(
             ignore_tool_usage=True,
             #prompt = ChatPromptTemplate.from_messages(["system",PROMPT_TO_ALL_LLMs])
         )
-    # with ThreadPoolExecutor(max_workers=10) as executor:
-    #     for chunk in combined_chunk_document_list:
-    #         chunk_doc = Document(
-    #             page_content=chunk.page_content.encode("utf-8"), metadata=chunk.metadata
-    #         )
-    #         futures.append(
-    #             executor.submit(llm_transformer.convert_to_graph_documents, [chunk_doc])
-    #         )
-
-    #     for i, future in enumerate(concurrent.futures.as_completed(futures)):
-    #         graph_document = future.result()
-    #         graph_document_list.append(graph_document[0])
-
-    if isinstance(llm,DiffbotGraphTransformer):
-        graph_document_list = llm_transformer.convert_to_graph_documents(combined_chunk_document_list)
+    scheduler = get_extraction_scheduler(model or type(llm).__name__)
+    if is_llm_instance(llm, "langchain_experimental.graph_transformers.diffbot", ("DiffbotGraphTransformer",)):
+        async def convert_chunk(chunk_document):
+            return await asyncio.to_thread(llm_transformer.convert_to_graph_documents, [chunk_document])
     else:
-        graph_document_list = await llm_transformer.aconvert_to_graph_documents(combined_chunk_document_list)
+        async def convert_chunk(chunk_document):
+            return await llm_transformer.aconvert_to_graph_documents([chunk_document])
+
+    results = await asyncio.gather(
+        *[scheduler.run(convert_chunk, chunk_document) for chunk_document in combined_chunk_document_list]
+    )
+    graph_document_list = [graph_document for result in results for graph_document in result]
     return graph_document_list
 
 
-async def get_graph_from_llm(model, chunkId_chunkDoc_list, allowedNodes, allowedRelationship):
+async def get_graph_from_llm(model, chunkId_chunkDoc_list, allowedNodes, allowedRelationship, cache_stats=None):
+    """
+    Extract graph documents for the combined chunks. When EXTRACTION_CACHE_ENABLED is set, combined chunks already
+    extracted with the same model and allowed schema are served from the extraction cache and only the misses are
+    sent to the LLM. Hit and miss counts are added to cache_stats when it is given.
+    """
 
     llm, model_name = get_llm(model)
     combined_chunk_document_list = get_combined_chunks(chunkId_chunkDoc_list)
@@ -202,7 +221,38 @@ async def get_graph_from_llm(model, chunkId_chunkDoc_list, allowedNodes, allowed
     else:
         allowedRelationship = allowedRelationship.split(',')
 
-    graph_document_list = await get_graph_document_list(
-        llm, combined_chunk_document_list, allowedNodes, allowedRelationship
-    )
-    return graph_document_list
+    extraction_cache = get_extraction_cache()
+    if extraction_cache is None:
+        return await get_graph_document_list(
+            llm, combined_chunk_document_list, allowedNodes, allowedRelationship, model
+        )
+
+    cache_model_name = f"{model}:{model_name}"
+    graph_document_list = [None] * len(combined_chunk_document_list)
+    cache_keys = [get_extraction_cache_key(combined_chunk_document.page_content, cache_model_name, allowedNodes, allowedRelationship)
+                  for combined_chunk_document in combined_chunk_document_list]
+    # the SQLite reads and writes of the cache run in a thread, off the event loop
+    cached_values = await asyncio.to_thread(list, map(extraction_cache.get, cache_keys))
+    missing_indexes = []
+    for index, (combined_chunk_document, cached_value) in enumerate(zip(combined_chunk_document_list, cached_values)):
+        if cached_value is None:
+            missing_indexes.append(index)
+        else:
+            graph_document_list[index] = graph_document_from_json(cached_value, combined_chunk_document)
+    logging.info(f"Extraction cache: {len(combined_chunk_document_list) - len(missing_indexes)} hits, {len(missing_indexes)} misses")
+    if cache_stats is not None:
+        cache_stats["extraction_cache_hits"] = cache_stats.get("extraction_cache_hits", 0) + len(combined_chunk_document_list) - len(missing_indexes)
+        cache_stats["extraction_cache_misses"] = cache_stats.get("extraction_cache_misses", 0) + len(missing_indexes)
+
+    if missing_indexes:
+        missing_documents = [combined_chunk_document_list[index] for index in missing_indexes]
+        extracted_documents = await get_graph_document_list(
+            llm, missing_documents, allowedNodes, allowedRelationship, model
+        )
+        # the transformers return one graph document per input document, in order
+        for index, graph_document in zip(missing_indexes, extracted_documents):
+            graph_document_list[index] = graph_document
+        # an empty result is usually a failed or truncated LLM call, it is extracted again next time instead of cached
+        await asyncio.to_thread(extraction_cache.put_many, [(cache_keys[index], graph_document) for index, graph_document in zip(missing_indexes, extracted_documents)
+                                                            if graph_document.nodes or graph_document.relationships])
+    return [graph_document for graph_document in graph_document_list if graph_document is not None]
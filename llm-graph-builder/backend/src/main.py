@@ -1,4 +1,3 @@
-from langchain_community.graphs import Neo4jGraph
 from src.shared.constants import (BUCKET_UPLOAD, PROJECT_ID, QUERY_TO_GET_CHUNKS,
                                   QUERY_TO_DELETE_EXISTING_ENTITIES,
                                   QUERY_TO_GET_LAST_PROCESSED_CHUNK_POSITION,
@@ -6,8 +5,12 @@ from src.shared.constants import (BUCKET_UPLOAD, PROJECT_ID, QUERY_TO_GET_CHUNKS
                                   START_FROM_BEGINNING,
                                   START_FROM_LAST_PROCESSED_POSITION,
                                   DELETE_ENTITIES_AND_START_FROM_BEGINNING,
-                                  QUERY_TO_GET_NODES_AND_RELATIONS_OF_A_DOCUMENT)
+                                  QUERY_TO_GET_NODES_AND_RELATIONS_OF_A_DOCUMENT,
+                                  QUERY_TO_GET_DOCUMENT_CHUNK_IDS,
+                                  QUERY_TO_DELETE_CHUNK_ORDER_OF_A_DOCUMENT,
+                                  QUERY_TO_DETACH_VANISHED_CHUNKS)
 from src.shared.schema_extraction import schema_extraction_from_text
+from src.shared.extraction_cache import get_extraction_cache
 from langchain_community.document_loaders import GoogleApiClient, GoogleApiYoutubeLoader
 from dotenv import load_dotenv
 from datetime import datetime
@@ -32,6 +35,9 @@ import sys
 import shutil
 import urllib.parse
 import json
+import asyncio
+import collections
+import threading
 
 warnings.filterwarnings("ignore")
 load_dotenv()
@@ -216,10 +222,12 @@ async def extract_graph_from_file_local_file(uri, userName, password, database,
     gcs_file_cache = os.environ.get('GCS_FILE_CACHE')
     if gcs_file_cache == 'True':
       folder_name = create_gcs_bucket_folder_name_hashed(uri, fileName)
-      file_name, pages = get_documents_from_gcs( PROJECT_ID, BUCKET_UPLOAD, folder_name, fileName)
+      file_name, pages = await asyncio.to_thread(get_documents_from_gcs, PROJECT_ID, BUCKET_UPLOAD, folder_name, fileName)
     else:
-      file_name, pages, file_extension = get_documents_from_file_by_path(merged_file_path,fileName)
-    if pages==None or len(pages)==0:
+      # non-PDF files are parsed in a parse process, wait for it off the event loop
+      file_name, pages, file_extension = await asyncio.to_thread(get_documents_from_file_by_path, merged_file_path, fileName)
+    # pages of local PDFs are a generator, get_pages_lazily returns an empty list for empty files
+    if pages==None or (isinstance(pages, list) and len(pages)==0):
       raise Exception(f'File content is not available for file : {file_name}')
     return await processing_source(uri, userName, password, database, model, file_name, pages, allowedNodes, allowedRelationship, True, merged_file_path)
   else:
@@ -231,7 +239,7 @@ async def extract_graph_from_file_s3(uri, userName, password, database, model, s
       raise Exception('Please provide AWS access and secret keys')
     else:
       logging.info("Insert in S3 Block")
-      file_name, pages = get_documents_from_s3(source_url, aws_access_key_id, aws_secret_access_key)
+      file_name, pages = await asyncio.to_thread(get_documents_from_s3, source_url, aws_access_key_id, aws_secret_access_key)
 
     if pages==None or len(pages)==0:
       raise Exception(f'File content is not available for file : {file_name}')
@@ -270,7 +278,7 @@ async def extract_graph_from_file_Wikipedia(uri, userName, password, database, m
 
 async def extract_graph_from_file_gcs(uri, userName, password, database, model, gcs_project_id, gcs_bucket_name, gcs_bucket_folder, gcs_blob_filename, access_token, file_name, allowedNodes, allowedRelationship, retry_condition):
   if retry_condition is None:
-    file_name, pages = get_documents_from_gcs(gcs_project_id, gcs_bucket_name, gcs_bucket_folder, gcs_blob_filename, access_token)
+    file_name, pages = await asyncio.to_thread(get_documents_from_gcs, gcs_project_id, gcs_bucket_name, gcs_bucket_folder, gcs_blob_filename, access_token)
     if pages==None or len(pages)==0:
       raise Exception(f'File content is not available for file : {file_name}')
     return await processing_source(uri, userName, password, database, model, file_name, pages, allowedNodes, allowedRelationship)
@@ -304,13 +312,37 @@ async def processing_source(uri, userName, password, database, model, file_name,
   uri_latency["create_connection"] = f'{elapsed_create_connection:.2f}'
   graphDb_data_Access = graphDBdataAccess(graph)
 
-  start_get_chunkId_chunkDoc_list = time.time()
-  total_chunks, chunkId_chunkDoc_list = get_chunkId_chunkDoc_list(graph, file_name, pages, retry_condition)
-  end_get_chunkId_chunkDoc_list = time.time()
-  elapsed_get_chunkId_chunkDoc_list = end_get_chunkId_chunkDoc_list - start_get_chunkId_chunkDoc_list
-  logging.info(f'Time taken to create list chunkids with chunk document: {elapsed_get_chunkId_chunkDoc_list:.2f} seconds')
-  uri_latency["create_list_chunk_and_document"] = f'{elapsed_get_chunkId_chunkDoc_list:.2f}'
-  uri_latency["total_chunks"] = total_chunks
+  # the chunks of a new document are created batch by batch while the batches are processed, the chunks of a
+  # retry are read back from the graph
+  update_graph_chunk_processed = int(os.environ.get('UPDATE_GRAPH_CHUNKS_PROCESSED'))
+  chunk_stats = {"total_chunks": None, "reused_chunks": 0, "chunking_time": 0.0}
+  is_reusing_chunks = False
+  is_incremental_reingest = os.environ.get('ENABLE_INCREMENTAL_REINGEST', 'False').upper() == "TRUE"
+  if retry_condition is None and is_incremental_reingest:
+    existing_chunks = graph.query(QUERY_TO_GET_DOCUMENT_CHUNK_IDS, params={"filename":file_name, "require_embedding":is_chunk_embedding_required()})
+    is_reusing_chunks = any(row['processed'] for row in existing_chunks)
+    chunk_batches = get_changed_chunk_batches(graph, file_name, pages, update_graph_chunk_processed, existing_chunks, chunk_stats)
+  elif retry_condition is None:
+    chunk_batches = get_chunk_batches(graph, file_name, pages, update_graph_chunk_processed, chunk_stats)
+  else:
+    start_get_chunkId_chunkDoc_list = time.time()
+    if retry_condition == START_FROM_LAST_PROCESSED_POSITION and is_incremental_reingest:
+      # after an incremental re-ingest the processed chunks are not a prefix of the document, resume from the graph state
+      total_chunks, chunkId_chunkDoc_list = get_chunkId_chunkDoc_list(graph, file_name, pages, START_FROM_BEGINNING)
+      processed_chunk_ids = get_processed_chunk_ids(graph, file_name)
+      chunkId_chunkDoc_list = [chunk for chunk in chunkId_chunkDoc_list if chunk['chunk_id'] not in processed_chunk_ids]
+      if not chunkId_chunkDoc_list:
+        raise Exception(f"All chunks of {file_name} are alreday processed. If you want to re-process, Please start from begnning")
+      chunk_stats["reused_chunks"] = total_chunks - len(chunkId_chunkDoc_list)
+      is_reusing_chunks = chunk_stats["reused_chunks"] > 0
+    else:
+      total_chunks, chunkId_chunkDoc_list = get_chunkId_chunkDoc_list(graph, file_name, pages, retry_condition)
+    chunk_stats["total_chunks"] = total_chunks
+    chunk_stats["chunking_time"] = time.time() - start_get_chunkId_chunkDoc_list
+    chunk_batches = iter([(i, min(i+update_graph_chunk_processed, len(chunkId_chunkDoc_list)), chunkId_chunkDoc_list[i:i+update_graph_chunk_processed])
+                          for i in range(0, len(chunkId_chunkDoc_list), update_graph_chunk_processed)])
+  # a next() of a cancelled iterate_in_thread can still run in its thread when finish_chunk_batches drains the batches
+  chunk_batches = LockedIterator(chunk_batches)
 
   start_status_document_node = time.time()
   result = graphDb_data_Access.get_current_status_document_node(file_name)
@@ -329,12 +361,18 @@ async def processing_source(uri, userName, password, database, model, file_name,
       status = "Processing"
       obj_source_node.file_name = file_name
       obj_source_node.status = status
-      obj_source_node.total_chunks = total_chunks
+      obj_source_node.total_chunks = chunk_stats["total_chunks"]
       obj_source_node.model = model
-      if retry_condition == START_FROM_LAST_PROCESSED_POSITION:
+      if retry_condition == START_FROM_LAST_PROCESSED_POSITION and not is_incremental_reingest:
           node_count = result[0]['nodeCount']
           rel_count = result[0]['relationshipCount']
           select_chunks_with_retry = result[0]['processed_chunk']
+      elif is_reusing_chunks:
+          # incremental re-ingest or its resume: processed chunks keep their entities and count as processed
+          document_counts = graph.query(QUERY_TO_GET_NODES_AND_RELATIONS_OF_A_DOCUMENT, params={"filename":file_name})
+          node_count = document_counts[0]['nodes']
+          rel_count = document_counts[0]['rels']
+          select_chunks_with_retry = chunk_stats["reused_chunks"]
       obj_source_node.processed_chunk = 0+select_chunks_with_retry
       logging.info(file_name)
       logging.info(obj_source_node)
@@ -347,48 +385,73 @@ async def processing_source(uri, userName, password, database, model, file_name,
       uri_latency["update_source_node"] = f'{elapsed_update_source_node:.2f}'
 
       logging.info('Update the status as Processing')
-      update_graph_chunk_processed = int(os.environ.get('UPDATE_GRAPH_CHUNKS_PROCESSED'))
+      if os.getenv('IS_EMBEDDING', 'False').upper() == "TRUE":
+        start_create_vector_index = time.time()
+        create_chunk_vector_index(graph)
+        elapsed_create_vector_index = time.time() - start_create_vector_index
+        logging.info(f'Time taken to check and create the chunk vector index: {elapsed_create_vector_index:.2f} seconds')
+        uri_latency["create_vector_index"] = f'{elapsed_create_vector_index:.2f}'
       # selected_chunks = []
       is_cancelled_status = False
       job_status = "Completed"
-      for i in range(0, len(chunkId_chunkDoc_list), update_graph_chunk_processed):
-        select_chunks_upto = i+update_graph_chunk_processed
-        logging.info(f'Selected Chunks upto: {select_chunks_upto}')
-        if len(chunkId_chunkDoc_list) <= select_chunks_upto:
-          select_chunks_upto = len(chunkId_chunkDoc_list)
-        selected_chunks = chunkId_chunkDoc_list[i:select_chunks_upto]
-
-        result = graphDb_data_Access.get_current_status_document_node(file_name)
-        is_cancelled_status = result[0]['is_cancelled']
-        logging.info(f"Value of is_cancelled : {result[0]['is_cancelled']}")
-        if bool(is_cancelled_status) == True:
-          job_status = "Cancelled"
-          logging.info('Exit from running loop of processing file')
-          break
+
+      def update_processed_chunk_progress(select_chunks_upto, node_count, rel_count):
+        end_time = datetime.now()
+        processed_time = end_time - start_time
+
+        obj_source_node = sourceNode()
+        obj_source_node.file_name = file_name
+        obj_source_node.updated_at = end_time
+        obj_source_node.processing_time = processed_time
+        obj_source_node.processed_chunk = select_chunks_upto+select_chunks_with_retry
+        if retry_condition == START_FROM_BEGINNING or is_reusing_chunks:
+          result = graph.query(QUERY_TO_GET_NODES_AND_RELATIONS_OF_A_DOCUMENT, params={"filename":file_name})
+          obj_source_node.node_count = result[0]['nodes']
+          obj_source_node.relationship_count = result[0]['rels']
+        else:
+          obj_source_node.node_count = node_count
+          obj_source_node.relationship_count = rel_count
+        graphDb_data_Access.update_source_node(obj_source_node)
+
+      is_pipelined_processing = os.environ.get('ENABLE_PIPELINED_PROCESSING', 'False').upper() == "TRUE"
+      try:
+        if is_pipelined_processing:
+          node_count, rel_count, job_status = await processing_chunks_pipelined(iterate_in_thread(chunk_batches), graph, graphDb_data_Access, file_name, model, allowedNodes, allowedRelationship,
+                                                                                 node_count, rel_count, uri_latency, update_processed_chunk_progress)
         else:
-          processing_chunks_start_time = time.time()
-          node_count,rel_count,latency_processed_chunk = await processing_chunks(selected_chunks,graph,uri, userName, password, database,file_name,model,allowedNodes,allowedRelationship,node_count, rel_count)
-          processing_chunks_end_time = time.time()
-          processing_chunks_elapsed_end_time = processing_chunks_end_time - processing_chunks_start_time
-          logging.info(f"Time taken {update_graph_chunk_processed} chunks processed upto {select_chunks_upto} completed in {processing_chunks_elapsed_end_time:.2f} seconds for file name {file_name}")
-          uri_latency[f'processed_combine_chunk_{i}-{select_chunks_upto}'] = f'{processing_chunks_elapsed_end_time:.2f}'
-          uri_latency[f'processed_chunk_detail_{i}-{select_chunks_upto}'] = latency_processed_chunk
-          end_time = datetime.now()
-          processed_time = end_time - start_time
-
-          obj_source_node = sourceNode()
-          obj_source_node.file_name = file_name
-          obj_source_node.updated_at = end_time
-          obj_source_node.processing_time = processed_time
-          obj_source_node.processed_chunk = select_chunks_upto+select_chunks_with_retry
-          if retry_condition == START_FROM_BEGINNING:
-            result = graph.query(QUERY_TO_GET_NODES_AND_RELATIONS_OF_A_DOCUMENT, params={"filename":file_name})
-            obj_source_node.node_count = result[0]['nodes']
-            obj_source_node.relationship_count = result[0]['rels']
-          else:
-            obj_source_node.node_count = node_count
-            obj_source_node.relationship_count = rel_count
-          graphDb_data_Access.update_source_node(obj_source_node)
+          async for i, select_chunks_upto, selected_chunks in iterate_in_thread(chunk_batches):
+            logging.info(f'Selected Chunks upto: {select_chunks_upto}')
+            result = graphDb_data_Access.get_current_status_document_node(file_name)
+            is_cancelled_status = result[0]['is_cancelled']
+            logging.info(f"Value of is_cancelled : {result[0]['is_cancelled']}")
+            if bool(is_cancelled_status) == True:
+              job_status = "Cancelled"
+              logging.info('Exit from running loop of processing file')
+              break
+            else:
+              processing_chunks_start_time = time.time()
+              node_count,rel_count,latency_processed_chunk = await processing_chunks(selected_chunks,graph,uri, userName, password, database,file_name,model,allowedNodes,allowedRelationship,node_count, rel_count)
+              processing_chunks_end_time = time.time()
+              processing_chunks_elapsed_end_time = processing_chunks_end_time - processing_chunks_start_time
+              logging.info(f"Time taken {update_graph_chunk_processed} chunks processed upto {select_chunks_upto} completed in {processing_chunks_elapsed_end_time:.2f} seconds for file name {file_name}")
+              uri_latency[f'processed_combine_chunk_{i}-{select_chunks_upto}'] = f'{processing_chunks_elapsed_end_time:.2f}'
+              uri_latency[f'processed_chunk_detail_{i}-{select_chunks_upto}'] = latency_processed_chunk
+              update_processed_chunk_progress(select_chunks_upto, node_count, rel_count)
+      except Exception:
+        # a retry reads the chunks back from the graph, write the ones this run did not reach
+        await finish_chunk_batches(chunk_batches, file_name)
+        raise
+      if job_status == "Cancelled":
+        await finish_chunk_batches(chunk_batches, file_name)
+      uri_latency["create_list_chunk_and_document"] = f'{chunk_stats["chunking_time"]:.2f}'
+      uri_latency["total_chunks"] = chunk_stats["total_chunks"]
+      if is_incremental_reingest:
+        uri_latency["reused_chunks"] = chunk_stats["reused_chunks"]
+
+      if get_extraction_cache() is not None:
+        batch_latencies = [value for key, value in uri_latency.items() if key.startswith('processed_chunk_detail_')]
+        uri_latency["extraction_cache_hits"] = sum(latency.get("extraction_cache_hits", 0) for latency in batch_latencies)
+        uri_latency["extraction_cache_misses"] = sum(latency.get("extraction_cache_misses", 0) for latency in batch_latencies)
 
       result = graphDb_data_Access.get_current_status_document_node(file_name)
       is_cancelled_status = result[0]['is_cancelled']
@@ -402,6 +465,16 @@ async def processing_source(uri, userName, password, database, model, file_name,
       obj_source_node.file_name = file_name
       obj_source_node.status = job_status
       obj_source_node.processing_time = processed_time
+      obj_source_node.total_chunks = chunk_stats["total_chunks"]
+      if job_status == "Completed":
+        obj_source_node.processed_chunk = chunk_stats["total_chunks"]
+      if is_reusing_chunks:
+        # vanished chunks and their entities are only removed once every chunk was read
+        document_counts = graph.query(QUERY_TO_GET_NODES_AND_RELATIONS_OF_A_DOCUMENT, params={"filename":file_name})
+        node_count = document_counts[0]['nodes']
+        rel_count = document_counts[0]['rels']
+        obj_source_node.node_count = node_count
+        obj_source_node.relationship_count = rel_count
 
       graphDb_data_Access.update_source_node(obj_source_node)
       logging.info('Updated the nodeCount and relCount properties in Document node')
@@ -443,44 +516,136 @@ async def processing_source(uri, userName, password, database, model, file_name,
 
 async def processing_chunks(chunkId_chunkDoc_list,graph,uri, userName, password, database,file_name,model,allowedNodes,allowedRelationship, node_count, rel_count):
   #create vector index and update chunk node with embedding
-  if graph is not None:
-    if graph._driver._closed:
-      graph = create_graph_database_connection(uri, userName, password, database)
-  else:
-    graph = create_graph_database_connection(uri, userName, password, database)
+  latency_processing_chunk = embed_chunks(graph, chunkId_chunkDoc_list, file_name)
+  graph_documents = await extract_graph_documents(model, chunkId_chunkDoc_list, allowedNodes, allowedRelationship, latency_processing_chunk)
+  save_graph_documents(graph, graph_documents, chunkId_chunkDoc_list, latency_processing_chunk)
+  node_count, rel_count = count_nodes_and_relationships(graph_documents, node_count, rel_count)
+  return node_count,rel_count,latency_processing_chunk
 
+async def processing_chunks_pipelined(chunk_batches, graph, graphDb_data_Access, file_name, model, allowedNodes, allowedRelationship, node_count, rel_count, uri_latency, update_progress):
+  """
+  Process chunk batches with the embedding, entity extraction and graph write stages overlapping.
+
+  Up to MAX_BATCHES_IN_FLIGHT batches are extracted concurrently and the stages are connected by
+  bounded queues of the same size. Batches are written in their original order, so processed_chunk
+  on the Document node always points at a contiguous prefix of the file. The cancellation flag is
+  checked before each batch enters the pipeline; batches that have not been extracted yet when the
+  job is cancelled are dropped.
+
+  Args:
+    chunk_batches: async iterator of (start, end, chunkId_chunkDoc_list) tuples
+    update_progress: callable(select_chunks_upto, node_count, rel_count) updating the Document node
+
+  Returns:
+    node_count, rel_count and the job status ("Completed" or "Cancelled")
+  """
+  max_batches_in_flight = max(1, int(os.environ.get('MAX_BATCHES_IN_FLIGHT', '2')))
+  logging.info(f'Pipelined processing of chunk batches with {max_batches_in_flight} batches in flight')
+  embedded_queue = asyncio.Queue(maxsize=max_batches_in_flight)
+  extracted_queue = asyncio.Queue(maxsize=max_batches_in_flight)
+  is_cancelled = asyncio.Event()
+  counts = {"node_count": node_count, "rel_count": rel_count}
+
+  async def embed_stage():
+    try:
+      batch_index = -1
+      async for i, select_chunks_upto, selected_chunks in chunk_batches:
+        batch_index += 1
+        result = await asyncio.to_thread(graphDb_data_Access.get_current_status_document_node, file_name)
+        logging.info(f"Value of is_cancelled : {result[0]['is_cancelled']}")
+        if bool(result[0]['is_cancelled']) == True:
+          logging.info('Exit from running pipeline of processing file')
+          is_cancelled.set()
+          break
+        latency_processing_chunk = await asyncio.to_thread(embed_chunks, graph, selected_chunks, file_name)
+        await embedded_queue.put((batch_index, i, select_chunks_upto, selected_chunks, latency_processing_chunk, time.time()))
+    finally:
+      for _ in range(max_batches_in_flight):
+        await embedded_queue.put(None)
+
+  async def extract_stage():
+    try:
+      while True:
+        item = await embedded_queue.get()
+        if item is None:
+          break
+        batch_index, i, select_chunks_upto, selected_chunks, latency_processing_chunk, batch_start_time = item
+        if is_cancelled.is_set():
+          continue
+        graph_documents = await extract_graph_documents(model, selected_chunks, allowedNodes, allowedRelationship, latency_processing_chunk)
+        await extracted_queue.put((batch_index, i, select_chunks_upto, selected_chunks, graph_documents, latency_processing_chunk, batch_start_time))
+    finally:
+      await extracted_queue.put(None)
+
+  async def write_stage():
+    pending_batches = {}
+    next_batch_index = 0
+    finished_extract_workers = 0
+    while finished_extract_workers < max_batches_in_flight:
+      item = await extracted_queue.get()
+      if item is None:
+        finished_extract_workers += 1
+        continue
+      pending_batches[item[0]] = item
+      while next_batch_index in pending_batches:
+        _, i, select_chunks_upto, selected_chunks, graph_documents, latency_processing_chunk, batch_start_time = pending_batches.pop(next_batch_index)
+        await asyncio.to_thread(save_graph_documents, graph, graph_documents, selected_chunks, latency_processing_chunk)
+        counts["node_count"], counts["rel_count"] = count_nodes_and_relationships(graph_documents, counts["node_count"], counts["rel_count"])
+        elapsed_batch_time = time.time() - batch_start_time
+        logging.info(f"Time taken chunks processed upto {select_chunks_upto} completed in {elapsed_batch_time:.2f} seconds for file name {file_name}")
+        uri_latency[f'processed_combine_chunk_{i}-{select_chunks_upto}'] = f'{elapsed_batch_time:.2f}'
+        uri_latency[f'processed_chunk_detail_{i}-{select_chunks_upto}'] = latency_processing_chunk
+        await asyncio.to_thread(update_progress, select_chunks_upto, counts["node_count"], counts["rel_count"])
+        next_batch_index += 1
+
+  stage_tasks = [asyncio.create_task(embed_stage()), asyncio.create_task(write_stage())]
+  stage_tasks += [asyncio.create_task(extract_stage()) for _ in range(max_batches_in_flight)]
+  try:
+    await asyncio.gather(*stage_tasks)
+  except Exception:
+    for task in stage_tasks:
+      task.cancel()
+    raise
+
+  job_status = "Cancelled" if is_cancelled.is_set() else "Completed"
+  return counts["node_count"], counts["rel_count"], job_status
+
+def embed_chunks(graph, chunkId_chunkDoc_list, file_name):
   start_update_embedding = time.time()
   update_embedding_create_vector_index( graph, chunkId_chunkDoc_list, file_name)
   end_update_embedding = time.time()
   elapsed_update_embedding = end_update_embedding - start_update_embedding
   logging.info(f'Time taken to update embedding in chunk node: {elapsed_update_embedding:.2f} seconds')
   latency_processing_chunk = {"update_embedding" : f'{elapsed_update_embedding:.2f}'}
-  logging.info("Get graph document list from models")
+  return latency_processing_chunk
 
+async def extract_graph_documents(model, chunkId_chunkDoc_list, allowedNodes, allowedRelationship, latency_processing_chunk):
+  logging.info("Get graph document list from models")
   start_entity_extraction = time.time()
-  graph_documents =  await get_graph_from_llm(model, chunkId_chunkDoc_list, allowedNodes, allowedRelationship)
+  graph_documents =  await get_graph_from_llm(model, chunkId_chunkDoc_list, allowedNodes, allowedRelationship, latency_processing_chunk)
   end_entity_extraction = time.time()
   elapsed_entity_extraction = end_entity_extraction - start_entity_extraction
   logging.info(f'Time taken to extract enitities from LLM Graph Builder: {elapsed_entity_extraction:.2f} seconds')
   latency_processing_chunk["entity_extraction"] = f'{elapsed_entity_extraction:.2f}'
-  cleaned_graph_documents = handle_backticks_nodes_relationship_id_type(graph_documents)
+  return handle_backticks_nodes_relationship_id_type(graph_documents)
+
+def save_graph_documents(graph, cleaned_graph_documents, chunkId_chunkDoc_list, latency_processing_chunk):
+  chunks_and_graphDocuments_list = get_chunk_and_graphDocument(cleaned_graph_documents, chunkId_chunkDoc_list)
 
   start_save_graphDocuments = time.time()
-  save_graphDocuments_in_neo4j(graph, cleaned_graph_documents)
+  if create_entity_id_constraint(graph):
+    row_count = write_graph_documents_with_chunk_entities(graph, chunks_and_graphDocuments_list)
+  else:
+    row_count = write_graph_documents_with_add_graph_documents(graph, chunks_and_graphDocuments_list)
   end_save_graphDocuments = time.time()
   elapsed_save_graphDocuments = end_save_graphDocuments - start_save_graphDocuments
-  logging.info(f'Time taken to save graph document in neo4j: {elapsed_save_graphDocuments:.2f} seconds')
+  rows_per_second = row_count / elapsed_save_graphDocuments if elapsed_save_graphDocuments > 0 else 0
+  logging.info(f'Time taken to save graph documents and chunk entity relationships in neo4j: {elapsed_save_graphDocuments:.2f} seconds, {rows_per_second:.2f} rows/s')
   latency_processing_chunk["save_graphDocuments"] = f'{elapsed_save_graphDocuments:.2f}'
+  latency_processing_chunk["graph_write_rows"] = row_count
+  latency_processing_chunk["graph_write_rows_per_second"] = f'{rows_per_second:.2f}'
 
-  chunks_and_graphDocuments_list = get_chunk_and_graphDocument(cleaned_graph_documents, chunkId_chunkDoc_list)
-
-  start_relationship = time.time()
-  merge_relationship_between_chunk_and_entites(graph, chunks_and_graphDocuments_list)
-  end_relationship = time.time()
-  elapsed_relationship = end_relationship - start_relationship
-  logging.info(f'Time taken to create relationship between chunk and entities: {elapsed_relationship:.2f} seconds')
-  latency_processing_chunk["relationship_between_chunk_entity"] = f'{elapsed_relationship:.2f}'
-
+def count_nodes_and_relationships(graph_documents, node_count, rel_count):
   distinct_nodes = set()
   relations = []
   for graph_document in graph_documents:
@@ -498,24 +663,20 @@ async def processing_chunks(chunkId_chunkDoc_list,graph,uri, userName, password,
     rel_count += len(relations)
     print(f'node count internal func:{node_count}')
     print(f'relation count internal func:{rel_count}')
-  return node_count,rel_count,latency_processing_chunk
+  return node_count,rel_count
+
+# single pass replacement of the characters removed from page text before chunking
+BAD_CHARS_TRANSLATION = str.maketrans({'"': None, "'": None, "\n": ' '})
 
 def get_chunkId_chunkDoc_list(graph, file_name, pages, retry_condition):
   if retry_condition is None:
     logging.info("Break down file into chunks")
-    bad_chars = ['"', "\n", "'"]
-    for i in range(0,len(pages)):
-      text = pages[i].page_content
-      for j in bad_chars:
-        if j == '\n':
-          text = text.replace(j, ' ')
-        else:
-          text = text.replace(j, '')
-      pages[i]=Document(page_content=str(text), metadata=pages[i].metadata)
+    # pages can be a generator, they are cleaned, chunked and written to the graph as they are read
+    pages = (Document(page_content=str(page.page_content).translate(BAD_CHARS_TRANSLATION), metadata=page.metadata) for page in pages)
     create_chunks_obj = CreateChunksofDocument(pages, graph)
     chunks = create_chunks_obj.split_file_into_chunks()
     chunkId_chunkDoc_list = create_relation_between_chunks(graph,file_name,chunks)
-    return len(chunks), chunkId_chunkDoc_list
+    return len(chunkId_chunkDoc_list), chunkId_chunkDoc_list
 
   else:
     chunkId_chunkDoc_list=[]
@@ -545,6 +706,112 @@ def get_chunkId_chunkDoc_list(graph, file_name, pages, retry_condition):
         logging.info(f"Retry : start_from_beginning with chunks {len(chunkId_chunkDoc_list)}")
         return len(chunks), chunkId_chunkDoc_list
 
+def get_chunk_batches(graph, file_name, pages, batch_size, chunk_stats):
+  """
+  Generator cleaning, chunking and writing the pages of the file batch by batch, it yields
+  (start, end, chunkId_chunkDoc_list) for every batch of batch_size chunks once the batch is written.
+  pages can be a generator: pages are only parsed and chunked as the batches are taken, so the chunk texts
+  of one batch are held at a time instead of the whole file. chunk_stats gets the total number of chunks
+  once all of them are written and the time spent parsing, chunking and writing.
+
+  total_chunks of the Document is set to the number of chunks written so far after every batch, so the
+  progress of a document that is still being chunked is shown from its first batch on, and chunking_completed
+  tells whether all of its chunks are written.
+  """
+  logging.info("Break down file into chunks")
+  batch_start_time = time.time()
+  graphDb_data_Access = graphDBdataAccess(graph)
+  pages = (Document(page_content=str(page.page_content).translate(BAD_CHARS_TRANSLATION), metadata=page.metadata) for page in pages)
+  chunks = CreateChunksofDocument(pages, graph).split_file_into_chunks()
+  end = 0
+  for chunkId_chunkDoc_list in create_relation_between_chunks_in_batches(graph, file_name, chunks, batch_size):
+    start, end = end, end + len(chunkId_chunkDoc_list)
+    obj_source_node = sourceNode()
+    obj_source_node.file_name = file_name
+    obj_source_node.total_chunks = end
+    obj_source_node.chunking_completed = False
+    graphDb_data_Access.update_source_node(obj_source_node)
+    chunk_stats["chunking_time"] += time.time() - batch_start_time
+    yield start, end, chunkId_chunkDoc_list
+    batch_start_time = time.time()
+  chunk_stats["chunking_time"] += time.time() - batch_start_time
+  chunk_stats["total_chunks"] = end
+  obj_source_node = sourceNode()
+  obj_source_node.file_name = file_name
+  obj_source_node.chunking_completed = True
+  graphDb_data_Access.update_source_node(obj_source_node)
+
+def get_changed_chunk_batches(graph, file_name, pages, batch_size, existing_chunks, chunk_stats):
+  """
+  Incremental re-ingest of a document that may already have chunks, like get_chunk_batches. Chunk ids are
+  content hashes, so the new chunks are compared with existing_chunks, the Chunk nodes of the Document:
+  - every chunk is written again, which updates position and offsets, and FIRST_CHUNK and NEXT_CHUNK are
+    re-stitched in the new order
+  - only chunks that were fully processed before, embedded and with extracted entities, are reused, the new
+    chunks and the ones an earlier run did not finish are yielded to be embedded and extracted
+  - once every chunk was read, chunks that vanished are detached from the Document, and deleted together
+    with the entities only they mentioned when no other Document has them
+
+  end of a yielded batch counts the reused chunks before it, chunk_stats gets the number of reused chunks.
+  """
+  existing_chunk_ids = {row['id'] for row in existing_chunks}
+  processed_chunk_ids = {row['id'] for row in existing_chunks if row['processed']}
+  if existing_chunk_ids:
+    graph.query(QUERY_TO_DELETE_CHUNK_ORDER_OF_A_DOCUMENT, params={"filename":file_name})
+  chunk_ids = set()
+  for start, end, chunkId_chunkDoc_list in get_chunk_batches(graph, file_name, pages, batch_size, chunk_stats):
+    chunk_ids.update(chunk['chunk_id'] for chunk in chunkId_chunkDoc_list)
+    changed_chunkId_chunkDoc_list = [chunk for chunk in chunkId_chunkDoc_list if chunk['chunk_id'] not in processed_chunk_ids]
+    chunk_stats["reused_chunks"] += len(chunkId_chunkDoc_list) - len(changed_chunkId_chunkDoc_list)
+    if changed_chunkId_chunkDoc_list:
+      yield start, end, changed_chunkId_chunkDoc_list
+
+  vanished_chunk_ids = list(existing_chunk_ids - chunk_ids)
+  if vanished_chunk_ids:
+    graph.query(QUERY_TO_DETACH_VANISHED_CHUNKS, params={"filename":file_name, "chunk_ids":vanished_chunk_ids})
+  reused_chunks = chunk_stats["reused_chunks"]
+  logging.info(f"Incremental re-ingest of {file_name}: {chunk_stats['total_chunks'] - reused_chunks} to process, {reused_chunks} unchanged and {len(vanished_chunk_ids)} vanished chunks")
+
+class LockedIterator:
+  """Iterator taking the items of a blocking iterator one thread at a time, so a generator is never run by two threads at once."""
+
+  def __init__(self, iterator):
+    self.iterator = iterator
+    self.lock = threading.Lock()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    with self.lock:
+      return next(self.iterator)
+
+async def iterate_in_thread(iterator):
+  """Async iterator over a blocking iterator, every item is taken in a worker thread so parsing and writing stay off the event loop."""
+  while True:
+    item = await asyncio.to_thread(next, iterator, None)
+    if item is None:
+      return
+    yield item
+
+async def finish_chunk_batches(chunk_batches, file_name):
+  """
+  Take the remaining batches without processing them, so the chunks of a cancelled or failed run are all written.
+  chunk_batches is a LockedIterator, the drain waits for a batch still being taken by a cancelled iterate_in_thread.
+  """
+  try:
+    await asyncio.to_thread(collections.deque, chunk_batches, 0)
+  except Exception as e:
+    logging.error(f"Unable to write the remaining chunks of {file_name}: {e}")
+
+def is_chunk_embedding_required():
+  return os.environ.get('IS_EMBEDDING', 'False').upper() == "TRUE"
+
+def get_processed_chunk_ids(graph, file_name):
+  """Ids of the chunks of the document that are embedded (when IS_EMBEDDING is set) and have extracted entities."""
+  chunks = graph.query(QUERY_TO_GET_DOCUMENT_CHUNK_IDS, params={"filename":file_name, "require_embedding":is_chunk_embedding_required()})
+  return {row['id'] for row in chunks if row['processed']}
+
 def get_source_list_from_graph(uri,userName,password,db_name=None):
   """
   Args:
@@ -559,11 +826,8 @@ def get_source_list_from_graph(uri,userName,password,db_name=None):
    sorting the list by the last updated date.
  """
   logging.info("Get existing files list from graph")
-  graph = Neo4jGraph(url=uri, database=db_name, username=userName, password=password)
+  graph = create_graph_database_connection(uri, userName, password, db_name)
   graph_DB_dataAccess = graphDBdataAccess(graph)
-  if not graph._driver._closed:
-      logging.info(f"closing connection for sources_list api")
-      graph._driver.close()
   return graph_DB_dataAccess.get_source_list()
 
 def update_graph(graph):
@@ -607,14 +871,72 @@ def merge_chunks_local(file_name, total_chunks, chunk_dir, merged_dir):
 
 
 
-def upload_file(graph, model, chunk, chunk_number:int, total_chunks:int, originalname, uri, chunk_dir, merged_dir):
+def write_chunk_at_offset(chunk, chunk_number:int, total_chunks:int, chunk_size:int, originalname, chunk_dir):
+  """
+  Streaming assembly: write the part straight into the assembled file at (chunk_number - 1) * chunk_size.
+  The file is preallocated for all parts when the first part to arrive creates it, and the part is copied in
+  blocks of UPLOAD_COPY_BLOCK_SIZE, so neither a part nor the file is ever held in memory. The received part
+  numbers are appended to a sidecar file so missing parts are detected before the file is used.
+  """
+  if not os.path.exists(chunk_dir):
+    os.makedirs(chunk_dir, exist_ok=True)
+  assembly_file_path = os.path.join(chunk_dir, f"{originalname}.assembling")
+  if chunk_number == 1:
+    # the frontend uploads parts in order, the first one discards what is left of an earlier failed upload
+    for stale_file_path in (assembly_file_path, f"{assembly_file_path}.parts"):
+      if os.path.exists(stale_file_path):
+        os.unlink(stale_file_path)
+  try:
+    fd = os.open(assembly_file_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+    if hasattr(os, 'posix_fallocate'):
+      os.posix_fallocate(fd, 0, total_chunks * chunk_size)
+  except FileExistsError:
+    fd = os.open(assembly_file_path, os.O_RDWR)
+  try:
+    block_size = int(os.environ.get('UPLOAD_COPY_BLOCK_SIZE', 1024 * 1024))
+    offset = (chunk_number - 1) * chunk_size
+    while True:
+      block = chunk.file.read(block_size)
+      if not block:
+        break
+      os.pwrite(fd, block, offset)
+      offset += len(block)
+  finally:
+    os.close(fd)
+  with open(f"{assembly_file_path}.parts", "a") as parts_file:
+    parts_file.write(f"{chunk_number}\n")
+  # end offset of the part, for the last part this is the size of the file
+  return offset
+
+def finish_chunk_assembly(originalname, total_chunks:int, file_size:int, chunk_dir, merged_dir):
+  assembly_file_path = os.path.join(chunk_dir, f"{originalname}.assembling")
+  with open(f"{assembly_file_path}.parts") as parts_file:
+    received_parts = {int(line) for line in parts_file if line.strip()}
+  missing_parts = set(range(1, total_chunks + 1)) - received_parts
+  if missing_parts:
+    raise Exception(f"Chunks {sorted(missing_parts)[:10]} of {originalname} were not received")
+  # drop the preallocated space beyond the last part
+  os.truncate(assembly_file_path, file_size)
+  if not os.path.exists(merged_dir):
+    os.makedirs(merged_dir, exist_ok=True)
+  merged_file_path = os.path.join(merged_dir, originalname)
+  shutil.move(assembly_file_path, merged_file_path)
+  os.unlink(f"{assembly_file_path}.parts")
+  logging.info(f"Chunks assembled in place into {merged_file_path}")
+  return file_size
+
+def upload_file(graph, model, chunk, chunk_number:int, total_chunks:int, originalname, uri, chunk_dir, merged_dir, chunk_size:int=None):
 
   gcs_file_cache = os.environ.get('GCS_FILE_CACHE')
   logging.info(f'gcs file cache: {gcs_file_cache}')
+  # clients sending the part size get the streaming assembly, the others the part files merged at the end
+  streaming_assembly = chunk_size is not None and gcs_file_cache != 'True'
 
   if gcs_file_cache == 'True':
     folder_name = create_gcs_bucket_folder_name_hashed(uri,originalname)
     upload_file_to_gcs(chunk, chunk_number, originalname, BUCKET_UPLOAD, folder_name)
+  elif streaming_assembly:
+    chunk_end_offset = write_chunk_at_offset(chunk, int(chunk_number), int(total_chunks), int(chunk_size), originalname, chunk_dir)
   else:
     if not os.path.exists(chunk_dir):
       os.mkdir(chunk_dir)
@@ -623,12 +945,14 @@ def upload_file(graph, model, chunk, chunk_number:int, total_chunks:int, origina
     logging.info(f'Chunk File Path: {chunk_file_path}')
 
     with open(chunk_file_path, "wb") as chunk_file:
-      chunk_file.write(chunk.file.read())
+      shutil.copyfileobj(chunk.file, chunk_file)
 
   if int(chunk_number) == int(total_chunks):
       # If this is the last chunk, merge all chunks into a single file
       if gcs_file_cache == 'True':
         file_size = merge_file_gcs(BUCKET_UPLOAD, originalname, folder_name, int(total_chunks))
+      elif streaming_assembly:
+        file_size = finish_chunk_assembly(originalname, int(total_chunks), chunk_end_offset, chunk_dir, merged_dir)
       else:
         file_size = merge_chunks_local(originalname, int(total_chunks), chunk_dir, merged_dir)
 
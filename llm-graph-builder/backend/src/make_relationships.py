@@ -1,21 +1,48 @@
 from langchain_community.graphs import Neo4jGraph
 from langchain.docstore.document import Document
-from src.shared.common_fn import load_embedding_model
+from src.shared.common_fn import load_embedding_model, embed_documents_cached
+from src.shared.embedding_models import get_embedding_dimension
+from src.shared.chat_cache import chat_chain_cache
 import logging
-from typing import List
+from typing import Iterable
 import os
 import hashlib
 import time
+import threading
+import weakref
 
 logging.basicConfig(format='%(asctime)s - %(message)s',level='INFO')
 
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL')
-EMBEDDING_FUNCTION , EMBEDDING_DIMENSION = load_embedding_model(EMBEDDING_MODEL)
+
+ENTITY_ID_CONSTRAINT_QUERY = "CREATE CONSTRAINT IF NOT EXISTS FOR (e:`__Entity__`) REQUIRE e.id IS UNIQUE"
+
+# the graphs, shared per database by the driver registry, on which the constraint was created or failed
+_entity_id_constraint_graphs = weakref.WeakKeyDictionary()
+_entity_id_constraint_lock = threading.Lock()
+
+def create_entity_id_constraint(graph):
+    """
+    Entities are merged on (:__Entity__ {id}), the constraint backs that merge with an index. It is created once
+    per shared graph, and so once per database. Returns False when it can't be created, for example because
+    existing entities have duplicate ids or the user may not create constraints.
+    """
+    with _entity_id_constraint_lock:
+        if graph in _entity_id_constraint_graphs:
+            return _entity_id_constraint_graphs[graph]
+    try:
+        graph.query(ENTITY_ID_CONSTRAINT_QUERY)
+        has_constraint = True
+    except Exception as e:
+        logging.warning(f"Unable to create the __Entity__ id constraint, graph documents are written without it: {e}")
+        has_constraint = False
+    with _entity_id_constraint_lock:
+        _entity_id_constraint_graphs[graph] = has_constraint
+    return has_constraint
 
 def merge_relationship_between_chunk_and_entites(graph: Neo4jGraph, graph_documents_chunk_chunk_Id : list):
     batch_data = []
     logging.info("Create HAS_ENTITY relationship between chunks and entities")
-    chunk_node_id_set = 'id:"{}"'
     for graph_doc_chunk_id in graph_documents_chunk_chunk_Id:
         for node in graph_doc_chunk_id['graph_doc'].nodes:
             query_data={
@@ -24,10 +51,6 @@ def merge_relationship_between_chunk_and_entites(graph: Neo4jGraph, graph_docume
                 'node_id': node.id
             }
             batch_data.append(query_data)
-            #node_id = node.id
-            #Below query is also unable to change as parametrize because we can't make parameter of Label or node type
-            #https://neo4j.com/docs/cypher-manual/current/syntax/parameters/
-            #graph.query('MATCH(c:Chunk {'+chunk_node_id_set.format(graph_doc_chunk_id['chunk_id'])+'}) MERGE (n:'+ node.type +'{ id: "'+node_id+'"}) MERGE (c)-[:HAS_ENTITY]->(n)')
 
     if batch_data:
         unwind_query = """
@@ -38,55 +61,124 @@ def merge_relationship_between_chunk_and_entites(graph: Neo4jGraph, graph_docume
                 """
         graph.query(unwind_query, params={"batch_data": batch_data})
 
+def write_graph_documents_with_add_graph_documents(graph: Neo4jGraph, graph_documents_chunk_chunk_Id : list):
+    """The write path used when the __Entity__ id constraint can't be created. Returns the number of rows written."""
+    graph_documents = [graph_doc_chunk_id['graph_doc'] for graph_doc_chunk_id in graph_documents_chunk_chunk_Id]
+    graph.add_graph_documents(graph_documents, baseEntityLabel=True, include_source=True)
+    merge_relationship_between_chunk_and_entites(graph, graph_documents_chunk_chunk_Id)
+    return sum(len(graph_document.nodes) + len(graph_document.relationships) for graph_document in graph_documents)
+
+def write_graph_documents_with_chunk_entities(graph: Neo4jGraph, graph_documents_chunk_chunk_Id : list):
+    """
+    Write the entities and relationships of the graph documents together with the HAS_ENTITY relationships
+    from their chunks, in one transaction.
+
+    Nodes are grouped by type and relationships by type and endpoint types so that every group is a single
+    UNWIND subquery with static labels and relationship type; labels and types can't be query parameters
+    (https://neo4j.com/docs/cypher-manual/current/syntax/parameters/). The groups are CALL subqueries of one
+    query, which runs in one transaction. Entities, relationship endpoints included, are merged on
+    (:__Entity__ {id}) and get their type label like add_graph_documents with baseEntityLabel=True.
+
+    Returns the number of rows written.
+    """
+    nodes_by_type = {}
+    relationships_by_type = {}
+    for graph_doc_chunk_id in graph_documents_chunk_chunk_Id:
+        graph_document = graph_doc_chunk_id['graph_doc']
+        for node in graph_document.nodes:
+            row = nodes_by_type.setdefault(node.type, {}).setdefault(node.id, {"id": node.id, "properties": {}, "chunk_ids": []})
+            row["properties"].update(node.properties)
+            if graph_doc_chunk_id['chunk_id'] not in row["chunk_ids"]:
+                row["chunk_ids"].append(graph_doc_chunk_id['chunk_id'])
+        for rel in graph_document.relationships:
+            rel_key = (rel.type, rel.source.type, rel.target.type)
+            row = relationships_by_type.setdefault(rel_key, {}).setdefault((rel.source.id, rel.target.id), {"source": rel.source.id, "target": rel.target.id, "properties": {}})
+            row["properties"].update(rel.properties)
+
+    queries = []
+    for node_type, rows in nodes_by_type.items():
+        queries.append(("""
+                    MERGE (n:`__Entity__` {id: row.id})
+                    SET n:`%s`
+                    SET n += row.properties
+                    WITH n, row
+                    UNWIND row.chunk_ids AS chunk_id
+                    MATCH (c:Chunk {id: chunk_id})
+                    MERGE (c)-[:HAS_ENTITY]->(n)
+                """ % node_type, list(rows.values())))
+    for (rel_type, source_type, target_type), rows in relationships_by_type.items():
+        queries.append(("""
+                    MERGE (source:`__Entity__` {id: row.source})
+                    SET source:`%s`
+                    MERGE (target:`__Entity__` {id: row.target})
+                    SET target:`%s`
+                    MERGE (source)-[r:`%s`]->(target)
+                    SET r += row.properties
+                """ % (source_type, target_type, rel_type), list(rows.values())))
+    if not queries:
+        return 0
+
+    params = {}
+    subqueries = []
+    for index, (query, rows) in enumerate(queries):
+        params[f"rows_{index}"] = rows
+        subqueries.append("CALL {\n                    UNWIND $rows_%d AS row%s}" % (index, query))
+    graph.query("\n".join(subqueries), params=params)
+    row_count = sum(len(rows) for _, rows in queries)
+    logging.info(f"Wrote {row_count} node and relationship rows in {len(queries)} grouped subqueries")
+    return row_count
+
+
+def create_chunk_vector_index(graph):
+    """
+    Drop the legacy '__Chunk__' vector index and create the 'Chunk' vector index when it is missing.
+    Called once per file before its chunk batches are embedded.
+    """
+    dimension = get_embedding_dimension(EMBEDDING_MODEL)
+    result = graph.query("SHOW INDEXES YIELD * WHERE labelsOrTypes = ['__Chunk__'] and name = 'vector'")
+    vector_index = graph.query("SHOW INDEXES YIELD * WHERE labelsOrTypes = ['Chunk'] and type = 'VECTOR' AND name = 'vector' return options")
+    if not result and vector_index:
+        return
+    try:
+        if result:
+            logging.info(f"vector index dropped for 'Chunk'")
+            graph.query("DROP INDEX vector IF EXISTS;")
+
+        if len(vector_index) == 0:
+            logging.info(f'vector index is not exist, will create in next query')
+            graph.query("""CREATE VECTOR INDEX `vector` if not exists for (c:Chunk) on (c.embedding)
+                            OPTIONS {indexConfig: {
+                            `vector.dimensions`: $dimensions,
+                            `vector.similarity_function`: 'cosine'
+                            }}
+                        """,
+                        {
+                            "dimensions" : dimension
+                        }
+                        )
+    finally:
+        # after the create, a store cached in between would point at the dropped or missing index
+        chat_chain_cache.invalidate()
 
 def update_embedding_create_vector_index(graph, chunkId_chunkDoc_list, file_name):
     #create embedding
     isEmbedding = os.getenv('IS_EMBEDDING')
     # embedding_model = os.getenv('EMBEDDING_MODEL')
 
-    embeddings, dimension = EMBEDDING_FUNCTION , EMBEDDING_DIMENSION
+    embeddings, dimension = load_embedding_model(EMBEDDING_MODEL)
     logging.info(f'embedding model:{embeddings} and dimesion:{dimension}')
     data_for_query = []
     logging.info(f"update embedding and vector index for chunks")
-    for row in chunkId_chunkDoc_list:
-        # for graph_document in row['graph_doc']:
-        if isEmbedding.upper() == "TRUE":
-            embeddings_arr = embeddings.embed_query(row['chunk_doc'].page_content)
-            # logging.info(f'Embedding list {embeddings_arr}')
-
+    if isEmbedding.upper() == "TRUE":
+        texts = [row['chunk_doc'].page_content for row in chunkId_chunkDoc_list]
+        # chunk ids are the SHA1 of the chunk text, so they double as the embedding cache keys
+        chunk_ids = [row['chunk_id'] for row in chunkId_chunkDoc_list]
+        embeddings_list = embed_documents_cached(embeddings, EMBEDDING_MODEL, texts, chunk_ids)
+        for row, embeddings_arr in zip(chunkId_chunkDoc_list, embeddings_list):
             data_for_query.append({
                 "chunkId": row['chunk_id'],
                 "embeddings": embeddings_arr
             })
-            # graph.query("""MATCH (d:Document {fileName : $fileName})
-            #                MERGE (c:Chunk {id:$chunkId}) SET c.embedding = $embeddings
-            #                MERGE (c)-[:PART_OF]->(d)
-            #             """,
-            #             {
-            #                 "fileName" : file_name,
-            #                 "chunkId": row['chunk_id'],
-            #                 "embeddings" : embeddings_arr
-            #             }
-            #             )
-            # logging.info('create vector index on chunk embedding')
-            result = graph.query("SHOW INDEXES YIELD * WHERE labelsOrTypes = ['__Chunk__'] and name = 'vector'")
-            vector_index = graph.query("SHOW INDEXES YIELD * WHERE labelsOrTypes = ['Chunk'] and type = 'VECTOR' AND name = 'vector' return options")
-            if result:
-                logging.info(f"vector index dropped for 'Chunk'")
-                graph.query("DROP INDEX vector IF EXISTS;")
-
-            if len(vector_index) == 0:
-                logging.info(f'vector index is not exist, will create in next query')
-                graph.query("""CREATE VECTOR INDEX `vector` if not exists for (c:Chunk) on (c.embedding)
-                                OPTIONS {indexConfig: {
-                                `vector.dimensions`: $dimensions,
-                                `vector.similarity_function`: 'cosine'
-                                }}
-                            """,
-                            {
-                                "dimensions" : dimension
-                            }
-                            )
 
     query_to_create_embedding = """
         UNWIND $data AS row
@@ -97,35 +189,52 @@ def update_embedding_create_vector_index(graph, chunkId_chunkDoc_list, file_name
     """
     graph.query(query_to_create_embedding, params={"fileName":file_name, "data":data_for_query})
 
-def create_relation_between_chunks(graph, file_name, chunks: List[Document])->list:
+def create_relation_between_chunks(graph, file_name, chunks: Iterable[Document])->list:
+    """
+    Create the Chunk nodes of the file with their PART_OF, FIRST_CHUNK and NEXT_CHUNK relationships, in sub-batches
+    of CHUNK_WRITE_BATCH_SIZE, and return every chunk. See create_relation_between_chunks_in_batches.
+    """
+    chunk_write_batch_size = int(os.environ.get('CHUNK_WRITE_BATCH_SIZE', '1000'))
+    lst_chunks_including_hash = []
+    for chunk_batch in create_relation_between_chunks_in_batches(graph, file_name, chunks, chunk_write_batch_size):
+        lst_chunks_including_hash.extend(chunk_batch)
+    return lst_chunks_including_hash
+
+def create_relation_between_chunks_in_batches(graph, file_name, chunks: Iterable[Document], batch_size: int):
+    """
+    Generator creating the Chunk nodes of the file with their PART_OF, FIRST_CHUNK and NEXT_CHUNK relationships.
+
+    chunks can be a generator: chunks are written in sub-batches of batch_size as they are produced, each
+    sub-batch in its own transaction together with its FIRST_CHUNK and NEXT_CHUNK relationships, and every
+    written sub-batch is yielded as a list of {'chunk_id', 'chunk_doc'}. Only one sub-batch of chunk texts is
+    held at a time, the caller can process it before the next one is read. NEXT_CHUNK of the first chunk in
+    a sub-batch links back to the last chunk of the previous, already committed, one.
+    """
     logging.info("creating FIRST_CHUNK and NEXT_CHUNK relationships between chunks")
     current_chunk_id = ""
+    chunk_count = 0
     lst_chunks_including_hash = []
     batch_data = []
-    relationships = []
     offset=0
+    previous_chunk_length = 0
     for i, chunk in enumerate(chunks):
         page_content_sha1 = hashlib.sha1(chunk.page_content.encode())
         previous_chunk_id = current_chunk_id
         current_chunk_id = page_content_sha1.hexdigest()
         position = i + 1
-        if i>0:
+        if 'start_index' in chunk.metadata:
+            # character offset computed by the chunker
+            offset = chunk.metadata['start_index']
+        elif i>0:
             #offset += len(tiktoken.encoding_for_model("gpt2").encode(chunk.page_content))
-            offset += len(chunks[i-1].page_content)
-        if i == 0:
-            firstChunk = True
-        else:
-            firstChunk = False
-        metadata = {"position": position,"length": len(chunk.page_content), "content_offset":offset}
-        chunk_document = Document(
-            page_content=chunk.page_content, metadata=metadata
-        )
+            offset += previous_chunk_length
+        previous_chunk_length = len(chunk.page_content)
 
         chunk_data = {
             "id": current_chunk_id,
-            "pg_content": chunk_document.page_content,
+            "pg_content": chunk.page_content,
             "position": position,
-            "length": chunk_document.metadata["length"],
+            "length": len(chunk.page_content),
             "f_name": file_name,
             "previous_id" : previous_chunk_id,
             "content_offset" : offset
@@ -142,47 +251,47 @@ def create_relation_between_chunks(graph, file_name, chunks: List[Document])->li
 
         lst_chunks_including_hash.append({'chunk_id': current_chunk_id, 'chunk_doc': chunk})
 
-        # create relationships between chunks
-        if firstChunk:
-            relationships.append({"type": "FIRST_CHUNK", "chunk_id": current_chunk_id})
-        else:
-            relationships.append({
-                "type": "NEXT_CHUNK",
-                "previous_chunk_id": previous_chunk_id,  # ID of previous chunk
-                "current_chunk_id": current_chunk_id
-            })
+        if len(batch_data) == batch_size:
+            write_chunk_sub_batch(graph, file_name, batch_data)
+            chunk_count += len(batch_data)
+            yield lst_chunks_including_hash
+            batch_data = []
+            lst_chunks_including_hash = []
 
-    query_to_create_chunk_and_PART_OF_relation = """
-        UNWIND $batch_data AS data
-        MERGE (c:Chunk {id: data.id})
-        SET c.text = data.pg_content, c.position = data.position, c.length = data.length, c.fileName=data.f_name, c.content_offset=data.content_offset
-        WITH data, c
-        SET c.page_number = CASE WHEN data.page_number IS NOT NULL THEN data.page_number END,
-            c.start_time = CASE WHEN data.start_time IS NOT NULL THEN data.start_time END,
-            c.end_time = CASE WHEN data.end_time IS NOT NULL THEN data.end_time END
-        WITH data, c
-        MATCH (d:Document {fileName: data.f_name})
-        MERGE (c)-[:PART_OF]->(d)
+    if batch_data:
+        write_chunk_sub_batch(graph, file_name, batch_data)
+        chunk_count += len(batch_data)
+        yield lst_chunks_including_hash
+    logging.info(f"Created {chunk_count} chunks with PART_OF, FIRST_CHUNK and NEXT_CHUNK relationships in sub-batches of {batch_size}")
+
+def write_chunk_sub_batch(graph, file_name, batch_data):
+    """Write the chunks of a sub-batch with PART_OF, FIRST_CHUNK and NEXT_CHUNK in one query, so in one transaction."""
+    first_chunk_id = batch_data[0]["id"] if batch_data[0]["position"] == 1 else None
+    next_chunk_relationships = [{"previous_chunk_id": data["previous_id"], "current_chunk_id": data["id"]}
+                                for data in batch_data if data["previous_id"]]
+    query_to_create_chunks_and_relations = """
+        CALL {
+            MATCH (d:Document {fileName: $f_name})
+            UNWIND $batch_data AS data
+            MERGE (c:Chunk {id: data.id})
+            SET c.text = data.pg_content, c.position = data.position, c.length = data.length, c.fileName=data.f_name, c.content_offset=data.content_offset
+            WITH d, data, c
+            SET c.page_number = CASE WHEN data.page_number IS NOT NULL THEN data.page_number END,
+                c.start_time = CASE WHEN data.start_time IS NOT NULL THEN data.start_time END,
+                c.end_time = CASE WHEN data.end_time IS NOT NULL THEN data.end_time END
+            MERGE (c)-[:PART_OF]->(d)
+        }
+        CALL {
+            MATCH (d:Document {fileName: $f_name})
+            MATCH (c:Chunk {id: $first_chunk_id})
+            MERGE (d)-[:FIRST_CHUNK]->(c)
+        }
+        CALL {
+            UNWIND $relationships AS relationship
+            MATCH (c:Chunk {id: relationship.current_chunk_id})
+            MATCH (pc:Chunk {id: relationship.previous_chunk_id})
+            MERGE (c)<-[:NEXT_CHUNK]-(pc)
+        }
     """
-    graph.query(query_to_create_chunk_and_PART_OF_relation, params={"batch_data": batch_data})
-
-    query_to_create_FIRST_relation = """
-        UNWIND $relationships AS relationship
-        MATCH (d:Document {fileName: $f_name})
-        MATCH (c:Chunk {id: relationship.chunk_id})
-        FOREACH(r IN CASE WHEN relationship.type = 'FIRST_CHUNK' THEN [1] ELSE [] END |
-                MERGE (d)-[:FIRST_CHUNK]->(c))
-        """
-    graph.query(query_to_create_FIRST_relation, params={"f_name": file_name, "relationships": relationships})
-
-    query_to_create_NEXT_CHUNK_relation = """
-        UNWIND $relationships AS relationship
-        MATCH (c:Chunk {id: relationship.current_chunk_id})
-        WITH c, relationship
-        MATCH (pc:Chunk {id: relationship.previous_chunk_id})
-        FOREACH(r IN CASE WHEN relationship.type = 'NEXT_CHUNK' THEN [1] ELSE [] END |
-                MERGE (c)<-[:NEXT_CHUNK]-(pc))
-        """
-    graph.query(query_to_create_NEXT_CHUNK_relation, params={"relationships": relationships})
-
-    return lst_chunks_including_hash
\ No newline at end of file
+    graph.query(query_to_create_chunks_and_relations, params={"f_name":file_name, "batch_data":batch_data, "first_chunk_id":first_chunk_id,
+                                                              "relationships":next_chunk_relationships})
@@ -1,9 +1,11 @@
-from neo4j import GraphDatabase
 import logging
 import time
 from langchain_community.graphs import Neo4jGraph
 import os
-from src.shared.common_fn import load_embedding_model
+from concurrent.futures import ThreadPoolExecutor
+from src.shared.common_fn import load_embedding_model, embed_documents_cached
+from src.shared.driver_registry import driver_registry
+from src.shared.chat_cache import chat_chain_cache
 
 DROP_INDEX_QUERY = "DROP INDEX entities IF EXISTS;"
 LABELS_QUERY = "CALL db.labels()"
@@ -65,6 +67,9 @@ def create_vector_index(driver, index_type, embedding_dimension=None):
     except Exception as e:
         logging.error("An error occurred while creating the vector index.", exc_info=True)
         logging.error(f"Error details: {str(e)}")
+    finally:
+        # once the index is recreated, or failed to, so no chat caches a store against the dropped index
+        chat_chain_cache.invalidate()
 
 def create_fulltext(driver,type):
 
@@ -119,6 +124,7 @@ def create_fulltext(driver,type):
     except Exception as e:
         logging.error(f"An error occurred during the session: {e}")
     finally:
+        chat_chain_cache.invalidate()
         logging.info(f"Process completed in {time.time() - start_time:.2f} seconds.")
 
 
@@ -127,7 +133,7 @@ def create_vector_fulltext_indexes(uri, username, password, database):
     logging.info("Starting the process of creating full-text indexes.")
 
     try:
-        driver = GraphDatabase.driver(uri, auth=(username, password), database=database)
+        driver = driver_registry.get_driver(uri, username, password, database)
         driver.verify_connectivity()
         logging.info("Database connectivity verified.")
     except Exception as e:
@@ -149,38 +155,68 @@ def create_vector_fulltext_indexes(uri, username, password, database):
     except Exception as e:
         logging.error(f"Failed to create vector index for '{CHUNK_VECTOR_INDEX_NAME}': {e}")
 
-    try:
-        driver.close()
-        logging.info("Driver closed successfully.")
-    except Exception as e:
-        logging.error(f"Error closing the driver: {e}")
-
     logging.info("Full-text and vector index creation process completed.")
 
 
-def create_entity_embedding(graph:Neo4jGraph):
-    rows = fetch_entities_for_embedding(graph)
-    for i in range(0, len(rows), 1000):
-        update_embeddings(rows[i:i+1000],graph)
-
-def fetch_entities_for_embedding(graph):
-    query = """
-                MATCH (e)
-                WHERE NOT (e:Chunk OR e:Document OR e:`__Community__`) AND e.embedding IS NULL AND e.id IS NOT NULL
-                RETURN elementId(e) AS elementId, e.id + " " + coalesce(e.description, "") AS text
+ENTITY_EMBEDDING_PAGE_SIZE = 1000
+
+FETCH_ENTITIES_FOR_EMBEDDING_QUERY = """
+                MATCH (e:`__Entity__`)
+                WHERE e.id > $cursor AND e.embedding IS NULL
+                RETURN e.id AS entityId, elementId(e) AS elementId, e.id + " " + coalesce(e.description, "") AS text
+                ORDER BY e.id
+                LIMIT $page_size
                 """
-    result = graph.query(query)
-    return [{"elementId": record["elementId"], "text": record["text"]} for record in result]
 
-def update_embeddings(rows, graph):
-    embedding_model = os.getenv('EMBEDDING_MODEL')
-    embeddings, dimension = load_embedding_model(embedding_model)
-    logging.info(f"update embedding for entities")
-    for row in rows:
-        row['embedding'] = embeddings.embed_query(row['text'])
-    query = """
+UPDATE_ENTITY_EMBEDDINGS_QUERY = """
       UNWIND $rows AS row
       MATCH (e) WHERE elementId(e) = row.elementId
       CALL db.create.setNodeVectorProperty(e, "embedding", row.embedding)
       """
-    return graph.query(query,params={'rows':rows})
\ No newline at end of file
+
+def create_entity_embedding(graph:Neo4jGraph):
+    """
+    Embed every entity without an embedding, one page of ENTITY_EMBEDDING_PAGE_SIZE entities at a time.
+
+    Entities are paged with a cursor on __Entity__.id, which the entity id constraint indexes, so the
+    whole entity list is never held in memory. The embedding model is loaded once for the whole job, each
+    page is encoded in batches and written by a background thread while the next page is fetched and
+    encoded. Only entities whose embedding is still null are fetched, so an interrupted job resumes where
+    it stopped when it is run again.
+    """
+    start = time.time()
+    embedding_model = os.getenv('EMBEDDING_MODEL')
+    embeddings, dimension = load_embedding_model(embedding_model)
+    page_size = int(os.environ.get('ENTITY_EMBEDDING_PAGE_SIZE', ENTITY_EMBEDDING_PAGE_SIZE))
+    cursor = ""
+    entity_count = 0
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        pending_write = None
+        while True:
+            rows = fetch_entities_for_embedding(graph, cursor, page_size)
+            if not rows:
+                break
+            cursor = rows[-1]["entityId"]
+            embed_entity_rows(embeddings, embedding_model, rows)
+            if pending_write is not None:
+                pending_write.result()
+            pending_write = writer.submit(update_embeddings, rows, graph)
+            entity_count += len(rows)
+            logging.info(f"Embedded {entity_count} entities in {time.time() - start:.2f} seconds")
+        if pending_write is not None:
+            pending_write.result()
+    logging.info(f"Entity embedding completed for {entity_count} entities in {time.time() - start:.2f} seconds")
+
+def fetch_entities_for_embedding(graph, cursor, page_size):
+    result = graph.query(FETCH_ENTITIES_FOR_EMBEDDING_QUERY, params={"cursor": cursor, "page_size": page_size})
+    return [{"entityId": record["entityId"], "elementId": record["elementId"], "text": record["text"]} for record in result]
+
+def embed_entity_rows(embeddings, embedding_model, rows):
+    embeddings_list = embed_documents_cached(embeddings, embedding_model, [row['text'] for row in rows])
+    for row, embedding in zip(rows, embeddings_list):
+        row['embedding'] = embedding
+
+def update_embeddings(rows, graph):
+    logging.info(f"update embedding for entities")
+    rows = [{"elementId": row["elementId"], "embedding": row["embedding"]} for row in rows]
+    return graph.query(UPDATE_ENTITY_EMBEDDINGS_QUERY, params={'rows':rows})
@@ -1,30 +1,35 @@
 import os
 import logging
+import threading
 import time
 from src.llm import get_llm
-from datasets import Dataset
 from dotenv import load_dotenv
-from ragas import evaluate
-from ragas.metrics import answer_relevancy, faithfulness
 from src.shared.common_fn import load_embedding_model
-from ragas.dataset_schema import SingleTurnSample
-from ragas.metrics import BleuScore, RougeScore, SemanticSimilarity, ContextEntityRecall
-from ragas.metrics._factual_correctness import FactualCorrectness
-from ragas.llms import LangchainLLMWrapper
-from langchain_openai import ChatOpenAI
-from langchain.embeddings import OpenAIEmbeddings
-from ragas.embeddings import LangchainEmbeddingsWrapper
-import nltk
 
-nltk.download('punkt')
 load_dotenv()
 
 EMBEDDING_MODEL = os.getenv("RAGAS_EMBEDDING_MODEL")
-EMBEDDING_FUNCTION, _ = load_embedding_model(EMBEDDING_MODEL)
+
+# ragas, datasets and nltk are imported by the metric functions and punkt is downloaded on the first evaluation,
+# not when the API workers start
+_ragas_nltk_data_downloaded = False
+_ragas_nltk_data_lock = threading.Lock()
+
+def download_ragas_nltk_data():
+    global _ragas_nltk_data_downloaded
+    with _ragas_nltk_data_lock:
+        if not _ragas_nltk_data_downloaded:
+            import nltk
+            nltk.download('punkt')
+            _ragas_nltk_data_downloaded = True
 
 def get_ragas_metrics(question: str, context: list, answer: list, model: str):
     """Calculates RAGAS metrics."""
     try:
+        from datasets import Dataset
+        from ragas import evaluate
+        from ragas.metrics import answer_relevancy, faithfulness
+        download_ragas_nltk_data()
         start_time = time.time()
         dataset = Dataset.from_dict(
             {"question": [question] * len(answer), "answer": answer, "contexts": [[ctx] for ctx in context]}
@@ -41,7 +46,7 @@ def get_ragas_metrics(question: str, context: list, answer: list, model: str):
             dataset=dataset,
             metrics=[faithfulness, answer_relevancy],
             llm=llm,
-            embeddings=EMBEDDING_FUNCTION,
+            embeddings=load_embedding_model(EMBEDDING_MODEL)[0],
         )
 
         score_dict = (
@@ -69,9 +74,14 @@ async def get_additional_metrics(question: str, contexts: list, answers: list, r
    try:
        if ("diffbot" in model_name) or ("ollama" in model_name):
            raise ValueError(f"Unsupported model for evaluation: {model_name}")
+       from ragas.dataset_schema import SingleTurnSample
+       from ragas.metrics import RougeScore, SemanticSimilarity, ContextEntityRecall
+       from ragas.llms import LangchainLLMWrapper
+       from ragas.embeddings import LangchainEmbeddingsWrapper
+       download_ragas_nltk_data()
        llm, model_name = get_llm(model=model_name)
        ragas_llm = LangchainLLMWrapper(llm)
-       embeddings = EMBEDDING_FUNCTION
+       embeddings, _ = load_embedding_model(EMBEDDING_MODEL)
        embedding_model = LangchainEmbeddingsWrapper(embeddings=embeddings)
        rouge_scorer = RougeScore()
        semantic_scorer = SemanticSimilarity()
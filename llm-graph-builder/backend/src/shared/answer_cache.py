@@ -0,0 +1,133 @@
+import copy
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+CHAT_ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+CHAT_ANSWER_CACHE_MAX_SCOPES = 256
+CHAT_ANSWER_CACHE_MAX_ENTRIES_PER_SCOPE = 256
+
+# status and updatedAt of the documents in scope, an empty list of names means every document
+QUERY_TO_GET_DOCUMENT_VERSIONS = """
+MATCH (d:Document)
+WHERE d.fileName IS NOT NULL AND (size($document_names) = 0 OR d.fileName IN $document_names)
+RETURN d.fileName AS fileName, d.status AS status, toString(d.updatedAt) AS updatedAt
+ORDER BY fileName
+"""
+
+
+def get_documents_version(graph, document_names):
+    """Hash of the status and updatedAt of every document in scope, it changes whenever one of them changes."""
+    rows = graph.query(QUERY_TO_GET_DOCUMENT_VERSIONS, {"document_names": list(document_names)})
+    version = hashlib.sha1()
+    for row in rows:
+        version.update(f"{row['fileName']}\x00{row['status']}\x00{row['updatedAt']}\x01".encode())
+    return version.hexdigest()
+
+
+class AnswerCacheScope:
+    """The cached answers of one (graph, chat mode, model, documents) scope, valid for one documents version."""
+
+    def __init__(self, documents_version):
+        self.documents_version = documents_version
+        self.embeddings = []
+        self.answers = []
+
+    def find(self, question_embedding, threshold):
+        if not self.embeddings:
+            return None, 0.0
+        similarities = np.asarray(self.embeddings, dtype=np.float32) @ question_embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < threshold:
+            return None, float(similarities[best])
+        return self.answers[best], float(similarities[best])
+
+    def add(self, question_embedding, answer, max_entries):
+        self.embeddings.append(question_embedding)
+        self.answers.append(answer)
+        if len(self.answers) > max_entries:
+            del self.embeddings[0]
+            del self.answers[0]
+
+
+class AnswerCache:
+    """
+    Process wide cache of chat answers for repeated questions. Answers are grouped in scopes keyed by the
+    graph, the chat mode, the model and the selected documents; within a scope a question is answered from
+    the cache when the cosine similarity of its embedding with a cached question is at least
+    CHAT_ANSWER_CACHE_SIMILARITY_THRESHOLD. Every lookup reads the status and updatedAt of the documents in
+    scope and drops the scope's answers when any of them changed, so re-processed or deleted documents never
+    serve stale answers. The latency of the pipeline run that produced an answer is kept with it, a hit
+    counts that latency minus the lookup time as saved.
+    """
+
+    def __init__(self):
+        self.similarity_threshold = float(os.environ.get('CHAT_ANSWER_CACHE_SIMILARITY_THRESHOLD', CHAT_ANSWER_CACHE_SIMILARITY_THRESHOLD))
+        self.max_scopes = int(os.environ.get('CHAT_ANSWER_CACHE_MAX_SCOPES', CHAT_ANSWER_CACHE_MAX_SCOPES))
+        self.max_entries_per_scope = int(os.environ.get('CHAT_ANSWER_CACHE_MAX_ENTRIES_PER_SCOPE', CHAT_ANSWER_CACHE_MAX_ENTRIES_PER_SCOPE))
+        self.scopes = OrderedDict()
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.saved_latency = 0.0
+
+    def get_scope(self, scope_key, documents_version):
+        scope = self.scopes.get(scope_key)
+        if scope is None or scope.documents_version != documents_version:
+            if scope is not None:
+                logging.info(f"Answer cache: documents changed, dropped {len(scope.answers)} cached answers")
+            scope = AnswerCacheScope(documents_version)
+            self.scopes[scope_key] = scope
+        self.scopes.move_to_end(scope_key)
+        while len(self.scopes) > self.max_scopes:
+            self.scopes.popitem(last=False)
+        return scope
+
+    def lookup(self, scope_key, documents_version, question_embedding, lookup_time):
+        """Return (answer, similarity) for the most similar cached question, answer is None on a miss."""
+        with self.lock:
+            self.lookups += 1
+            scope = self.get_scope(scope_key, documents_version)
+            cached, similarity = scope.find(question_embedding, self.similarity_threshold)
+            if cached is None:
+                return None, similarity
+            self.hits += 1
+            self.saved_latency += max(cached["latency"] - lookup_time, 0.0)
+            return copy.deepcopy(cached["result"]), similarity
+
+    def add(self, scope_key, documents_version, question_embedding, result, latency):
+        with self.lock:
+            scope = self.get_scope(scope_key, documents_version)
+            scope.add(question_embedding, {"result": copy.deepcopy(result), "latency": latency}, self.max_entries_per_scope)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "saved_latency": round(self.saved_latency, 2),
+            }
+
+
+def normalize_embedding(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    """Return the process wide answer cache, or None when CHAT_ANSWER_CACHE_ENABLED is not set."""
+    global _answer_cache
+    if os.environ.get('CHAT_ANSWER_CACHE_ENABLED', 'False').upper() != "TRUE":
+        return None
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+        return _answer_cache
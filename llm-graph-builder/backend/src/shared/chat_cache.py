@@ -0,0 +1,91 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CHAT_CACHE_TTL = 600
+CHAT_CACHE_MAX_ENTRIES = 256
+
+
+class TTLCache:
+    """
+    Thread safe cache whose entries expire ttl seconds after they were created. Beyond max_entries the least
+    recently used entry is evicted. Concurrent misses for the same key may both create the value, the last
+    one is kept; creating a value twice is harmless for what is cached here. Only values whose creation
+    succeeded are cached, and a value whose creation started before a clear() is returned but not cached,
+    it may have been built on what the clear() invalidated.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+
+    def get_or_create(self, key, create):
+        if self.ttl <= 0:
+            return create()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self.generation
+        value = create()
+        with self.lock:
+            if generation != self.generation:
+                return value
+            self.entries[key] = (now, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class ChatChainCache:
+    """
+    Process wide cache of what chat setup builds for every question: the LLM clients per model, the
+    Neo4jVector stores per (graph, chat mode), the ready retriever chains per (graph, chat mode, model,
+    document filter) and the schema refreshes of the shared graphs used by graph mode.
+    Neo4jVector.from_existing_graph runs the index introspection queries, and for hybrid search may create
+    the keyword index, so a cached store must not outlive the indexes it was built on:
+    invalidate() is called once an index is dropped and created again, after the create. Other workers see the change once their
+    entries expire after CHAT_CACHE_TTL seconds. CHAT_CACHE_TTL=0 disables the cache.
+    """
+
+    def __init__(self):
+        ttl = float(os.environ.get('CHAT_CACHE_TTL', CHAT_CACHE_TTL))
+        max_entries = int(os.environ.get('CHAT_CACHE_MAX_ENTRIES', CHAT_CACHE_MAX_ENTRIES))
+        self.llms = TTLCache(ttl, max_entries)
+        self.vector_stores = TTLCache(ttl, max_entries)
+        self.retriever_chains = TTLCache(ttl, max_entries)
+        self.graph_schemas = TTLCache(ttl, max_entries)
+
+    def invalidate(self):
+        """Forget the vector stores and retriever chains, the LLM clients don't depend on the indexes."""
+        self.vector_stores.clear()
+        self.retriever_chains.clear()
+        logging.info("Chat cache invalidated, vector stores and retriever chains will be rebuilt")
+
+    def get_stats(self):
+        return {"llms": self.llms.get_stats(), "vector_stores": self.vector_stores.get_stats(),
+                "retriever_chains": self.retriever_chains.get_stats(), "graph_schemas": self.graph_schemas.get_stats()}
+
+
+chat_chain_cache = ChatChainCache()
@@ -1,21 +1,16 @@
 import hashlib
 import logging
 from src.document_sources.youtube import create_youtube_url
-from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
-from langchain_google_vertexai import VertexAIEmbeddings
-from langchain_openai import OpenAIEmbeddings
 from langchain.docstore.document import Document
-from langchain_community.graphs import Neo4jGraph
 from langchain_community.graphs.graph_document import GraphDocument
 from typing import List
 import re
 import os
 from pathlib import Path
-from langchain_openai import ChatOpenAI
-from langchain_google_vertexai import ChatVertexAI
-from langchain_groq import ChatGroq
-from langchain_google_vertexai import HarmBlockThreshold, HarmCategory
-from langchain_experimental.graph_transformers.diffbot import DiffbotGraphTransformer
+from concurrent.futures import ThreadPoolExecutor
+from src.shared.embedding_cache import get_embedding_cache, get_content_hash
+from src.shared.driver_registry import driver_registry
+from src.shared.embedding_models import embedding_model_registry, get_embedding_model_key
 # from neo4j.debug import watch
 
 # watch("neo4j")
@@ -66,36 +61,55 @@ def get_chunk_and_graphDocument(graph_document_list, chunkId_chunkDoc_list):
   return lst_chunk_chunkId_document
 
 def create_graph_database_connection(uri, userName, password, database):
-  enable_user_agent = os.environ.get("ENABLE_USER_AGENT", "False").lower() in ("true", "1", "yes")
-  if enable_user_agent:
-    graph = Neo4jGraph(url=uri, database=database, username=userName, password=password, refresh_schema=False, sanitize=True,driver_config={'user_agent':os.environ.get('NEO4J_USER_AGENT')})
-  else:
-    graph = Neo4jGraph(url=uri, database=database, username=userName, password=password, refresh_schema=False, sanitize=True)
-  return graph
+  """Return the shared Neo4jGraph for the connection details, see DriverRegistry."""
+  return driver_registry.get_graph(uri, userName, password, database)
 
 
 def load_embedding_model(embedding_model_name: str):
-    if embedding_model_name == "openai":
-        embeddings = OpenAIEmbeddings()
-        dimension = 1536
-        logging.info(f"Embedding: Using OpenAI Embeddings , Dimension:{dimension}")
-    elif embedding_model_name == "vertexai":
-        embeddings = VertexAIEmbeddings(
-            model="textembedding-gecko@003"
-        )
-        dimension = 768
-        logging.info(f"Embedding: Using Vertex AI Embeddings , Dimension:{dimension}")
-    else:
-        embeddings = SentenceTransformerEmbeddings(
-            model_name="all-MiniLM-L6-v2"#, cache_folder="/embedding_model"
-        )
-        dimension = 384
-        logging.info(f"Embedding: Using SentenceTransformer , Dimension:{dimension}")
-    return embeddings, dimension
-
-def save_graphDocuments_in_neo4j(graph:Neo4jGraph, graph_document_list:List[GraphDocument]):
-  graph.add_graph_documents(graph_document_list, baseEntityLabel=True,include_source=True)
-  # graph.add_graph_documents(graph_document_list)
+    """Return (embeddings, dimension), the model is loaded once per process by the embedding model registry."""
+    return embedding_model_registry.get(embedding_model_name)
+
+def embed_documents_in_batches(embeddings, texts: List[str]):
+  """
+  Embed texts with embed_documents in batches of EMBEDDING_BATCH_SIZE instead of one embed_query call per text.
+  When EMBEDDING_WORKERS is greater than 1 the batches are encoded on a thread pool, which mainly helps the
+  local SentenceTransformer model whose forward pass releases the GIL.
+  """
+  if not texts:
+    return []
+  batch_size = int(os.environ.get('EMBEDDING_BATCH_SIZE', '32'))
+  embedding_workers = int(os.environ.get('EMBEDDING_WORKERS', '1'))
+  batches = [texts[i:i+batch_size] for i in range(0, len(texts), batch_size)]
+  if embedding_workers > 1 and len(batches) > 1:
+    with ThreadPoolExecutor(max_workers=embedding_workers) as executor:
+      embedded_batches = list(executor.map(embeddings.embed_documents, batches))
+  else:
+    embedded_batches = [embeddings.embed_documents(batch) for batch in batches]
+  return [vector for batch in embedded_batches for vector in batch]
+
+def embed_documents_cached(embeddings, embedding_model_name: str, texts: List[str], content_hashes: List[str] = None):
+  """
+  Embed texts through the persistent embedding cache, only the texts missing from the cache are sent to
+  embed_documents_in_batches. content_hashes can be passed when the SHA1 of each text is already known (chunk ids).
+  Falls back to embed_documents_in_batches when EMBEDDING_CACHE_ENABLED is not set.
+  """
+  embedding_cache = get_embedding_cache()
+  if embedding_cache is None or not texts:
+    return embed_documents_in_batches(embeddings, texts)
+  model_key = get_embedding_model_key(embedding_model_name)
+  if content_hashes is None:
+    content_hashes = [get_content_hash(text) for text in texts]
+  cached = embedding_cache.get_many(model_key, content_hashes)
+  missing = {}
+  for content_hash, text in zip(content_hashes, texts):
+    if content_hash not in cached and content_hash not in missing:
+      missing[content_hash] = text
+  if missing:
+    new_embeddings = embed_documents_in_batches(embeddings, list(missing.values()))
+    embedding_cache.put_many(model_key, list(missing.keys()), new_embeddings)
+    cached.update(zip(missing.keys(), new_embeddings))
+  logging.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses for {len(texts)} texts")
+  return [cached[content_hash] for content_hash in content_hashes]
 
 def handle_backticks_nodes_relationship_id_type(graph_document_list:List[GraphDocument]):
   for graph_document in graph_document_list:
@@ -124,9 +138,9 @@ def delete_uploaded_local_file(merged_file_path, file_name):
     logging.info(f'file {file_name} deleted successfully')
 
 def close_db_connection(graph, api_name):
+  # drivers are shared through the driver registry, they are closed once retired and released, or at shutdown, not per request
   if not graph._driver._closed:
-      logging.info(f"closing connection for {api_name} api")
-      # graph._driver.close()
+      logging.info(f"releasing connection for {api_name} api")
 
 def create_gcs_bucket_folder_name_hashed(uri, file_name):
   folder_name = uri + file_name
@@ -175,9 +175,21 @@ LIMIT $limit
 
 ## CHAT SETUP
 CHAT_SEARCH_KWARG_SCORE_THRESHOLD = 0.35
-CHAT_DOC_SPLIT_SIZE = 5000
 CHAT_EMBEDDING_FILTER_SCORE_THRESHOLD = 0.10
 
+# question transform of follow-up questions: "always" transforms every follow-up question, "skip" retrieves
+# self-contained follow-up questions as they are, "speculative" also retrieves the raw and the transformed
+# question of the other follow-up questions concurrently and merges the results
+CHAT_QUESTION_TRANSFORM_MODE = "always"
+# a follow-up question is self-contained when it has at least this many words and none of the words below
+CHAT_SELF_CONTAINED_MIN_WORDS = 5
+CHAT_FOLLOW_UP_REFERENCE_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "him", "his", "she", "her",
+    "above", "previous", "earlier", "same", "former", "latter", "more", "else", "again", "also",
+    "isso", "isto", "aquilo", "esse", "essa", "esses", "essas", "este", "esta", "estes", "estas", "ele", "ela",
+    "eles", "elas", "dele", "dela", "deles", "delas", "anterior", "acima", "mesmo", "mesma", "mais", "também",
+}
+
 CHAT_TOKEN_CUT_OFF = {
      ('openai_gpt_3.5','azure_ai_gpt_35',"gemini_1.0_pro","gemini_1.5_pro", "gemini_1.5_flash","groq-llama3",'groq_llama3_70b','anthropic_claude_3_5_sonnet','fireworks_llama_v3_70b','bedrock_claude_3_5_sonnet', ) : 4,
      ("openai-gpt-4","diffbot" ,'azure_ai_gpt_4o',"openai_gpt_4o", "openai_gpt_4o_mini") : 28,
@@ -273,9 +285,10 @@ WITH d, collect({chunk: cs.chunk, score: cs.score})[0..3] AS top_chunks  // Aume
 
 WITH d,
      [c IN top_chunks | c.chunk.text] AS texts,
-     [c IN top_chunks | {id: c.chunk.id, score: c.score}] AS chunkdetails
+     [c IN top_chunks | {id: c.chunk.id, score: c.score}] AS chunkdetails,
+     [c IN top_chunks | c.chunk.embedding] AS embeddings
 
-WITH d, chunkdetails,
+WITH d, chunkdetails, embeddings,
      apoc.text.join(texts, "\n----\n") AS text
 
 RETURN text,
@@ -285,7 +298,8 @@ RETURN text,
                    CASE WHEN d.url CONTAINS "None" THEN d.fileName ELSE d.url END,
                    d.fileName
                  ),
-         chunkdetails: chunkdetails
+         chunkdetails: chunkdetails,
+         embeddings: embeddings
        } AS metadata
 """
 
@@ -360,6 +374,7 @@ VECTOR_GRAPH_SEARCH_QUERY_SUFFIX = """
 WITH d, avg_score,
      [c IN chunks | c.chunk.text] AS texts,
      [c IN chunks | {id: c.chunk.id, score: c.score}] AS chunkdetails,
+     [c IN chunks | c.chunk.embedding] AS embeddings,
      [n IN nodes | elementId(n)] AS entityIds,
      [r IN rels | elementId(r)] AS relIds,
      apoc.coll.sort([
@@ -377,7 +392,7 @@ WITH d, avg_score,
      entities
 
 // Combine texts into response text
-WITH d, avg_score, chunkdetails, entityIds, relIds,
+WITH d, avg_score, chunkdetails, embeddings, entityIds, relIds,
      "Text Content:\n" + apoc.text.join(texts, "\n----\n") +
      "\n----\nEntities:\n" + apoc.text.join(nodeTexts, "\n") +
      "\n----\nRelationships:\n" + apoc.text.join(relTexts, "\n") AS text,
@@ -390,6 +405,7 @@ RETURN
         length: size(text),
         source: COALESCE(CASE WHEN d.url CONTAINS "None" THEN d.fileName ELSE d.url END, d.fileName),
         chunkdetails: chunkdetails,
+        embeddings: embeddings,
         entities : {
             entityids: entityIds,
             relationshipids: relIds
@@ -502,7 +518,7 @@ RETURN {
   }
 } AS text,
 score,
-{entities: metadata} AS metadata
+{entities: metadata, embeddings: [n IN nodes | n.embedding]} AS metadata
 """
 
 LOCAL_COMMUNITY_DETAILS_QUERY_PREFIX = """
@@ -583,14 +599,15 @@ WITH collect(distinct {community: node, score: score}) AS communities,
 
 WITH avg_score,
      [c IN communities | c.community.summary] AS texts,
-     [c IN communities | {id: elementId(c.community), score: c.score}] AS communityDetails
+     [c IN communities | {id: elementId(c.community), score: c.score}] AS communityDetails,
+     [c IN communities | c.community.embedding] AS embeddings
 
-WITH avg_score, communityDetails,
+WITH avg_score, communityDetails, embeddings,
      apoc.text.join(texts, "\n----\n") AS text
 
 RETURN text,
        avg_score AS score,
-       {communitydetails: communityDetails} AS metadata
+       {communitydetails: communityDetails, embeddings: embeddings} AS metadata
 """
 
 
@@ -719,6 +736,35 @@ QUERY_TO_GET_NODES_AND_RELATIONS_OF_A_DOCUMENT = """
                               RETURN count(DISTINCT e) as nodes, count(DISTINCT rel) as rels
                               """
 
+QUERY_TO_GET_DOCUMENT_CHUNK_IDS = """
+                              MATCH (d:Document {fileName:$filename})<-[:PART_OF]-(c:Chunk)
+                              RETURN c.id as id,
+                                     (NOT $require_embedding OR c.embedding IS NOT NULL) AND exists {(c)-[:HAS_ENTITY]->()} as processed
+                              """
+QUERY_TO_DELETE_CHUNK_ORDER_OF_A_DOCUMENT = """
+                              MATCH (d:Document {fileName:$filename})
+                              OPTIONAL MATCH (d)-[first:FIRST_CHUNK]->(:Chunk)
+                              DELETE first
+                              WITH DISTINCT d
+                              MATCH (d)<-[:PART_OF]-(:Chunk)-[next:NEXT_CHUNK]->(:Chunk)-[:PART_OF]->(d)
+                              DELETE next
+                              """
+QUERY_TO_DETACH_VANISHED_CHUNKS = """
+                              UNWIND $chunk_ids AS chunk_id
+                              MATCH (c:Chunk {id:chunk_id})-[part_of:PART_OF]->(:Document {fileName:$filename})
+                              DELETE part_of
+                              WITH c
+                              WHERE NOT exists {(c)-[:PART_OF]->(:Document)}
+                              OPTIONAL MATCH (c)-[:HAS_ENTITY]->(e)
+                              WITH c, collect(e) as entities
+                              DETACH DELETE c
+                              WITH entities
+                              UNWIND entities AS e
+                              WITH DISTINCT e
+                              WHERE NOT exists {(e)<-[:HAS_ENTITY]-(:Chunk)}
+                              DETACH DELETE e
+                              """
+
 START_FROM_BEGINNING  = "start_from_beginning"
 DELETE_ENTITIES_AND_START_FROM_BEGINNING = "delete_entities_and_start_from_beginning"
 START_FROM_LAST_PROCESSED_POSITION = "start_from_last_processed_position"
\ No newline at end of file
@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from langchain_community.graphs import Neo4jGraph
+
+NEO4J_MAX_CONNECTION_POOL_SIZE = 50
+NEO4J_MAX_DRIVERS = 16
+NEO4J_DRIVER_IDLE_TIMEOUT = 3600
+NEO4J_DRIVER_HEALTH_CHECK_INTERVAL = 60
+
+
+def close_driver(driver, uri, database):
+    try:
+        driver.close()
+        logging.info(f"Closed shared Neo4j driver for {uri} database {database}")
+    except Exception as e:
+        logging.error(f"Error closing the shared Neo4j driver for {uri}: {e}")
+
+
+class DriverEntry:
+    def __init__(self, graph: Neo4jGraph, uri, database):
+        self.graph = graph
+        self.last_used = time.monotonic()
+        self.last_health_check = time.monotonic()
+        # closes the driver once the retired graph is no longer referenced by any request, or at exit
+        self.finalizer = weakref.finalize(graph, close_driver, graph._driver, uri, database)
+
+
+class GraphDriver:
+    """
+    The driver of a shared graph for code that runs queries on the driver directly. It holds the graph, so the
+    driver is not closed while the handle is in use even when the registry retired the graph; attributes that
+    are not its own are looked up on the driver.
+    """
+
+    def __init__(self, graph: Neo4jGraph):
+        self.graph = graph
+        self.driver = graph._driver
+        self.database = graph._database
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class DriverRegistry:
+    """
+    Process wide registry of Neo4jGraph connections, one per (uri, user, password hash, database), so
+    every request and module shares the driver and its connection pool instead of opening new ones.
+
+    - each driver's connection pool is capped at NEO4J_MAX_CONNECTION_POOL_SIZE
+    - at most NEO4J_MAX_DRIVERS drivers are kept, the least recently used one is retired beyond that
+    - drivers not requested for NEO4J_DRIVER_IDLE_TIMEOUT seconds are retired
+    - a driver is health checked with verify_connectivity when it is handed out and was last checked more
+      than NEO4J_DRIVER_HEALTH_CHECK_INTERVAL seconds ago, and retired and recreated when the check fails
+
+    Retiring only removes the graph from the registry. Its driver is closed when the last user releases the
+    graph, i.e. when in-flight chat requests and extractions holding it are done and it is garbage collected,
+    so a retired driver never closes under a running request. Connecting and health checks run outside the
+    registry lock, under a lock per key, so a slow or unreachable database only holds up its own requests.
+
+    The password hash is part of the key so a request with different credentials never reuses a driver
+    authenticated by someone else.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        # (uri, database) of every graph handed out, kept after the graph is retired until it is collected
+        self.connection_keys = weakref.WeakKeyDictionary()
+        self.max_connection_pool_size = int(os.environ.get('NEO4J_MAX_CONNECTION_POOL_SIZE', NEO4J_MAX_CONNECTION_POOL_SIZE))
+        self.max_drivers = int(os.environ.get('NEO4J_MAX_DRIVERS', NEO4J_MAX_DRIVERS))
+        self.idle_timeout = int(os.environ.get('NEO4J_DRIVER_IDLE_TIMEOUT', NEO4J_DRIVER_IDLE_TIMEOUT))
+        self.health_check_interval = int(os.environ.get('NEO4J_DRIVER_HEALTH_CHECK_INTERVAL', NEO4J_DRIVER_HEALTH_CHECK_INTERVAL))
+
+    def get_graph(self, uri, userName, password, database):
+        key = (uri, userName, hashlib.sha256((password or "").encode()).hexdigest(), database)
+        with self.lock:
+            self.retire_idle(time.monotonic())
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is not None and not self.is_healthy(entry, time.monotonic()):
+                with self.lock:
+                    if self.entries.get(key) is entry:
+                        self.retire_entry(key)
+                entry = None
+            if entry is None:
+                graph = self.create_graph(uri, userName, password, database)
+                entry = DriverEntry(graph, uri, database)
+                with self.lock:
+                    self.connection_keys[graph] = (uri, database)
+                logging.info(f"Created shared Neo4j driver for {uri} database {database}")
+            with self.lock:
+                self.entries[key] = entry
+                entry.last_used = time.monotonic()
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_drivers:
+                    self.retire_entry(next(iter(self.entries)))
+        return entry.graph
+
+    def get_driver(self, uri, userName, password, database):
+        """Return the driver of the shared graph as a GraphDriver, keep the handle referenced while using the driver."""
+        return GraphDriver(self.get_graph(uri, userName, password, database))
+
+    def get_connection_key(self, graph: Neo4jGraph):
+        """Return (uri, database) of a graph handed out by the registry, also once retired, None for graphs created elsewhere."""
+        with self.lock:
+            return self.connection_keys.get(graph)
+
+    def create_graph(self, uri, userName, password, database):
+        # database in the driver config is the default database for raw driver sessions and execute_query
+        driver_config = {'max_connection_pool_size': self.max_connection_pool_size, 'database': database}
+        enable_user_agent = os.environ.get("ENABLE_USER_AGENT", "False").lower() in ("true", "1", "yes")
+        if enable_user_agent:
+            driver_config['user_agent'] = os.environ.get('NEO4J_USER_AGENT')
+        return Neo4jGraph(url=uri, database=database, username=userName, password=password, refresh_schema=False, sanitize=True, driver_config=driver_config)
+
+    def is_healthy(self, entry: DriverEntry, now):
+        if entry.graph._driver._closed:
+            return False
+        if now - entry.last_health_check < self.health_check_interval:
+            return True
+        try:
+            entry.graph._driver.verify_connectivity()
+            entry.last_health_check = now
+            return True
+        except Exception as e:
+            logging.warning(f"Shared Neo4j driver failed its health check, recreating it: {e}")
+            return False
+
+    def retire_idle(self, now):
+        idle_keys = [key for key, entry in self.entries.items() if now - entry.last_used > self.idle_timeout]
+        for key in idle_keys:
+            self.retire_entry(key)
+        for key in [key for key, key_lock in self.key_locks.items() if key not in self.entries and not key_lock.locked()]:
+            del self.key_locks[key]
+
+    def retire_entry(self, key):
+        """Remove the entry, its driver stays open for the requests still holding the graph."""
+        self.entries.pop(key)
+        logging.info(f"Retired shared Neo4j driver for {key[0]} database {key[3]}")
+
+    def close_all(self):
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+        for entry in entries:
+            entry.finalizer()
+
+
+driver_registry = DriverRegistry()
@@ -0,0 +1,100 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from array import array
+from typing import List
+from src.shared.sqlite_cache import SQLiteCache
+
+EMBEDDING_CACHE_DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "embedding_cache", "embeddings.sqlite")
+EMBEDDING_CACHE_DEFAULT_MAX_SIZE_MB = 1024
+
+CREATE_EMBEDDING_CACHE_TABLE = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (model, content_hash)
+)
+"""
+
+
+class EmbeddingCache(SQLiteCache):
+    """
+    Persistent embedding cache keyed by (embedding model, SHA1 of the embedded text), stored in SQLite.
+    Vectors are stored as float32 blobs and the least recently used entries are evicted once the
+    cache grows beyond max_size_mb.
+    """
+
+    name = "Embedding cache"
+    entry_name = "embeddings"
+    table = "embeddings"
+    key_columns = ("model", "content_hash")
+    create_table_query = CREATE_EMBEDDING_CACHE_TABLE
+
+    def __init__(self, path: str = EMBEDDING_CACHE_DEFAULT_PATH, max_size_mb: int = EMBEDDING_CACHE_DEFAULT_MAX_SIZE_MB):
+        super().__init__(path, max_size_mb)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model: str, content_hashes: List[str]):
+        """Return a dict of content_hash -> embedding for the hashes present in the cache."""
+        found = {}
+        unique_hashes = list(dict.fromkeys(content_hashes))
+        with self.lock:
+            # SQLite limits the number of bound parameters per statement
+            for i in range(0, len(unique_hashes), 500):
+                hashes = unique_hashes[i:i+500]
+                placeholders = ",".join("?" * len(hashes))
+                rows = self.connection.execute(
+                    f"SELECT content_hash, embedding FROM embeddings WHERE model = ? AND content_hash IN ({placeholders})",
+                    [model, *hashes]).fetchall()
+                for content_hash, blob in rows:
+                    found[content_hash] = array('f', blob).tolist()
+            if found:
+                now = time.time()
+                self.connection.executemany("UPDATE embeddings SET last_access = ? WHERE model = ? AND content_hash = ?",
+                                            [(now, model, content_hash) for content_hash in found])
+                self.connection.commit()
+            self.hits += len(found)
+            self.misses += len(unique_hashes) - len(found)
+        return found
+
+    def put_many(self, model: str, content_hashes: List[str], embeddings: List[List[float]]):
+        now = time.time()
+        rows = []
+        for content_hash, embedding in zip(content_hashes, embeddings):
+            if embedding is None:
+                continue
+            blob = array('f', embedding).tobytes()
+            rows.append((model, content_hash, blob, len(blob), now))
+        if not rows:
+            return
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO embeddings (model, content_hash, embedding, size, last_access) VALUES (?, ?, ?, ?, ?)", rows)
+            self.connection.commit()
+            self.evict(sum(row[3] for row in rows))
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    """Return the process wide embedding cache, or None when EMBEDDING_CACHE_ENABLED is not set."""
+    global _embedding_cache
+    if os.environ.get('EMBEDDING_CACHE_ENABLED', 'False').upper() != "TRUE":
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            path = os.environ.get('EMBEDDING_CACHE_PATH') or EMBEDDING_CACHE_DEFAULT_PATH
+            max_size_mb = int(os.environ.get('EMBEDDING_CACHE_MAX_SIZE_MB', EMBEDDING_CACHE_DEFAULT_MAX_SIZE_MB))
+            _embedding_cache = EmbeddingCache(path, max_size_mb)
+            logging.info(f"Embedding cache opened at {path} with max size {max_size_mb} MB")
+    return _embedding_cache
+
+def get_content_hash(text: str):
+    """SHA1 of the text, the same hash used for Chunk ids."""
+    return hashlib.sha1(text.encode()).hexdigest()
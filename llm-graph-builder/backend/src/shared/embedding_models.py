@@ -0,0 +1,67 @@
+import logging
+import threading
+import time
+import psutil
+
+SENTENCE_TRANSFORMER_MODEL = "all-MiniLM-L6-v2"
+# known without loading the model, EMBEDDING_MODEL values other than openai and vertexai use the SentenceTransformer model
+EMBEDDING_MODEL_DIMENSIONS = {"openai": 1536, "vertexai": 768, SENTENCE_TRANSFORMER_MODEL: 384}
+
+
+def get_embedding_model_key(embedding_model_name: str):
+    return embedding_model_name if embedding_model_name in ("openai", "vertexai") else SENTENCE_TRANSFORMER_MODEL
+
+def get_embedding_dimension(embedding_model_name: str):
+    """Dimension of the embedding model, without loading it."""
+    return EMBEDDING_MODEL_DIMENSIONS[get_embedding_model_key(embedding_model_name)]
+
+def create_embedding_model(model_key: str):
+    # provider packages are imported on first use, the SentenceTransformer import alone pulls in torch
+    if model_key == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings()
+    if model_key == "vertexai":
+        from langchain_google_vertexai import VertexAIEmbeddings
+        return VertexAIEmbeddings(model="textembedding-gecko@003")
+    from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+    return SentenceTransformerEmbeddings(model_name=SENTENCE_TRANSFORMER_MODEL)#, cache_folder="/embedding_model"
+
+
+class EmbeddingModelRegistry:
+    """
+    Process wide registry of embedding models. Each model is created once, on first use, and shared by every
+    caller; a lock per model makes concurrent first calls wait for one load instead of loading it twice.
+    The load time and the resident memory growth of every load are logged and kept in stats.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.model_locks = {}
+
+    def get(self, embedding_model_name: str):
+        """Return (embeddings, dimension) for the model, loading it if this is its first use."""
+        model_key = get_embedding_model_key(embedding_model_name)
+        model = self.models.get(model_key)
+        if model is not None:
+            return model, EMBEDDING_MODEL_DIMENSIONS[model_key]
+        with self.lock:
+            model_lock = self.model_locks.setdefault(model_key, threading.Lock())
+        with model_lock:
+            if model_key not in self.models:
+                process = psutil.Process()
+                memory_before = process.memory_info().rss
+                start = time.time()
+                self.models[model_key] = create_embedding_model(model_key)
+                load_time = time.time() - start
+                memory_mb = (process.memory_info().rss - memory_before) / (1024 * 1024)
+                self.stats[model_key] = {"load_time": round(load_time, 2), "memory_mb": round(memory_mb, 1)}
+                logging.info(f"Embedding: loaded {model_key}, Dimension:{EMBEDDING_MODEL_DIMENSIONS[model_key]}, in {load_time:.2f} seconds using {memory_mb:.1f} MB")
+        return self.models[model_key], EMBEDDING_MODEL_DIMENSIONS[model_key]
+
+    def get_stats(self):
+        return dict(self.stats)
+
+
+embedding_model_registry = EmbeddingModelRegistry()
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import List
+from langchain.docstore.document import Document
+from langchain_community.graphs.graph_document import GraphDocument, Node, Relationship
+from src.shared.sqlite_cache import SQLiteCache
+
+EXTRACTION_CACHE_DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "extraction_cache", "graph_documents.sqlite")
+EXTRACTION_CACHE_DEFAULT_MAX_SIZE_MB = 512
+# bump when the extraction prompt or transformer settings change so stale results are not reused
+EXTRACTION_CACHE_VERSION = "1"
+
+CREATE_EXTRACTION_CACHE_TABLE = """
+CREATE TABLE IF NOT EXISTS graph_documents (
+    cache_key TEXT PRIMARY KEY,
+    graph_document TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+)
+"""
+
+
+def get_extraction_cache_key(page_content: str, model_name: str, allowedNodes: List[str], allowedRelationship: List[str]):
+    """Key a combined chunk by its content, the model and the allowed schema."""
+    key = json.dumps([EXTRACTION_CACHE_VERSION, model_name, sorted(allowedNodes), sorted(allowedRelationship),
+                      hashlib.sha1(page_content.encode()).hexdigest()])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def node_to_dict(node: Node):
+    return {"id": node.id, "type": node.type, "properties": node.properties}
+
+def graph_document_to_json(graph_document: GraphDocument):
+    return json.dumps({
+        "nodes": [node_to_dict(node) for node in graph_document.nodes],
+        "relationships": [{"source": node_to_dict(rel.source), "target": node_to_dict(rel.target),
+                           "type": rel.type, "properties": rel.properties} for rel in graph_document.relationships]
+    })
+
+def graph_document_from_json(value: str, source: Document):
+    """Rebuild a cached GraphDocument, attached to the current combined chunk document as its source."""
+    data = json.loads(value)
+    nodes = [Node(**node) for node in data["nodes"]]
+    relationships = [Relationship(source=Node(**rel["source"]), target=Node(**rel["target"]),
+                                  type=rel["type"], properties=rel["properties"]) for rel in data["relationships"]]
+    return GraphDocument(nodes=nodes, relationships=relationships, source=source)
+
+
+class ExtractionCache(SQLiteCache):
+    """
+    Persistent cache of LLM extraction results (GraphDocument nodes and relationships) stored in SQLite,
+    so retries and re-uploads of identical content do not send the same combined chunk to the LLM again.
+    The least recently used results are evicted once the cache grows beyond max_size_mb.
+    """
+
+    name = "Extraction cache"
+    entry_name = "graph documents"
+    table = "graph_documents"
+    key_columns = ("cache_key",)
+    create_table_query = CREATE_EXTRACTION_CACHE_TABLE
+
+    def __init__(self, path: str = EXTRACTION_CACHE_DEFAULT_PATH, max_size_mb: int = EXTRACTION_CACHE_DEFAULT_MAX_SIZE_MB):
+        super().__init__(path, max_size_mb)
+
+    def get(self, cache_key: str):
+        with self.lock:
+            row = self.connection.execute("SELECT graph_document FROM graph_documents WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE graph_documents SET last_access = ? WHERE cache_key = ?", (time.time(), cache_key))
+            self.connection.commit()
+        return row[0]
+
+    def put_many(self, items):
+        """items: list of (cache_key, GraphDocument)"""
+        now = time.time()
+        rows = []
+        for cache_key, graph_document in items:
+            value = graph_document_to_json(graph_document)
+            rows.append((cache_key, value, len(value), now))
+        if not rows:
+            return
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO graph_documents (cache_key, graph_document, size, last_access) VALUES (?, ?, ?, ?)", rows)
+            self.connection.commit()
+            self.evict(sum(row[2] for row in rows))
+
+
+_extraction_cache = None
+_extraction_cache_lock = threading.Lock()
+
+def get_extraction_cache():
+    """Return the process wide extraction cache, or None when EXTRACTION_CACHE_ENABLED is not set."""
+    global _extraction_cache
+    if os.environ.get('EXTRACTION_CACHE_ENABLED', 'False').upper() != "TRUE":
+        return None
+    with _extraction_cache_lock:
+        if _extraction_cache is None:
+            path = os.environ.get('EXTRACTION_CACHE_PATH') or EXTRACTION_CACHE_DEFAULT_PATH
+            max_size_mb = int(os.environ.get('EXTRACTION_CACHE_MAX_SIZE_MB', EXTRACTION_CACHE_DEFAULT_MAX_SIZE_MB))
+            _extraction_cache = ExtractionCache(path, max_size_mb)
+            logging.info(f"Extraction cache opened at {path} with max size {max_size_mb} MB")
+    return _extraction_cache
@@ -0,0 +1,90 @@
+import builtins
+import logging
+import os
+import sys
+import threading
+import time
+
+IMPORT_PROFILE_TOP_MODULES = 25
+
+
+class ImportProfiler:
+    """
+    Time every module imported while the profiler is started, like python -X importtime but reported through
+    logging so it shows up in the worker logs. The import statement is wrapped, a module's cumulative time
+    includes the modules it imports and its self time doesn't. Only the thread that started the profiler is
+    measured, imports from other threads go straight through.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.stack = []
+        self.original_import = None
+        self.thread_id = None
+        self.start_time = None
+        self.total_time = 0.0
+
+    def start(self):
+        if self.original_import is not None:
+            return
+        self.original_import = builtins.__import__
+        self.thread_id = threading.get_ident()
+        self.start_time = time.perf_counter()
+        builtins.__import__ = self.timed_import
+
+    def stop(self):
+        if self.original_import is None:
+            return
+        builtins.__import__ = self.original_import
+        self.original_import = None
+        self.total_time = time.perf_counter() - self.start_time
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # relative imports and modules already loaded are counted in the importing module
+        if level or name in sys.modules or threading.get_ident() != self.thread_id:
+            return self.original_import(name, globals, locals, fromlist, level)
+        self.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = time.perf_counter() - start
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += cumulative
+            self.timings[name] = {"cumulative": cumulative, "self": cumulative - children}
+
+    def report(self, top: int = IMPORT_PROFILE_TOP_MODULES):
+        """Cumulative import time per top level package and the modules with the largest self time."""
+        packages = {}
+        for name, timing in self.timings.items():
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0.0) + timing["self"]
+        return {
+            "total_time": round(self.total_time, 3),
+            "packages": {package: round(seconds, 3) for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+            "modules": {name: {key: round(seconds, 3) for key, seconds in timing.items()}
+                        for name, timing in sorted(self.timings.items(), key=lambda item: -item[1]["self"])[:top]},
+        }
+
+    def log_report(self, top: int = IMPORT_PROFILE_TOP_MODULES):
+        report = self.report(top)
+        logging.info(f"Startup imports took {report['total_time']:.2f} seconds in {len(self.timings)} modules")
+        for package, seconds in report["packages"].items():
+            logging.info(f"Import time {seconds:8.3f} s  package {package}")
+        for name, timing in report["modules"].items():
+            logging.info(f"Import time {timing['self']:8.3f} s self {timing['cumulative']:8.3f} s cumulative  {name}")
+
+
+import_profiler = ImportProfiler()
+
+def start_import_profile():
+    """Start timing imports when IMPORT_PROFILE is set, a no-op otherwise."""
+    if os.environ.get('IMPORT_PROFILE', 'False').upper() == "TRUE":
+        import_profiler.start()
+
+def stop_import_profile():
+    """Stop timing imports and log the per package and per module report."""
+    if import_profiler.original_import is not None:
+        import_profiler.stop()
+        import_profiler.log_report(int(os.environ.get('IMPORT_PROFILE_TOP_MODULES', IMPORT_PROFILE_TOP_MODULES)))
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+# LLM_MODEL_RATE_LIMIT_<model> follows the LLM_MODEL_CONFIG_<model> naming: "max_concurrency,requests_per_minute"
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_REQUESTS_PER_MINUTE = 0
+RATE_LIMIT_ERROR_MARKERS = ("429", "rate limit", "ratelimit", "too many requests", "resource_exhausted", "resource exhausted", "throttl")
+
+
+class TokenBucket:
+    """Async token bucket refilled at requests_per_minute / 60 tokens per second."""
+
+    def __init__(self, requests_per_minute: int, capacity: int):
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1, capacity)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ExtractionScheduler:
+    """
+    Limits the extraction calls made to one model: at most max_concurrency requests in flight,
+    at most requests_per_minute requests started per minute (0 disables the limit), and rate limit
+    errors are retried with exponential backoff and full jitter.
+    """
+
+    def __init__(self, model: str, max_concurrency: int, requests_per_minute: int):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.token_bucket = TokenBucket(requests_per_minute, max_concurrency) if requests_per_minute > 0 else None
+        self.max_retries = int(os.environ.get('LLM_MAX_RETRIES', '5'))
+        self.retry_base_delay = float(os.environ.get('LLM_RETRY_BASE_DELAY', '1'))
+        self.retry_max_delay = float(os.environ.get('LLM_RETRY_MAX_DELAY', '60'))
+
+    async def run(self, func, *args):
+        """Await func(*args) within the concurrency and rate limits of the model."""
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                if self.token_bucket is not None:
+                    await self.token_bucket.acquire()
+                try:
+                    return await func(*args)
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                        raise
+            delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+            attempt += 1
+            logging.warning(f"Rate limited by model {self.model}, retry {attempt}/{self.max_retries} in {delay:.2f} seconds")
+            await asyncio.sleep(delay)
+
+
+def is_rate_limit_error(error: Exception):
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status_code == 429:
+        return True
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in RATE_LIMIT_ERROR_MARKERS)
+
+def get_rate_limit_config(model: str):
+    env_value = os.environ.get("LLM_MODEL_RATE_LIMIT_" + model)
+    if not env_value:
+        max_concurrency = int(os.environ.get('LLM_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY))
+        requests_per_minute = int(os.environ.get('LLM_REQUESTS_PER_MINUTE', DEFAULT_REQUESTS_PER_MINUTE))
+        return max_concurrency, requests_per_minute
+    max_concurrency, requests_per_minute = env_value.split(",")
+    return int(max_concurrency), int(requests_per_minute)
+
+
+# event loop -> {model: scheduler}. A semaphore that had waiters references its loop, so closed loops are
+# also pruned explicitly, the weak key alone would not free them
+_schedulers = weakref.WeakKeyDictionary()
+_schedulers_lock = threading.Lock()
+
+def get_extraction_scheduler(model: str):
+    """
+    Return the scheduler shared by every extraction for the model, so the limits hold across
+    batches and files processed concurrently. asyncio primitives belong to one event loop, so
+    schedulers are kept per running loop, keyed on the loop itself rather than its id which a
+    later loop can reuse.
+    """
+    loop = asyncio.get_running_loop()
+    with _schedulers_lock:
+        for closed_loop in [scheduler_loop for scheduler_loop in _schedulers if scheduler_loop.is_closed()]:
+            del _schedulers[closed_loop]
+        loop_schedulers = _schedulers.setdefault(loop, {})
+        if model not in loop_schedulers:
+            max_concurrency, requests_per_minute = get_rate_limit_config(model)
+            loop_schedulers[model] = ExtractionScheduler(model, max(1, max_concurrency), requests_per_minute)
+            logging.info(f"Extraction scheduler for {model}: max concurrency {max_concurrency}, requests per minute {requests_per_minute or 'unlimited'}")
+        return loop_schedulers[model]
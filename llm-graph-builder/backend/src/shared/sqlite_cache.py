@@ -0,0 +1,71 @@
+import logging
+import os
+import sqlite3
+import threading
+
+# after an eviction the cache is trimmed down to this fraction of the maximum size
+SQLITE_CACHE_EVICTION_TARGET = 0.9
+# the size is counted again after this many writes, to include the writes of the other processes sharing the file
+SQLITE_CACHE_RECOUNT_INTERVAL = 1000
+
+
+class SQLiteCache:
+    """
+    Base of the persistent caches stored in SQLite. A subclass sets table, the CREATE TABLE statement
+    create_table_query and its key_columns; the table also has a size and a last_access column. The
+    connection is shared by threads behind self.lock and the least recently used rows are evicted once
+    the sizes add up to more than max_size_mb.
+
+    The size of the cache is a running total of the written sizes, counted exactly with SUM(size) only when
+    the total goes over the maximum size and every SQLITE_CACHE_RECOUNT_INTERVAL writes.
+    """
+
+    name = "Cache"
+    entry_name = "entries"
+    table = None
+    key_columns = ()
+    create_table_query = None
+
+    def __init__(self, path: str, max_size_mb: int):
+        self.path = path
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(self.create_table_query)
+        self.connection.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table} (last_access)")
+        self.connection.commit()
+        self.total_size = self.count_size()
+        self.writes_since_count = 0
+
+    def count_size(self):
+        return self.connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+
+    def evict(self, written_size: int):
+        """
+        Add the size of the rows just written to the running total, a replaced row is counted twice until the
+        next count, and delete the least recently used rows down to SQLITE_CACHE_EVICTION_TARGET of the maximum
+        size when it is exceeded. Called with self.lock held.
+        """
+        self.total_size += written_size
+        self.writes_since_count += 1
+        if self.total_size <= self.max_size_bytes and self.writes_since_count < SQLITE_CACHE_RECOUNT_INTERVAL:
+            return
+        total_size = self.total_size = self.count_size()
+        self.writes_since_count = 0
+        if total_size <= self.max_size_bytes:
+            return
+        target_size = self.max_size_bytes * SQLITE_CACHE_EVICTION_TARGET
+        key_columns = ", ".join(self.key_columns)
+        to_delete = []
+        for *key, size in self.connection.execute(f"SELECT {key_columns}, size FROM {self.table} ORDER BY last_access ASC"):
+            if total_size <= target_size:
+                break
+            to_delete.append(key)
+            total_size -= size
+        key_condition = " AND ".join(f"{column} = ?" for column in self.key_columns)
+        self.connection.executemany(f"DELETE FROM {self.table} WHERE {key_condition}", to_delete)
+        self.connection.commit()
+        self.total_size = total_size
+        logging.info(f"{self.name} evicted {len(to_delete)} least recently used {self.entry_name}")
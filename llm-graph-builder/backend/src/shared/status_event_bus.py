@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import threading
+
+STATUS_POLL_MIN_INTERVAL = 1
+STATUS_POLL_MAX_INTERVAL = 30
+# Document properties that are part of the extraction status stream
+STATUS_FIELDS = ('status', 'processingTime', 'nodeCount', 'relationshipCount', 'model', 'total_chunks', 'fileSize', 'processed_chunk', 'fileSource')
+
+
+class StatusTopic:
+    """Latest known status of one document and the SSE subscribers waiting for changes to it."""
+
+    def __init__(self):
+        self.snapshot = None
+        self.subscribers = set()
+        self.poller = None
+        # incremented on every change, a poll result is dropped when the snapshot changed while it was being read
+        self.version = 0
+
+
+class StatusEventBus:
+    """
+    In-process pub/sub for extraction status, keyed by (uri, database, file name).
+
+    update_source_node publishes the properties it writes and every SSE subscriber of the document is woken
+    up; bursts are coalesced because subscribers only ever read the latest snapshot. Updates made by other
+    worker processes are picked up by one shared poller per document, which reads the Document node with an
+    interval doubling from STATUS_POLL_MIN_INTERVAL to STATUS_POLL_MAX_INTERVAL while nothing changes, so the
+    database load does not grow with the number of viewers.
+    """
+
+    def __init__(self):
+        self.topics = {}
+        self.lock = threading.Lock()
+        self.poll_min_interval = float(os.environ.get('STATUS_POLL_MIN_INTERVAL', STATUS_POLL_MIN_INTERVAL))
+        self.poll_max_interval = float(os.environ.get('STATUS_POLL_MAX_INTERVAL', STATUS_POLL_MAX_INTERVAL))
+
+    def publish(self, key, properties: dict):
+        """Merge the changed properties into the snapshot and notify the subscribers, callable from any thread."""
+        changes = {field: properties[field] for field in STATUS_FIELDS if field in properties}
+        with self.lock:
+            topic = self.topics.get(key)
+            if topic is None or topic.snapshot is None or not changes:
+                return
+            snapshot = {**topic.snapshot, **changes}
+            if snapshot == topic.snapshot:
+                return
+            topic.snapshot = snapshot
+            topic.version += 1
+            subscribers = list(topic.subscribers)
+        for loop, event in subscribers:
+            loop.call_soon_threadsafe(event.set)
+
+    async def subscribe(self, key, fetch_status):
+        """
+        Async generator yielding the status of the document every time it changes, starting with the current one.
+
+        fetch_status: blocking callable returning the status dict of the document read from the database, or None
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        subscriber = (loop, event)
+        with self.lock:
+            topic = self.topics.setdefault(key, StatusTopic())
+            topic.subscribers.add(subscriber)
+            needs_snapshot = topic.snapshot is None
+            read_version = topic.version
+        try:
+            if needs_snapshot:
+                self.set_snapshot(key, await asyncio.to_thread(fetch_status), read_version)
+            with self.lock:
+                if topic.poller is None or topic.poller.done():
+                    topic.poller = loop.create_task(self.poll(key, topic, fetch_status))
+            last_sent = None
+            while True:
+                with self.lock:
+                    snapshot = topic.snapshot
+                if snapshot is not None and snapshot != last_sent:
+                    last_sent = snapshot
+                    yield snapshot
+                await event.wait()
+                event.clear()
+        finally:
+            with self.lock:
+                topic.subscribers.discard(subscriber)
+                if not topic.subscribers:
+                    if topic.poller is not None:
+                        topic.poller.cancel()
+                    self.topics.pop(key, None)
+
+    def set_snapshot(self, key, status, read_version):
+        if status is None:
+            return
+        with self.lock:
+            topic = self.topics.get(key)
+            if topic is None or topic.version != read_version or topic.snapshot == status:
+                return
+            topic.snapshot = status
+            topic.version += 1
+            subscribers = list(topic.subscribers)
+        for loop, event in subscribers:
+            loop.call_soon_threadsafe(event.set)
+
+    async def poll(self, key, topic, fetch_status):
+        interval = self.poll_min_interval
+        while True:
+            await asyncio.sleep(interval)
+            with self.lock:
+                read_version = topic.version
+            try:
+                status = await asyncio.to_thread(fetch_status)
+            except Exception as e:
+                logging.error(f"Status poll failed for {key[2]}: {e}")
+                status = None
+            with self.lock:
+                changed = status is not None and status != topic.snapshot
+            if changed:
+                self.set_snapshot(key, status, read_version)
+                interval = self.poll_min_interval
+            else:
+                interval = min(interval * 2, self.poll_max_interval)
+
+
+status_event_bus = StatusEventBus()
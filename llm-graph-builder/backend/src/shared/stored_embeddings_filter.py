@@ -0,0 +1,72 @@
+import logging
+from typing import Optional, Sequence
+import numpy as np
+from pydantic import ConfigDict
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
+from langchain_community.document_transformers.embeddings_redundant_filter import get_stateful_documents
+
+STORED_EMBEDDINGS_METADATA_KEY = "embeddings"
+
+
+class StoredEmbeddingsFilter(BaseDocumentCompressor):
+    """
+    Drop retrieved documents whose similarity to the query is below similarity_threshold, like EmbeddingsFilter,
+    but score them with the vectors already stored in the graph instead of embedding their text again.
+
+    The retrieval queries return the embeddings of the chunks (or communities, entities) a document was built
+    from in metadata["embeddings"]. The query is embedded once, all stored vectors are scored with a single
+    matrix multiply and a document's score is the cosine similarity of its best matching vector. Only documents
+    without usable stored vectors, for example from another embedding model, have their text embedded, in one
+    embed_documents call. The score is kept in state["query_similarity_score"] like EmbeddingsFilter does and the
+    vectors are removed from the metadata so they don't travel further with the documents.
+    """
+
+    embeddings: Embeddings
+    similarity_threshold: float
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def compress_documents(self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        if not documents:
+            return []
+        documents = get_stateful_documents(documents)
+        query_embedding = normalize(np.asarray(self.embeddings.embed_query(query), dtype=np.float32))
+        dimension = query_embedding.shape[0]
+
+        vectors = []
+        offsets = []
+        without_vectors = []
+        for index, document in enumerate(documents):
+            stored = [vector for vector in document.metadata.pop(STORED_EMBEDDINGS_METADATA_KEY, None) or []
+                      if vector is not None and len(vector) == dimension]
+            if stored:
+                offsets.append((index, len(vectors)))
+                vectors.extend(stored)
+            else:
+                without_vectors.append(index)
+
+        scores = np.zeros(len(documents), dtype=np.float32)
+        if vectors:
+            similarities = normalize(np.asarray(vectors, dtype=np.float32)) @ query_embedding
+            best = np.maximum.reduceat(similarities, [start for _, start in offsets])
+            scores[[index for index, _ in offsets]] = best
+        if without_vectors:
+            logging.info(f"Embedding {len(without_vectors)} retrieved documents without stored vectors")
+            texts = [documents[index].page_content for index in without_vectors]
+            embedded = normalize(np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32))
+            scores[without_vectors] = embedded @ query_embedding
+
+        filtered_documents = []
+        for document, score in zip(documents, scores):
+            if score >= self.similarity_threshold:
+                document.state["query_similarity_score"] = float(score)
+                filtered_documents.append(document)
+        return filtered_documents
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
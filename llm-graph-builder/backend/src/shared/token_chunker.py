@@ -0,0 +1,89 @@
+import itertools
+import logging
+import threading
+import tiktoken
+
+CHUNK_SIZE = 200
+CHUNK_OVERLAP = 20
+# TokenTextSplitter's default encoding, chunk boundaries stay the same as with the langchain splitter
+TOKENIZER_ENCODING = "gpt2"
+
+
+class TokenChunker:
+    """
+    Split text into windows of chunk_size tokens overlapping by chunk_overlap tokens, like TokenTextSplitter.
+
+    Each text is tokenized once. Instead of decoding every window, the character offsets of the window
+    boundaries are computed from a per-token byte length table of the vocabulary, and the chunk text is a
+    slice of the original text. Boundaries falling inside a multi-byte character are moved back to the
+    start of that character, so chunks never contain partial characters.
+    """
+
+    def __init__(self, encoding_name: str = TOKENIZER_ENCODING, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.token_byte_lengths = get_token_byte_lengths(self.encoding)
+
+    def split_text_with_offsets(self, text: str):
+        """Return the chunks of text as a list of (start, end, chunk_text) with character offsets into text."""
+        tokens = self.encoding.encode_ordinary(text)
+        if not tokens:
+            return []
+        step = self.chunk_size - self.chunk_overlap
+        token_windows = []
+        for start in range(0, len(tokens), step):
+            end = min(start + self.chunk_size, len(tokens))
+            token_windows.append((start, end))
+            if end == len(tokens):
+                break
+
+        byte_offsets = [0, *itertools.accumulate(map(self.token_byte_lengths.__getitem__, tokens))]
+        text_bytes = text.encode("utf-8")
+        boundaries = sorted({token_index for window in token_windows for token_index in window})
+        char_offsets = {}
+        previous_byte_offset = 0
+        char_offset = 0
+        for token_index in boundaries:
+            byte_offset = align_to_char_start(text_bytes, byte_offsets[token_index])
+            char_offset += len(text_bytes[previous_byte_offset:byte_offset].decode("utf-8"))
+            char_offsets[token_index] = char_offset
+            previous_byte_offset = byte_offset
+
+        chunks = []
+        for start, end in token_windows:
+            char_start, char_end = char_offsets[start], char_offsets[end]
+            if char_end > char_start:
+                chunks.append((char_start, char_end, text[char_start:char_end]))
+        return chunks
+
+
+def align_to_char_start(text_bytes: bytes, byte_offset: int):
+    while 0 < byte_offset < len(text_bytes) and 0x80 <= text_bytes[byte_offset] < 0xC0:
+        byte_offset -= 1
+    return byte_offset
+
+def get_token_byte_lengths(encoding):
+    """Byte length of every token id of the encoding, ids without a token map to 0."""
+    token_byte_lengths = []
+    for token in range(encoding.n_vocab):
+        try:
+            token_byte_lengths.append(len(encoding.decode_single_token_bytes(token)))
+        except KeyError:
+            token_byte_lengths.append(0)
+    return token_byte_lengths
+
+
+_chunkers = {}
+_chunkers_lock = threading.Lock()
+
+def get_token_chunker(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP, encoding_name: str = TOKENIZER_ENCODING):
+    """Return the process wide chunker for the settings, the tokenizer and its byte length table are built once."""
+    key = (encoding_name, chunk_size, chunk_overlap)
+    with _chunkers_lock:
+        if key not in _chunkers:
+            _chunkers[key] = TokenChunker(encoding_name, chunk_size, chunk_overlap)
+            logging.info(f"Created token chunker with encoding {encoding_name}, chunk size {chunk_size} and overlap {chunk_overlap}")
+        return _chunkers[key]
@@ -0,0 +1,38 @@
+import asyncio
+import threading
+import pytest
+
+pytest.importorskip("langchain_community")
+from src.main import LockedIterator, finish_chunk_batches, iterate_in_thread
+
+
+def test_finish_waits_for_a_batch_taken_by_a_cancelled_iteration():
+    taken = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def batches():
+        for i in range(5):
+            if i == 1:
+                started.set()
+                release.wait(5)
+            taken.append(i)
+            yield i, i + 1, [i]
+
+    async def run():
+        chunk_batches = LockedIterator(batches())
+
+        async def consume():
+            async for _ in iterate_in_thread(chunk_batches):
+                pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        threading.Timer(0.2, release.set).start()
+        await finish_chunk_batches(chunk_batches, "file.pdf")
+
+    asyncio.run(run())
+    assert taken == [0, 1, 2, 3, 4]
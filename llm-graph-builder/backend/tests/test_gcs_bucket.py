@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip("google.cloud.storage")
+from src.document_sources.gcs_bucket import GCS_MAX_COMPOSE_SOURCES, compose_blobs
+
+
+class FakeBlob:
+    def __init__(self, name):
+        self.name = name
+        self.sources = None
+
+    def compose(self, sources):
+        assert len(sources) <= GCS_MAX_COMPOSE_SOURCES
+        self.sources = list(sources)
+
+    def parts(self):
+        if self.sources is None:
+            return [self.name]
+        return [part for source in self.sources for part in source.parts()]
+
+
+class FakeBucket:
+    def blob(self, name):
+        return FakeBlob(name)
+
+
+@pytest.mark.parametrize("part_count", [1, GCS_MAX_COMPOSE_SOURCES, GCS_MAX_COMPOSE_SOURCES + 1, GCS_MAX_COMPOSE_SOURCES ** 2 + 5])
+def test_parts_are_composed_in_order(part_count):
+    parts = [FakeBlob(f"part_{i}") for i in range(part_count)]
+    destination = FakeBlob("file.pdf")
+    temporary_blobs = compose_blobs(FakeBucket(), parts, destination, "file.pdf")
+    assert destination.parts() == [part.name for part in parts]
+    if part_count <= GCS_MAX_COMPOSE_SOURCES:
+        assert temporary_blobs == []
+    else:
+        assert len({blob.name for blob in temporary_blobs}) == len(temporary_blobs)
@@ -0,0 +1,81 @@
+import time
+import pytest
+
+pytest.importorskip("psutil")
+pytest.importorskip("cryptography")
+from src.job_queue import JOB_STATUS_COMPLETED, JOB_STATUS_FAILED, JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JobQueue
+
+
+@pytest.fixture
+def job_queue(tmp_path, monkeypatch):
+    monkeypatch.delenv("JOB_QUEUE_SECRET_KEY", raising=False)
+    monkeypatch.setenv("JOB_STALE_TIMEOUT", "60")
+    monkeypatch.setenv("JOB_MAX_ATTEMPTS", "2")
+    return JobQueue(str(tmp_path / "jobs.sqlite"))
+
+def make_stale(job_queue, job_id, owner="other-host:1:0.0"):
+    with job_queue.lock:
+        job_queue.connection.execute("UPDATE jobs SET heartbeat_at = ?, owner = ? WHERE id = ?", (time.time() - 120, owner, job_id))
+
+
+def test_jobs_are_claimed_once_in_order(job_queue):
+    first = job_queue.submit({"file_name": "a.pdf"}, "a.pdf")
+    second = job_queue.submit({"file_name": "b.pdf"}, "b.pdf")
+    claimed = [job_queue.claim(), job_queue.claim()]
+    assert [job["job_id"] for job in claimed] == [first, second]
+    assert [job["attempt"] for job in claimed] == [1, 1]
+    assert claimed[0]["payload"] == {"file_name": "a.pdf"}
+    assert job_queue.claim() is None
+    assert job_queue.get(first)["status"] == JOB_STATUS_RUNNING
+
+def test_payload_is_encrypted_and_cleared_when_finished(job_queue):
+    job_id = job_queue.submit({"password": "secret"}, "a.pdf")
+    with job_queue.lock:
+        stored_payload = job_queue.connection.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    assert "secret" not in stored_payload
+    job_queue.claim()
+    job_queue.finish(job_id, JOB_STATUS_COMPLETED, {"nodeCount": 3})
+    with job_queue.lock:
+        assert job_queue.connection.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] is None
+    assert job_queue.get(job_id)["result"] == {"nodeCount": 3}
+
+def test_stale_job_is_resumed_with_the_next_attempt(job_queue):
+    job_id = job_queue.submit({"file_name": "a.pdf"}, "a.pdf")
+    job_queue.claim()
+    assert job_queue.claim() is None
+    make_stale(job_queue, job_id)
+    job = job_queue.claim()
+    assert job["job_id"] == job_id
+    assert job["attempt"] == 2
+    assert job["payload"] == {"file_name": "a.pdf"}
+
+def test_stale_job_of_a_running_process_is_not_claimed(job_queue, tmp_path):
+    job_id = job_queue.submit({}, "a.pdf")
+    job_queue.claim()
+    other_queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    other_queue.owner = "another-worker"
+    make_stale(job_queue, job_id, owner=job_queue.owner)
+    assert other_queue.claim() is None
+
+def test_job_is_abandoned_after_max_attempts(job_queue):
+    job_id = job_queue.submit({}, "a.pdf")
+    for _ in range(2):
+        job_queue.claim()
+        make_stale(job_queue, job_id)
+    assert job_queue.claim() is None
+    job = job_queue.get(job_id)
+    assert job["status"] == JOB_STATUS_FAILED
+    assert "2 attempts" in job["error"]
+
+def test_batch_summary(job_queue):
+    first = job_queue.submit({}, "a.pdf", "batch", 2 * 1024 * 1024)
+    job_queue.submit({}, "b.pdf", "batch", 1024)
+    job_queue.claim()
+    job_queue.finish(first, JOB_STATUS_COMPLETED, {})
+    summary = job_queue.get_batch_summary("batch")
+    assert summary["total_files"] == 2
+    assert summary["extracted_files"] == 1
+    assert summary["queued_files"] == 1
+    assert summary["processed_bytes"] == 2 * 1024 * 1024
+    assert [file["status"] for file in summary["files"]] == [JOB_STATUS_COMPLETED, JOB_STATUS_QUEUED]
+    assert job_queue.get_batch_summary("unknown") is None
@@ -0,0 +1,75 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+from src.knn_graph import load_chunk_embeddings, normalize_rows, top_k_neighbours
+
+
+def brute_force_neighbours(embeddings, query_indices, k, min_score):
+    scores = (1 + embeddings @ embeddings.T) / 2
+    neighbours = set()
+    for query_index in query_indices:
+        candidates = [(scores[query_index, index], index) for index in range(len(embeddings)) if index != query_index]
+        for score, index in sorted(candidates, reverse=True)[:k]:
+            if score >= min_score:
+                neighbours.add((query_index, index))
+    return neighbours
+
+
+@pytest.fixture
+def embeddings():
+    return normalize_rows(np.random.default_rng(7).standard_normal((50, 8)).astype(np.float32))
+
+
+def test_blocked_search_matches_brute_force(embeddings):
+    query_indices = np.arange(len(embeddings))
+    neighbours = list(top_k_neighbours(embeddings, query_indices, k=3, min_score=0, query_block_size=7, corpus_block_size=11))
+    assert {(query_index, index) for query_index, index, _ in neighbours} == brute_force_neighbours(embeddings, query_indices, 3, 0)
+    assert all(query_index != index for query_index, index, _ in neighbours)
+
+def test_scores_below_min_score_are_dropped(embeddings):
+    query_indices = np.array([0, 5, 9])
+    neighbours = list(top_k_neighbours(embeddings, query_indices, k=5, min_score=0.6, query_block_size=2, corpus_block_size=16))
+    assert {(query_index, index) for query_index, index, _ in neighbours} == brute_force_neighbours(embeddings, query_indices, 5, 0.6)
+    assert all(score >= 0.6 for _, _, score in neighbours)
+
+def test_k_larger_than_the_corpus(embeddings):
+    corpus = embeddings[:3]
+    neighbours = list(top_k_neighbours(corpus, np.arange(3), k=10, min_score=0, query_block_size=4, corpus_block_size=2))
+    assert len(neighbours) == 6
+
+
+class FakeSession:
+    def __init__(self, records):
+        self.records = records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def run(self, query):
+        return iter(self.records)
+
+
+class FakeDriver:
+    def __init__(self, records):
+        self.records = records
+
+    def session(self, **config):
+        return FakeSession(self.records)
+
+
+def test_embeddings_of_another_dimension_are_skipped():
+    records = [{"element_id": "old", "embedding": [1.0] * 4, "is_new": True},
+               {"element_id": "a", "embedding": [1.0] * 3, "is_new": True},
+               {"element_id": "b", "embedding": [0.5] * 3, "is_new": False}]
+    element_ids, is_new, embeddings = load_chunk_embeddings(FakeDriver(records), "neo4j", fetch_size=1, dimension=3)
+    assert element_ids == ["a", "b"]
+    assert is_new.tolist() == [True, False]
+    assert embeddings.shape == (2, 3)
+
+def test_no_embeddings():
+    element_ids, is_new, embeddings = load_chunk_embeddings(FakeDriver([]), "neo4j", fetch_size=10, dimension=3)
+    assert element_ids == []
+    assert embeddings.shape == (0, 3)
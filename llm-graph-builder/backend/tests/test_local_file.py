@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip("langchain_community")
+from langchain_core.documents import Document
+from src.document_sources.local_file import get_pages_with_page_numbers
+
+
+def element(text, category="NarrativeText", **metadata):
+    return Document(page_content=text, metadata={"source": "file.pdf", "filename": "file.pdf", "filetype": "application/pdf",
+                                                 "category": category, **metadata})
+
+
+def test_elements_are_joined_into_pages_at_page_breaks():
+    pages = get_pages_with_page_numbers([element("a"), element("b"), element("", category="PageBreak"), element("c"), element("d")])
+    assert [page.page_content for page in pages] == ["ab", "cd"]
+    assert pages[-1].metadata["page_number"] == 1
+
+def test_element_equal_to_the_last_one_does_not_end_the_document():
+    pages = get_pages_with_page_numbers([element("x"), element("y"), element("x")])
+    assert [page.page_content for page in pages] == ["xyx"]
+
+def test_elements_of_one_numbered_page():
+    pages = get_pages_with_page_numbers([element("a", page_number=1), element("b", page_number=1)])
+    assert [page.page_content for page in pages] == ["ab"]
+
+def test_no_elements():
+    assert get_pages_with_page_numbers([]) == []
@@ -0,0 +1,40 @@
+import itertools
+import pytest
+from src.shared import embedding_cache
+from src.shared.embedding_cache import EmbeddingCache
+
+# 1024 float32 values, 4 KiB per cached embedding
+EMBEDDING = [0.5] * 1024
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    clock = itertools.count(1)
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: next(clock))
+    return EmbeddingCache(str(tmp_path / "embeddings.sqlite"), max_size_mb=1)
+
+def cached_hashes(cache):
+    with cache.lock:
+        return {row[0] for row in cache.connection.execute("SELECT content_hash FROM embeddings")}
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    cache.put_many("model", ["kept"], [EMBEDDING])
+    for i in range(300):
+        cache.put_many("model", [f"hash_{i}"], [EMBEDDING])
+        if i % 10 == 0:
+            assert cache.get_many("model", ["kept"]) == {"kept": EMBEDDING}
+    hashes = cached_hashes(cache)
+    assert "kept" in hashes
+    assert "hash_0" not in hashes
+    assert "hash_299" in hashes
+    assert len(hashes) * len(EMBEDDING) * 4 <= 1024 * 1024
+
+def test_cache_under_its_maximum_size_is_not_evicted(cache):
+    cache.put_many("model", [f"hash_{i}" for i in range(100)], [EMBEDDING] * 100)
+    assert len(cached_hashes(cache)) == 100
+
+def test_size_is_counted_from_the_existing_rows(cache, tmp_path):
+    cache.put_many("model", [f"hash_{i}" for i in range(10)], [EMBEDDING] * 10)
+    reopened_cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"), max_size_mb=1)
+    assert reopened_cache.total_size == 10 * len(EMBEDDING) * 4
@@ -0,0 +1,49 @@
+import pytest
+
+tiktoken = pytest.importorskip("tiktoken")
+from src.shared.token_chunker import TokenChunker, TOKENIZER_ENCODING, align_to_char_start
+
+
+@pytest.fixture(scope="module")
+def chunker():
+    try:
+        tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        pytest.skip(f"{TOKENIZER_ENCODING} encoding is not available: {e}")
+    return TokenChunker(chunk_size=200, chunk_overlap=20)
+
+
+TEXT = " ".join(f"Sentence {i} talks about graph databases, chunking and retrieval." for i in range(300))
+MULTIBYTE_TEXT = " ".join(f"Grüße {i}: 東京タワー 🚀 naïve café" for i in range(300))
+
+
+def test_offsets_slice_the_original_text(chunker):
+    chunks = chunker.split_text_with_offsets(MULTIBYTE_TEXT)
+    assert len(chunks) > 1
+    for start, end, chunk_text in chunks:
+        assert MULTIBYTE_TEXT[start:end] == chunk_text
+    assert chunks[0][0] == 0
+    assert chunks[-1][1] == len(MULTIBYTE_TEXT)
+
+def test_chunks_overlap_and_cover_the_text(chunker):
+    chunks = chunker.split_text_with_offsets(TEXT)
+    for (_, previous_end, _), (start, _, _) in zip(chunks, chunks[1:]):
+        assert start < previous_end
+
+def test_boundaries_match_token_text_splitter(chunker):
+    text_splitters = pytest.importorskip("langchain_text_splitters")
+    splitter = text_splitters.TokenTextSplitter(encoding_name=TOKENIZER_ENCODING, chunk_size=200, chunk_overlap=20)
+    assert [chunk_text for _, _, chunk_text in chunker.split_text_with_offsets(TEXT)] == splitter.split_text(TEXT)
+
+def test_empty_text_has_no_chunks(chunker):
+    assert chunker.split_text_with_offsets("") == []
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        TokenChunker(chunk_size=20, chunk_overlap=20)
+
+def test_align_to_char_start_moves_back_to_the_lead_byte():
+    text_bytes = "aü".encode("utf-8")
+    assert align_to_char_start(text_bytes, 2) == 1
+    assert align_to_char_start(text_bytes, 1) == 1
+    assert align_to_char_start(text_bytes, len(text_bytes)) == len(text_bytes)
@@ -0,0 +1,46 @@
+import io
+import os
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("langchain_community")
+from src.main import finish_chunk_assembly, write_chunk_at_offset
+
+CHUNK_SIZE = 1024
+
+
+def upload_parts(content, part_numbers, chunk_dir):
+    total_chunks = (len(content) + CHUNK_SIZE - 1) // CHUNK_SIZE
+    end_offset = None
+    for chunk_number in part_numbers:
+        part = content[(chunk_number - 1) * CHUNK_SIZE:chunk_number * CHUNK_SIZE]
+        end_offset = write_chunk_at_offset(SimpleNamespace(file=io.BytesIO(part)), chunk_number, total_chunks, CHUNK_SIZE, "file.pdf", chunk_dir)
+    return total_chunks, end_offset
+
+
+def test_parts_are_assembled_in_place(tmp_path, monkeypatch):
+    monkeypatch.setenv("UPLOAD_COPY_BLOCK_SIZE", "100")
+    content = os.urandom(5 * CHUNK_SIZE + 300)
+    chunk_dir, merged_dir = str(tmp_path / "chunks"), str(tmp_path / "merged")
+    total_chunks, end_offset = upload_parts(content, [1, 3, 2, 4, 5, 6], chunk_dir)
+    assert end_offset == len(content)
+    assert finish_chunk_assembly("file.pdf", total_chunks, end_offset, chunk_dir, merged_dir) == len(content)
+    with open(os.path.join(merged_dir, "file.pdf"), "rb") as merged_file:
+        assert merged_file.read() == content
+    assert os.listdir(chunk_dir) == []
+
+def test_missing_parts_are_detected(tmp_path):
+    content = os.urandom(3 * CHUNK_SIZE)
+    chunk_dir, merged_dir = str(tmp_path / "chunks"), str(tmp_path / "merged")
+    total_chunks, end_offset = upload_parts(content, [1, 3], chunk_dir)
+    with pytest.raises(Exception, match=r"\[2\]"):
+        finish_chunk_assembly("file.pdf", total_chunks, end_offset, chunk_dir, merged_dir)
+
+def test_first_part_discards_an_earlier_failed_upload(tmp_path):
+    chunk_dir, merged_dir = str(tmp_path / "chunks"), str(tmp_path / "merged")
+    upload_parts(os.urandom(3 * CHUNK_SIZE), [1, 2], chunk_dir)
+    content = os.urandom(2 * CHUNK_SIZE)
+    total_chunks, end_offset = upload_parts(content, [1, 2], chunk_dir)
+    finish_chunk_assembly("file.pdf", total_chunks, end_offset, chunk_dir, merged_dir)
+    with open(os.path.join(merged_dir, "file.pdf"), "rb") as merged_file:
+        assert merged_file.read() == content
@@ -2,6 +2,7 @@ import { Method } from 'axios';
 import { url } from './Utils';
 import { UserCredentials, ExtractParams, UploadParams } from '../types';
 import { apiCall } from '../services/CommonAPI';
+import { chunkSize } from './Constants';
 
 // Upload Call
 export const uploadAPI = async (
@@ -15,7 +16,8 @@ export const uploadAPI = async (
   const urlUpload = `${url()}/upload`;
   const method: Method = 'post';
   const commonParams: UserCredentials = userCredentials;
-  const additionalParams: UploadParams = { file, model, chunkNumber, totalChunks, originalname };
+  // chunkSize lets the backend write every chunk at its offset in the assembled file
+  const additionalParams: UploadParams = { file, model, chunkNumber, totalChunks, originalname, chunkSize };
   const response = await apiCall(urlUpload, method, commonParams, additionalParams);
   return response;
 };